@@ -0,0 +1,27 @@
+import sys  
+sys.path.append("./src")
+
+from gym_trading_env.downloader import benchmark
+from gym_trading_env.utils.fake_exchange import FakeExchange
+import datetime
+
+# 在本地模拟交易所上测量下载速度（不需要访问真实的交易所），用于调整EXCHANGE_LIMIT_RATES和发现性能退化。
+scenarios = {
+    # 名称: (模拟交易所的参数, 下载的参数)
+    "latency 50ms" : (dict(latency = 0.05, latency_jitter = 0.02, seed = 0), dict(pause_every = 20, pause = 1)),
+    "strict rate limit" : (dict(latency = 0.05, rate_limit = 10, burst = 10, seed = 0), dict(pause_every = 20, pause = 1, retry_delay = 0.1)),
+    "5% errors" : (dict(latency = 0.05, error_rate = 0.05, seed = 0), dict(pause_every = 20, pause = 1, retry_delay = 0.1)),
+    "max 5 in flight" : (dict(latency = 0.05, seed = 0), dict(pause_every = 20, pause = 1, max_in_flight = 5)),
+}
+for name, (exchange_params, download_params) in scenarios.items():
+    report = benchmark(
+        FakeExchange(**exchange_params),
+        symbols= ["BTC/USDT", "ETH/USDT", "SOL/USDT"],
+        timeframe= "1m",
+        since= datetime.datetime(year= 2023, month= 1, day= 1),
+        until= datetime.datetime(year= 2023, month= 2, day= 1),
+        **download_params
+    )
+    print(f"{name:>20} : {report['candles_per_second']:10.0f} candles/s, {report['requests']} requests ({report['retries']} retries), "
+          f"in flight : max {report['max_in_flight']} mean {report['mean_in_flight']:.1f}, rate limiter wait : {report['rate_limit_wait']:.2f}s, "
+          f"request : {report['request_time']:.2f}s, parse : {report['parse_time']:.2f}s")
@@ -2,6 +2,9 @@ from gymnasium.envs.registration import register
 
 # 注册 'TradingEnv' 环境
 # 注册 'MultiDatasetTradingEnv' 环境
+# 注册 'MultiAssetTradingEnv' 多资产环境
+# 注册 'StreamingTradingEnv' 流式数据环境
+# 注册 'VectorTradingEnv' 向量化环境（通过 gym.make_vec 创建）
 register(
     id='TradingEnv',
     entry_point='gym_trading_env.environments:TradingEnv',
@@ -14,4 +17,19 @@ register(
     disable_env_checker = True,
     order_enforce= False
 )
- 
\ No newline at end of file
+register(
+    id='MultiAssetTradingEnv',
+    entry_point='gym_trading_env.environments:MultiAssetTradingEnv',
+    disable_env_checker = True,
+    order_enforce= False
+)
+register(
+    id='StreamingTradingEnv',
+    entry_point='gym_trading_env.environments:StreamingTradingEnv',
+    disable_env_checker = True,
+    order_enforce= False
+)
+register(
+    id='VectorTradingEnv',
+    vector_entry_point='gym_trading_env.environments:VectorTradingEnv',
+)
@@ -2,8 +2,12 @@ import asyncio
 import ccxt.async_support as ccxt
 import pandas as pd
 import datetime
+import time
+import tempfile
+import itertools
 import numpy as np
 import nest_asyncio
+from .utils.ohlcv_store import OHLCVStore
 nest_asyncio.apply()
 import sys 
 if sys.platform == 'win32':
@@ -14,6 +18,8 @@ EXCHANGE_LIMIT_RATES = {
     # limit: 每批次请求的数据量
     # pause_every: 每隔多少批次暂停一次
     # pause: 暂停时长（秒）
+    # 调度器据此为每个交易所创建令牌桶：平均每pause秒pause_every个请求，最多连续pause_every个请求。
+    # 可选的max_in_flight: 同时进行的最大请求数（默认为pause_every）。
     "bitfinex2": {
         "limit":10_000,
         "pause_every": 1,
@@ -31,6 +37,125 @@ EXCHANGE_LIMIT_RATES = {
     }
 }
 
+# 可以重试的瞬时错误（网络错误、超时、交易所暂时不可用、触发限速...）。
+TRANSIENT_ERRORS = (ccxt.NetworkError, asyncio.TimeoutError)
+
+class TokenBucket:
+    # 令牌桶限速器：平均每秒rate个请求，最多连续burst个请求。
+    # wait_time: 因限速而等待的总时间（秒）。
+    def __init__(self, rate, burst = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.wait_time = 0
+
+    async def acquire(self):
+        # 取出一个令牌（没有令牌时等待）。按调用顺序依次获得令牌。
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+                self.wait_time += delay
+                await asyncio.sleep(delay)
+
+class ExchangeClient:
+    """
+    Request scheduler of one exchange, used by the downloader: all the requests to the exchange (from every symbol downloaded concurrently) share
+    a token-bucket rate limiter and a cap on the number of in-flight requests, and transient errors (network errors, timeouts, rate limit exceeded...) are retried with exponential backoff.
+
+    :param exchange: A ccxt async exchange, or any object with the same ``fetch_ohlcv`` and ``close`` coroutines (for example a local fake exchange).
+    :type exchange: ccxt.async_support.Exchange
+
+    :param rate: Average number of requests per second.
+    :type rate: float
+
+    :param burst: Maximum number of requests sent at once when the limiter is idle.
+    :type burst: optional - int
+
+    :param max_in_flight: Maximum number of concurrent requests.
+    :type max_in_flight: optional - int
+
+    :param max_retries: Number of retries of a request after a transient error.
+    :type max_retries: optional - int
+
+    :param retry_delay: Delay before the first retry (seconds), doubled after each retry.
+    :type retry_delay: optional - float
+    """
+    def __init__(self, exchange, rate, burst = 1, max_in_flight = 10, max_retries = 5, retry_delay = 1):
+        self.exchange = exchange
+        self.rate_limiter = TokenBucket(rate, burst)
+        self.max_in_flight = max_in_flight
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        # 统计：请求数、重试次数、收到的K线数、同时进行的最大请求数、
+        # 请求的累计时间（网络）和解析结果的累计时间（秒，包括在线程池中排队的时间）。
+        self.nb_requests = 0
+        self.nb_candles = 0
+        self.nb_retries = 0
+        self.in_flight = 0
+        self.max_observed_in_flight = 0
+        self.request_time = 0
+        self.parse_time = 0
+
+    @classmethod
+    def from_limit_rates(cls, exchange, limit_rates, **kwargs):
+        # 根据EXCHANGE_LIMIT_RATES中的配置创建调度器。
+        kwargs.setdefault("max_in_flight", limit_rates.get("max_in_flight", limit_rates["pause_every"]))
+        return cls(exchange, rate = limit_rates["pause_every"] / limit_rates["pause"], burst = limit_rates["pause_every"], **kwargs)
+
+    async def fetch_ohlcv(self, **kwargs):
+        # 与ccxt的fetch_ohlcv相同，但经过限速，并在瞬时错误时退避重试。
+        for attempt in range(self.max_retries + 1):
+            async with self._semaphore:
+                await self.rate_limiter.acquire()
+                self.nb_requests += 1
+                self.in_flight += 1
+                self.max_observed_in_flight = max(self.max_observed_in_flight, self.in_flight)
+                start = time.perf_counter()
+                try:
+                    return await self.exchange.fetch_ohlcv(**kwargs)
+                except TRANSIENT_ERRORS:
+                    if attempt == self.max_retries: raise
+                finally:
+                    self.in_flight -= 1
+                    self.request_time += time.perf_counter() - start
+            self.nb_retries += 1
+            await asyncio.sleep(self.retry_delay * 2**attempt)
+
+    async def close(self):
+        await self.exchange.close()
+
+OHLCV_COLUMNS = ["open", "high", "low", "close", "volume"]
+
+def _parse_ohlcv(result, timedelta):
+    # 将ccxt返回的K线列表（[[时间戳, 开, 高, 低, 收, 量], ...]）一次性转换到预先分配的float64数组中
+    # （不需要先构建object类型的DataFrame，再逐列调用pd.to_numeric和pd.to_datetime）。
+    # 数组按列存放（6 x n），每列直接作为DataFrame的一列。
+    widths = set(map(len, result))
+    if len(widths) > 0 and min(widths) < 6:
+        raise ValueError(f"Each OHLCV row must contain at least 6 fields [timestamp, open, high, low, close, volume], got a row with {min(widths)} fields.")
+    # 某些交易所在每行末尾返回额外的字段：只保留前6个。
+    rows = result if widths <= {6} else (row[:6] for row in result)
+    values = np.fromiter(itertools.chain.from_iterable(rows), dtype= np.float64, count= 6 * len(result))
+    values = np.ascontiguousarray(values.reshape(-1, 6).T)
+    timestamps = values[0].astype(np.int64)
+    columns = {"timestamp_open" : timestamps}
+    for i, col in enumerate(OHLCV_COLUMNS):
+        columns[col] = values[i + 1]
+    # 日期列保存为datetime64[ns]（与pandas 2.x中pd.to_datetime(unit= "ms")的结果和已经保存的数据集一致），
+    # 否则pandas 2.x会保留datetime64[ms]的精度，改变数据集索引的类型。
+    columns["date_open"] = timestamps.astype("datetime64[ms]").astype("datetime64[ns]")
+    columns["date_close"] = (timestamps + timedelta).astype("datetime64[ms]").astype("datetime64[ns]")
+    return pd.DataFrame(columns)
+
 async def _ohlcv(exchange, symbol, timeframe, limit, step_since, timedelta):
     # 异步获取OHLCV（开盘价、最高价、最低价、收盘价、交易量）数据。
     # exchange: 交易所对象。
@@ -40,17 +165,17 @@ async def _ohlcv(exchange, symbol, timeframe, limit, step_since, timedelta):
     # step_since: 开始时间戳。
     # timedelta: 时间周期对应的毫秒数。
     result = await exchange.fetch_ohlcv(symbol = symbol, timeframe= timeframe, limit= limit, since=step_since)
-    result_df = pd.DataFrame(result, columns=["timestamp_open", "open", "high", "low", "close", "volume"])
-    for col in ["open", "high", "low", "close", "volume"]:
-        result_df[col] = pd.to_numeric(result_df[col])
-    result_df["date_open"] = pd.to_datetime(result_df["timestamp_open"], unit= "ms")
-    result_df["date_close"] = pd.to_datetime(result_df["timestamp_open"] + timedelta, unit= "ms")
-
+    # 解析在线程池中进行，不阻塞事件循环（其他请求可以同时进行）。
+    start = time.perf_counter()
+    result_df = await asyncio.get_running_loop().run_in_executor(None, _parse_ohlcv, result, timedelta)
+    if isinstance(exchange, ExchangeClient):
+        exchange.parse_time += time.perf_counter() - start
+        exchange.nb_candles += len(result_df)
     return result_df
 
-async def _download_symbol(exchange, symbol, timeframe = '5m', since = int(datetime.datetime(year=2020, month= 1, day= 1).timestamp()*1E3), until = int(datetime.datetime.now().timestamp()*1E3), limit = 1000, pause_every = 10, pause = 1):
-    # 异步下载单个交易对的历史数据。
-    # exchange: 交易所对象。
+async def _download_symbol(exchange, symbol, timeframe = '5m', since = int(datetime.datetime(year=2020, month= 1, day= 1).timestamp()*1E3), until = int(datetime.datetime.now().timestamp()*1E3), limit = 1000, pause_every = 10, pause = 1, flush_size = 100_000):
+    # 异步下载单个交易对的历史数据，返回DataFrame。
+    # exchange: 交易所的请求调度器（ExchangeClient）。也可以是ccxt交易所对象，此时按pause_every和pause限速。
     # symbol: 交易对符号。
     # timeframe: 时间周期。
     # since: 开始时间戳（毫秒）。
@@ -58,19 +183,21 @@ async def _download_symbol(exchange, symbol, timeframe = '5m', since = int(datet
     # limit: 每次请求的数据量限制。
     # pause_every: 每隔多少批次暂停一次。
     # pause: 暂停时长（秒）。
-    timedelta = int(pd.Timedelta(timeframe).to_timedelta64()/1E6)
-    tasks = []
-    results = []
-    for step_since in range(since, until, limit * timedelta):
-        tasks.append(
-            asyncio.create_task(_ohlcv(exchange, symbol, timeframe, limit, step_since, timedelta))
+    # flush_size: 见_download_symbol_incremental。
+    # 下载过程与增量下载相同（同时进行的请求数有限，K线每累积flush_size根就写入临时的OHLCVStore），
+    # 因此下载时的内存占用与历史长度无关，只有最后读取的DataFrame包含整个历史。
+    timedelta = int(pd.Timedelta(timeframe).total_seconds()*1E3)
+    with tempfile.TemporaryDirectory() as directory:
+        store = OHLCVStore(directory)
+        await _download_symbol_incremental(
+            exchange, symbol, store, timeframe= timeframe, since= since, until= until,
+            limit= limit, pause_every= pause_every, pause= pause, flush_size= flush_size,
         )
-        if len(tasks) >= pause_every:
-            results.extend(await asyncio.gather(*tasks))
-            await asyncio.sleep(pause)
-            tasks = []
-    if len(tasks) > 0 :
-        results.extend(await asyncio.gather(*tasks))
+        if len(store) == 0: return _format_ohlcv([_parse_ohlcv([], timedelta)], since, until)
+        return store.read()
+
+def _format_ohlcv(results, since, until):
+    # 合并请求的结果：只保留 since < 开盘时间 < until 的K线，以开盘时间为索引，排序并去重。
     final_df = pd.concat(results, ignore_index= True)
     final_df = final_df.loc[(since < final_df["timestamp_open"]) & (final_df["timestamp_open"] < until), :]
     del final_df["timestamp_open"]
@@ -80,40 +207,127 @@ async def _download_symbol(exchange, symbol, timeframe = '5m', since = int(datet
     final_df.drop_duplicates(inplace=True)
     return final_df
 
-async def _download_symbols(exchange_name, symbols, dir, timeframe,  **kwargs):
-    # 异步下载多个交易对的历史数据。
+async def _download_symbol_incremental(exchange, symbol, store, timeframe = '5m', since = int(datetime.datetime(year=2020, month= 1, day= 1).timestamp()*1E3), until = int(datetime.datetime.now().timestamp()*1E3), limit = 1000, pause_every = 10, pause = 1, flush_size = 100_000):
+    # 增量下载单个交易对：只请求store（OHLCVStore）中缺失的K线（末尾的新K线和中间的空洞）。
+    # 结果在到达时就写入store（每累积flush_size根K线合并一次到对应的月份分区），内存占用与历史长度无关，
+    # 下载中断时已写入的K线也会保留，下次只需下载剩余的部分。
+    # 返回新写入的K线数量。其他参数与_download_symbol相同。
+    if not isinstance(exchange, ExchangeClient):
+        exchange = ExchangeClient.from_limit_rates(exchange, {"pause_every": pause_every, "pause": pause})
+    timedelta = int(pd.Timedelta(timeframe).total_seconds()*1E3)
+    # 只保存已收盘的K线，否则当前未收盘的K线会被当作完整的K线保存，之后不再更新。
+    until = min(until, int(time.time()*1E3) - timedelta + 1)
+    # 与_download_symbol保持一致：since之后（不含since）、until之前的K线。
+    ranges = store.missing_ranges(since + 1, until, timedelta)
+    # 请求按时间顺序提交，同时最多有2 * max_in_flight个未处理的请求（已到达但未写入的结果也是有限的）。
+    steps = (
+        (step_since, min(limit, -(-(stop - step_since) // timedelta)))
+        for first, stop in ranges
+        for step_since in range(first, stop, limit * timedelta)
+    )
+    window = 2 * exchange.max_in_flight
+    # covered: 已得到交易所回答的区间（与buffer中的K线一起写入store），交易所没有K线的区间下次不会再请求。
+    nb_candles, buffer, covered, pending, done = 0, [], [], {}, set()
+    try:
+        while True:
+            for step_since, step_limit in itertools.islice(steps, window - len(pending)):
+                request = asyncio.ensure_future(_ohlcv(exchange, symbol, timeframe, step_limit, step_since, timedelta))
+                pending[request] = (step_since, step_since + step_limit * timedelta)
+            if len(pending) == 0: break
+            done, _ = await asyncio.wait(pending, return_when= asyncio.FIRST_COMPLETED)
+            # 先保存成功的请求的结果，再抛出失败的请求的错误。
+            for request in done:
+                step_range = pending.pop(request)
+                if request.exception() is not None: continue
+                result_df = request.result()
+                buffer.append(_format_ohlcv([result_df], since, until))
+                # 交易所返回的K线可能少于请求的数量（例如每次请求的上限更小）：只有最后一根K线之前的部分算作已覆盖。
+                stop = step_range[1] if len(result_df) == 0 else min(step_range[1], int(result_df["timestamp_open"].max()) + timedelta)
+                if stop > step_range[0]: covered.append((step_range[0], stop))
+            for request in done: request.result()
+            if sum(len(batch) for batch in buffer) >= flush_size:
+                store.write(pd.concat(buffer), covered= covered)
+                nb_candles += sum(len(batch) for batch in buffer)
+                buffer, covered = [], []
+    finally:
+        # 某个请求失败时，取消其他请求，但保存已经下载的K线。
+        for request in pending: request.cancel()
+        await asyncio.gather(*pending, *done, return_exceptions= True)
+        if len(buffer) > 0 or len(covered) > 0:
+            store.write(pd.concat(buffer) if len(buffer) > 0 else pd.DataFrame(), covered= covered)
+            nb_candles += sum(len(batch) for batch in buffer)
+    return nb_candles
+
+async def _download_and_save_symbol(exchange_name, exchange, symbol, dir, timeframe, incremental = False, **kwargs):
+    # 下载一个交易对并保存。失败时打印错误并返回None（不影响其他交易对）。
+    # incremental: 为True时保存为OHLCVStore目录（边下载边写入），并且只下载其中缺失的K线。
+    save_file = f"{dir}/{exchange_name}-{symbol.replace('/', '')}-{timeframe}"
+    try:
+        if incremental:
+            store = OHLCVStore(save_file)
+            nb_candles = await _download_symbol_incremental(exchange = exchange, symbol = symbol, store = store, timeframe= timeframe, **kwargs)
+        else:
+            df = await _download_symbol(exchange = exchange, symbol = symbol, timeframe= timeframe, **kwargs)
+    except Exception as e:
+        print(f"{symbol} could not be downloaded from {exchange_name} : {e!r}")
+        return None
+    if incremental:
+        print(f"{symbol} updated from {exchange_name} : {nb_candles} new candles stored at {save_file}")
+        return save_file
+    save_file += ".pkl"
+    print(f"{symbol} downloaded from {exchange_name} and stored at {save_file}")
+    df.to_pickle(save_file)
+    return save_file
+
+async def _download_symbols(exchange_name, symbols, dir, timeframe, exchange = None, max_in_flight = None, max_retries = 5, retry_delay = 1, **kwargs):
+    # 异步下载多个交易对的历史数据（所有交易对同时下载，共享交易所的请求调度器）。
     # exchange_name: 交易所名称。
     # symbols: 交易对列表。
     # dir: 保存数据的目录。
     # timeframe: 时间周期。
-    # kwargs: 其他参数，如limit, pause_every, pause, since, until。
-    exchange = getattr(ccxt, exchange_name)({ 'enableRateLimit': True })
-    for symbol in symbols:
-        df = await _download_symbol(exchange = exchange, symbol = symbol, timeframe= timeframe, **kwargs)
-        save_file = f"{dir}/{exchange_name}-{symbol.replace('/', '')}-{timeframe}.pkl"
-        print(f"{symbol} downloaded from {exchange_name} and stored at {save_file}")
-        df.to_pickle(save_file)
-    await exchange.close()
-
-async def _download(exchange_names, symbols, timeframe, dir, since : datetime.datetime, until : datetime.datetime = datetime.datetime.now()):
-    # 异步下载指定交易所和交易对的历史数据。
+    # exchange: 可选的交易所对象（默认根据名称创建ccxt交易所），例如本地的模拟交易所；也可以是已创建的ExchangeClient。
+    # max_in_flight, max_retries, retry_delay: 见ExchangeClient。
+    # kwargs: 其他参数，如limit, pause_every, pause, since, until, incremental。
+    if exchange is None: exchange = getattr(ccxt, exchange_name)({ 'enableRateLimit': True })
+    if isinstance(exchange, ExchangeClient):
+        client = exchange
+    else:
+        limit_rates = {"pause_every": kwargs.get("pause_every", 10), "pause": kwargs.get("pause", 1)}
+        if max_in_flight is not None: limit_rates["max_in_flight"] = max_in_flight
+        client = ExchangeClient.from_limit_rates(exchange, limit_rates, max_retries= max_retries, retry_delay= retry_delay)
+    try:
+        return await asyncio.gather(*[
+            _download_and_save_symbol(exchange_name, client, symbol, dir, timeframe, **kwargs)
+            for symbol in symbols
+        ])
+    finally:
+        await client.close()
+
+async def _download(exchange_names, symbols, timeframe, dir, since : datetime.datetime, until : datetime.datetime = datetime.datetime.now(), exchanges = None, **kwargs):
+    # 异步下载指定交易所和交易对的历史数据。所有（交易所, 交易对）同时下载，每个交易所有自己的限速器。
     # exchange_names: 交易所名称列表。
     # symbols: 交易对列表。
     # timeframe: 时间周期。
     # dir: 保存数据的目录。
     # since: 开始日期时间。
     # until: 结束日期时间。
+    # exchanges: 可选字典，交易所名称 -> 交易所对象（例如本地的模拟交易所），默认创建ccxt交易所。
+    # kwargs: 传递给_download_symbols的参数（max_in_flight, max_retries, retry_delay, incremental）。
     tasks = []
     for exchange_name in exchange_names:
         
         limit = EXCHANGE_LIMIT_RATES[exchange_name]["limit"]
         pause_every = EXCHANGE_LIMIT_RATES[exchange_name]["pause_every"]
         pause = EXCHANGE_LIMIT_RATES[exchange_name]["pause"]
+        options = dict(kwargs)
+        options.setdefault("max_in_flight", EXCHANGE_LIMIT_RATES[exchange_name].get("max_in_flight"))
         tasks.append(
             _download_symbols(
                 exchange_name = exchange_name, symbols= symbols, timeframe= timeframe, dir = dir,
+                exchange = None if exchanges is None else exchanges.get(exchange_name),
                 limit = limit, pause_every = pause_every, pause = pause,
-                since = int(since.timestamp()*1E3), until = int(until.timestamp()*1E3)
+                since = int(since.timestamp()*1E3), until = int(until.timestamp()*1E3),
+                **options
             )
         )
     await asyncio.gather(*tasks)
@@ -125,6 +339,47 @@ def download(*args, **kwargs):
         _download(*args, **kwargs)
     )
 
+def benchmark(exchange, symbols = ["BTC/USDT"], timeframe = "1m", since = datetime.datetime(year= 2023, month= 1, day= 1), until = datetime.datetime(year= 2023, month= 2, day= 1),
+        limit = 1000, pause_every = 10, pause = 1, max_in_flight = None, max_retries = 5, retry_delay = 1, incremental = False):
+    """
+    Download ``symbols`` from ``exchange`` (for example a local :class:`gym_trading_env.utils.fake_exchange.FakeExchange`) into a temporary directory, and report the throughput of the downloader.
+    ``limit``, ``pause_every``, ``pause`` and ``max_in_flight`` are the settings of ``EXCHANGE_LIMIT_RATES`` to evaluate, the other parameters are the same as ``download``.
+
+    .. code-block:: python
+
+        from gym_trading_env.downloader import benchmark
+        from gym_trading_env.utils.fake_exchange import FakeExchange
+
+        report = benchmark(FakeExchange(latency = 0.1, rate_limit = 20, burst = 20), symbols = ["BTC/USDT", "ETH/USDT"], pause_every = 20, pause = 1)
+
+    :return: A dict with the number of ``candles``, the ``elapsed`` time (seconds), ``candles_per_second``, the number of ``requests`` and ``retries``,
+        the maximum (``max_in_flight``) and average (``mean_in_flight``) number of concurrent requests, the time spent waiting for the rate limiter (``rate_limit_wait``),
+        and the cumulated request (``request_time``) and parsing (``parse_time``) times.
+    """
+    limit_rates = {"pause_every": pause_every, "pause": pause}
+    if max_in_flight is not None: limit_rates["max_in_flight"] = max_in_flight
+    client = ExchangeClient.from_limit_rates(exchange, limit_rates, max_retries= max_retries, retry_delay= retry_delay)
+    with tempfile.TemporaryDirectory() as dir:
+        start = time.perf_counter()
+        asyncio.run(_download_symbols(
+            exchange_name = "benchmark", symbols = symbols, dir = dir, timeframe = timeframe, exchange = client,
+            limit = limit, pause_every = pause_every, pause = pause, incremental = incremental,
+            since = int(since.timestamp()*1E3), until = int(until.timestamp()*1E3),
+        ))
+        elapsed = time.perf_counter() - start
+    return {
+        "candles": client.nb_candles,
+        "elapsed": elapsed,
+        "candles_per_second": client.nb_candles / elapsed,
+        "requests": client.nb_requests,
+        "retries": client.nb_retries,
+        "max_in_flight": client.max_observed_in_flight,
+        "mean_in_flight": client.request_time / elapsed,
+        "rate_limit_wait": client.rate_limiter.wait_time,
+        "request_time": client.request_time,
+        "parse_time": client.parse_time,
+    }
+
 async def main():
     # 主函数，用于示例下载数据。
     await _download(
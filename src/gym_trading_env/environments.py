@@ -1,19 +1,35 @@
 import gymnasium as gym
 from gymnasium import spaces
+from gymnasium.utils import seeding
+from gymnasium.vector import AutoresetMode
 import pandas as pd
 import numpy as np
 import datetime
 import glob
+import time
+import queue
 from pathlib import Path    
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from collections import Counter
 from .utils.history import History
-from .utils.portfolio import Portfolio, TargetPortfolio
+from .utils.portfolio import Portfolio, TargetPortfolio, PortfolioArray, TargetMultiAssetPortfolio, simulate_positions
+from .utils.market_data import MarketData, MemmapMarketData, is_memmap_dataset, features_array, info_array, info_records
+from .utils.ohlcv_store import read_dataset
+from .utils.preprocess_cache import PreprocessCache
+from .utils.incremental import IncrementalFunction
+from .utils.dynamic_features import PortfolioFeatures, PortfolioFeaturesArray
+from .utils.orders import OrderBook, PriceIndex, NO_EXPIRY, LIMIT, STOP_UP, STOP_DOWN
+from .utils.stream import END_OF_FEED, GrowableArray, bars_to_dataframe, bars_to_columns
 
 import tempfile, os
 import warnings
 warnings.filterwarnings("error")
 
+# History中没有动作（没有选择头寸）的步的position_index。
+NO_POSITION_INDEX = -1
+
 def basic_reward_function(history : History):
     # 基本奖励函数：计算投资组合估值的对数收益。
     return np.log(history["portfolio_valuation", -1] / history["portfolio_valuation", -2])
@@ -26,7 +42,81 @@ def dynamic_feature_real_position(history):
     # 动态特征函数：返回当前实际头寸。
     return history['real_position', -1]
 
-class TradingEnv(gym.Env):
+# 默认动态特征函数对应的内置特征：环境直接从投资组合状态维护它们，不再每步读取History。
+BUILTIN_DYNAMIC_FEATURES = {
+    dynamic_feature_last_position_taken : "last_position",
+    dynamic_feature_real_position : "real_position",
+}
+
+def split_dynamic_features(dynamic_feature_functions):
+    # 将动态特征分为内置特征（名称字符串或默认函数）和其他函数。
+    # 返回：内置特征名称及其在动态特征中的位置、其他函数的位置。
+    builtin_names, builtin_indexes, function_indexes = [], [], []
+    for i, dynamic_feature_function in enumerate(dynamic_feature_functions):
+        if isinstance(dynamic_feature_function, str):
+            builtin_names.append(dynamic_feature_function)
+            builtin_indexes.append(i)
+        elif not isinstance(dynamic_feature_function, IncrementalFunction) and dynamic_feature_function in BUILTIN_DYNAMIC_FEATURES:
+            builtin_names.append(BUILTIN_DYNAMIC_FEATURES[dynamic_feature_function])
+            builtin_indexes.append(i)
+        else:
+            function_indexes.append(i)
+    return builtin_names, builtin_indexes, function_indexes
+
+class BaseTradingEnv(gym.Env):
+    # TradingEnv和MultiAssetTradingEnv共享的部分：指标、日志、渲染和IncrementalFunction的重置。
+    # 子类需要设置reward_function、dynamic_feature_functions、_dynamic_feature_functions_indexes、verbose和log_metrics，
+    # 并在reset中创建historical_info。
+    """
+    Base class of TradingEnv and MultiAssetTradingEnv: metrics, logs and the reset of the IncrementalFunction objects.
+    Subclasses define how the "Market Return" metric is computed with ``_market_return``.
+    """
+    metadata = {'render_modes': ['logs']}
+
+    def _reset_incremental_functions(self):
+        # 为IncrementalFunction类型的奖励函数和动态特征函数预先解析所需的列，并用第一行重置它们的状态。
+        # 普通函数对应的读取器为None（仍然接收整个History）。
+        self._reward_reader = None
+        if isinstance(self.reward_function, IncrementalFunction):
+            self._reward_reader = self.historical_info.row_reader(self.reward_function.columns)
+            self.reward_function.reset(self._reward_reader())
+        self._dynamic_feature_readers = []
+        for i in self._dynamic_feature_functions_indexes:
+            dynamic_feature_function, reader = self.dynamic_feature_functions[i], None
+            if isinstance(dynamic_feature_function, IncrementalFunction):
+                reader = self.historical_info.row_reader(dynamic_feature_function.columns)
+                dynamic_feature_function.reset(reader())
+            self._dynamic_feature_readers.append(reader)
+
+    def render(self):
+        pass
+
+    def add_metric(self, name, function):
+        self.log_metrics.append({
+            'name': name,
+            'function': function
+        })
+    def _market_return(self):
+        # 市场收益（episode第一步到最后一步），由子类实现。
+        raise NotImplementedError
+    def calculate_metrics(self):
+        self.results_metrics = {
+            "Market Return" : f"{100*self._market_return():5.2f}%",
+            "Portfolio Return" : f"{100*(self.historical_info['portfolio_valuation', -1] / self.historical_info['portfolio_valuation', 0] -1):5.2f}%",
+        }
+
+        for metric in self.log_metrics:
+            self.results_metrics[metric['name']] = metric['function'](self.historical_info)
+    def get_metrics(self):
+        return self.results_metrics
+    def log(self):
+        if self.verbose > 0:
+            text = ""
+            for key, value in self.results_metrics.items():
+                text += f"{key} : {value}   |   "
+            print(text)
+
+class TradingEnv(BaseTradingEnv):
     # 交易环境类，用于OpenAI Gym。
     # 建议使用以下方式初始化：
     # import gymnasium as gym
@@ -42,8 +132,8 @@ class TradingEnv(gym.Env):
         env = gym.make('TradingEnv', ...)
 
 
-    :param df: 市场DataFrame。必须包含'open'、'high'、'low'、'close'列。索引必须是DatetimeIndex。您希望作为输入的列名中需要包含'feature'：这样，它们将在每个步骤中作为观察值返回。
-    :type df: pandas.DataFrame
+    :param df: 市场DataFrame。必须包含'open'、'high'、'low'、'close'列。索引必须是DatetimeIndex。您希望作为输入的列名中需要包含'feature'：这样，它们将在每个步骤中作为观察值返回。也可以传入一个MarketData对象（例如SharedMarketData，使多个进程中的环境共享同一份数据）。
+    :type df: pandas.DataFrame or gym_trading_env.utils.market_data.MarketData
 
     :param positions: 环境允许的头寸列表。
     :type positions: optional - list[int or float]
@@ -53,14 +143,19 @@ class TradingEnv(gym.Env):
         * 代理采取的最后一个头寸。
         * 投资组合的实际头寸（根据价格波动而变化）。
 
+        列表中也可以使用内置动态特征的名称： ``"last_position"``、``"real_position"``、``"unrealized_pnl"``、``"time_in_position"``、``"drawdown"``（见 ``gym_trading_env.utils.dynamic_features.PortfolioFeatures``）。内置特征（包括两个默认特征）直接从投资组合状态维护，不需要每步读取History。
+
     :type dynamic_feature_functions: optional - list   
 
-    :param reward_function: 接受环境的History对象并必须返回一个浮点数。
-    :type reward_function: optional - function<History->float>
+    :param reward_function: 接受环境的History对象并必须返回一个浮点数。也可以是一个IncrementalFunction对象：它声明需要的列，每步只接收最新的一行，并可以保存增量状态（见 ``gym_trading_env.utils.incremental``）。动态特征函数同样可以是IncrementalFunction对象。
+    :type reward_function: optional - function<History->float> or gym_trading_env.utils.incremental.IncrementalFunction
 
     :param windows: 默认为None。如果设置为整数N，则每个步骤的观察将返回过去N个观察。推荐用于基于循环神经网络的代理。
     :type windows: optional - None or int
 
+    :param copy_obs: 默认为False：每个步骤返回的观察是内部观察数组的只读视图（不复制数据）。注意：视图的内容在之后的episode中可能被动态特征覆盖。如果需要保存观察（例如放入自己的回放缓冲区且不复制），请设置为True，此时每个步骤返回一份独立的副本。
+    :type copy_obs: optional - bool
+
     :param trading_fees: 交易手续费（买入和卖出操作）。例如：0.01对应1%的手续费。
     :type trading_fees: optional - float
 
@@ -81,9 +176,23 @@ class TradingEnv(gym.Env):
     
     :param name: 环境的名称（例如：'BTC/USDT'）。
     :type name: optional - str
+
+    :param info_columns: 默认为None（所有不包含'feature'的列）。保存在info和History中的列（'close'总是被保留）。只保留需要的列可以减少内存占用。
+    :type info_columns: optional - list[str]
+
+    :param info_dtype: 默认为None：信息列保存为结构化数组，每列保留自己的类型（字符串列转换为定长unicode），而不是object数组。如果设置为numpy类型（例如np.float64，或object以保留原始的Python对象），信息列保存为该类型的二维数组。
+    :type info_dtype: optional - None or numpy.dtype
+
+    :param keep_df: 默认为True。如果为False，环境在构建数组后不保留对DataFrame的引用（``env.df`` 为None），DataFrame可以被释放。使用MarketData（例如内存映射数据集或预处理缓存）时，``env.df`` 在第一次访问时从数组重新构建。
+    :type keep_df: optional - bool
+
+    :param history_size: 默认为None：每个episode的History的容量为该episode的最大长度（``max_episode_duration`` 或数据集剩余的长度），而不是整个数据集的长度。如果设置为整数N，History为一个环形缓冲区，只保留最近的N步（适用于很长或无尽的episode）：指标根据保留的步计算。
+    :type history_size: optional - None or int
+
+    :param return_info: 默认为True：reset和step返回的info是History最新一行的惰性字典视图（只有在读取某个键时才取值）。如果设置为False（例如训练时不需要info），返回空字典。History仍然会被完整记录。
+    :type return_info: optional - bool
     
     """
-    metadata = {'render_modes': ['logs']}
     def __init__(self,
                 # 初始化交易环境。
                 df : pd.DataFrame,
@@ -91,6 +200,7 @@ class TradingEnv(gym.Env):
                 dynamic_feature_functions = [dynamic_feature_last_position_taken, dynamic_feature_real_position],
                 reward_function = basic_reward_function,
                 windows = None,
+                copy_obs = False,
                 trading_fees = 0,
                 borrow_interest_rate = 0,
                 portfolio_initial_value = 1000,
@@ -98,7 +208,12 @@ class TradingEnv(gym.Env):
                 max_episode_duration = 'max',
                 verbose = 1,
                 name = "Stock",
-                render_mode= "logs"
+                render_mode= "logs",
+                info_columns = None,
+                info_dtype = None,
+                keep_df = True,
+                history_size = None,
+                return_info = True,
                 ):
         self.max_episode_duration = max_episode_duration
         self.name = name
@@ -106,8 +221,19 @@ class TradingEnv(gym.Env):
 
         self.positions = positions
         self.dynamic_feature_functions = dynamic_feature_functions
+        portfolio_features_names, self._portfolio_features_indexes, self._dynamic_feature_functions_indexes = split_dynamic_features(dynamic_feature_functions)
+        self._portfolio_features = PortfolioFeatures(portfolio_features_names)
+        if self._portfolio_features_indexes == list(range(len(portfolio_features_names))):
+            # 内置特征位于动态特征的开头（默认情况）：使用切片写入。
+            self._portfolio_features_indexes = slice(0, len(portfolio_features_names))
         self.reward_function = reward_function
         self.windows = windows
+        self.copy_obs = copy_obs
+        self.info_columns = info_columns
+        self.info_dtype = info_dtype
+        self.keep_df = keep_df
+        self.history_size = history_size
+        self.return_info = return_info
         self.trading_fees = trading_fees
         self.borrow_interest_rate = borrow_interest_rate
         self.portfolio_initial_value = float(portfolio_initial_value)
@@ -134,49 +260,152 @@ class TradingEnv(gym.Env):
             )
         
         self.log_metrics = [] # 用于记录指标的列表。
+        self._history_dtypes = {
+            # 历史记录中数值列的类型（其余列根据初始值推断）。
+            # 没有动作的步（step()、快进）的position_index为NO_POSITION_INDEX。
+            "position_index": np.int64,
+            "real_position": np.float64,
+            "portfolio_valuation": np.float64,
+            "portfolio_distribution": np.float64,
+            "reward": np.float64,
+        }
 
 
-    def _set_df(self, df):
+    def _set_df(self, df, arrays = None):
         # 设置环境的DataFrame。
-        # df: 市场数据DataFrame。
-        df = df.copy()
-        self._features_columns = [col for col in df.columns if "feature" in col]
-        self._info_columns = list(set(list(df.columns) + ["close"]) - set(self._features_columns))
+        # df: 市场数据DataFrame（或MarketData对象）。
+        # arrays: 已经由_dataframe_arrays(df)构建的数组（例如在后台线程中构建），默认在这里构建。
+        if isinstance(df, MarketData):
+            self._set_market_data(df)
+            return
+        self._market_data = None
+        if arrays is None: arrays = self._dataframe_arrays(df)
+        for key, array in arrays.items():
+            setattr(self, key, array)
+        self._nb_static_features = len(self._features_columns)
+        self._features_columns.extend([f"dynamic_feature__{i}" for i in range(len(self.dynamic_feature_functions))])
         self._nb_features = len(self._features_columns)
-        self._nb_static_features = self._nb_features
+        # 动态特征列（_obs_array的视图）。
+        self._dynamic_obs_array = self._obs_array[:, self._nb_static_features:]
+        self._order_price_arrays = None
+        self._price_index = None
+        self.df = df if self.keep_df else None
 
-        for i  in range(len(self.dynamic_feature_functions)):
-            df[f"dynamic_feature__{i}"] = 0
-            self._features_columns.append(f"dynamic_feature__{i}")
-            self._nb_features += 1
+    @property
+    def df(self):
+        # 市场数据的DataFrame（keep_df为False时为None）。
+        # 使用MarketData时（例如内存映射数据集或预处理缓存），第一次访问时从数组重新构建。
+        if self._df is None and self.keep_df and self._market_data is not None:
+            self._df = self._market_data.to_dataframe()
+        return self._df
 
-        self.df = df
-        self._obs_array = np.array(self.df[self._features_columns], dtype= np.float32)
-        self._info_array = np.array(self.df[self._info_columns])
-        self._price_array = np.array(self.df["close"])
+    @df.setter
+    def df(self, df):
+        self._df = df
+
+    def _dataframe_arrays(self, df):
+        # 直接从源列构建环境使用的数组，不复制DataFrame，也不向其中添加列。
+        # 只读取环境的配置（不修改环境），因此可以在后台线程中调用。
+        features_columns = [col for col in df.columns if "feature" in col]
+        if self.info_columns is None:
+            info_columns = [col for col in df.columns if col not in features_columns]
+        else:
+            info_columns = list(self.info_columns) + ([] if "close" in self.info_columns else ["close"])
+        return {
+            "_features_columns": features_columns,
+            "_info_columns": info_columns,
+            # 静态特征后预留动态特征的列。
+            "_obs_array": features_array(df, features_columns, nb_extra_columns= len(self.dynamic_feature_functions)),
+            "_info_array": info_records(df, info_columns) if self.info_dtype is None else info_array(df, info_columns, self.info_dtype),
+            "_price_array": np.array(df["close"], dtype= np.float64),
+            "_dates_array": np.array(df.index.values),
+        }
+
+    def _set_market_data(self, market_data):
+        # 直接使用MarketData中的静态数组（例如共享内存中的只读数组），不复制数据。
+        # 动态特征保存在每个环境私有的数组中。
+        # info_columns和info_dtype与DataFrame相同（只选择需要的字段，结构化数组的字段视图不复制数据）。
+        self._market_data = market_data
+        self.df = None
+        self._features_columns = list(market_data.features_columns)
+        if self.info_columns is None:
+            self._info_columns = list(market_data.info_columns)
+        else:
+            self._info_columns = list(self.info_columns) + ([] if "close" in self.info_columns else ["close"])
+        self._nb_static_features = len(self._features_columns)
+        self._features_columns.extend([f"dynamic_feature__{i}" for i in range(len(self.dynamic_feature_functions))])
+        self._nb_features = len(self._features_columns)
+
+        self._obs_array = market_data.features
+        if self.info_dtype is not None:
+            self._info_array = info_array(market_data.info, self._info_columns, self.info_dtype, length= len(market_data))
+        elif self._info_columns == list(market_data.info_columns):
+            self._info_array = market_data.info
+        else:
+            self._info_array = market_data.info[self._info_columns]
+        self._price_array = market_data.price
+        self._dates_array = market_data.dates
+        self._dynamic_obs_array = np.zeros((len(market_data), len(self.dynamic_feature_functions)), dtype= np.float32)
+        self._order_price_arrays = None
+        self._price_index = None
+
+    def _get_info_column(self, column_index, idx):
+        # 获取某个信息列在idx处的值（兼容二维数组和MarketData的结构化数组）。
+        if self._info_array.dtype.names is not None:
+            return self._info_array[self._info_columns[column_index]][idx]
+        return self._info_array[idx, column_index]
 
 
     
     def _get_ticker(self, delta = 0):
         # 获取当前时间步的行情数据。
         # delta: 相对于当前索引的偏移量。
-        return self.df.iloc[self._idx + delta]
+        return dict(zip(self._info_columns, self._info_array[self._idx + delta]))
+
+    def _get_dataframe(self):
+        # 返回市场数据的DataFrame（如果没有保留DataFrame，则从数组重新构建，例如用于渲染）。
+        if self.df is not None:
+            return self.df
+        df = pd.DataFrame(
+            {column : self._get_info_column(i, slice(None)) for i, column in enumerate(self._info_columns)},
+            index = pd.DatetimeIndex(self._dates_array)
+        )
+        for i, column in enumerate(self._features_columns[:self._nb_static_features]):
+            df[column] = self._obs_array[:, i]
+        return df
     def _get_price(self, delta = 0):
         # 获取当前时间步的价格。
         # delta: 相对于当前索引的偏移量。
         return self._price_array[self._idx + delta]
     
+    def _update_dynamic_obs(self, incremental_only = False):
+        # 计算当前时间步的动态特征。
+        # 内置动态特征一次性写入，其他动态特征函数逐个调用（incremental_only为True时只调用IncrementalFunction，以更新它们的状态）。
+        if len(self._portfolio_features.names) > 0:
+            self._dynamic_obs_array[self._idx, self._portfolio_features_indexes] = self._portfolio_features.values
+        for i, reader in zip(self._dynamic_feature_functions_indexes, self._dynamic_feature_readers):
+            if incremental_only and reader is None: continue
+            self._dynamic_obs_array[self._idx, i] = self.dynamic_feature_functions[i](self.historical_info if reader is None else reader())
+
     def _get_obs(self):
         # 获取当前观察值。
-        # 根据动态特征函数更新观察数组。
-        for i, dynamic_feature_function in enumerate(self.dynamic_feature_functions):
-            self._obs_array[self._idx, self._nb_static_features + i] = dynamic_feature_function(self.historical_info)
+        self._update_dynamic_obs()
+        return self._observation()
 
+    def _observation(self):
+        # 使用基本切片：返回的是_obs_array的视图，不分配索引数组也不复制窗口。
         if self.windows is None:
-            _step_index = self._idx
-        else: 
-            _step_index = np.arange(self._idx + 1 - self.windows , self._idx + 1)
-        return self._obs_array[_step_index]
+            obs = self._obs_array[self._idx]
+        else:
+            obs = self._obs_array[self._idx + 1 - self.windows : self._idx + 1]
+        if self._market_data is not None and self._dynamic_obs_array.shape[1] > 0:
+            # 静态特征是共享的只读数组：需要与私有的动态特征拼接。
+            dynamic_obs = self._dynamic_obs_array[self._idx] if self.windows is None else self._dynamic_obs_array[self._idx + 1 - self.windows : self._idx + 1]
+            return np.concatenate([obs, dynamic_obs], axis= -1)
+        if self.copy_obs:
+            return obs.copy()
+        obs.flags.writeable = False
+        return obs
 
     
     def reset(self, seed = None, options=None, **kwargs):
@@ -188,17 +417,13 @@ class TradingEnv(gym.Env):
         
         self._step = 0 # 初始化步数为0。
         self._position = np.random.choice(self.positions) if self.initial_position == 'random' else self.initial_position # 设置初始头寸。
-        self._limit_orders = {} # 初始化限价订单。
+        self._orders = OrderBook() # 初始化订单簿（限价单和止损单）。
         
 
-        self._idx = 0 # 初始化当前索引为0。
-        if self.windows is not None: self._idx = self.windows - 1 # 如果设置了窗口，调整初始索引。
-        if self.max_episode_duration != 'max':
-            # 如果设置了最大episode持续时间，则随机选择起始索引。
-            self._idx = np.random.randint(
-                low = self._idx, 
-                high = len(self.df) - self.max_episode_duration - self._idx
-            )
+        self._idx = self._get_start_idx()
+        if self.windows is not None:
+            # episode开始之前的窗口行不属于本episode：清除之前episode留下的动态特征。
+            self._dynamic_obs_array[max(self._idx + 1 - self.windows, 0) : self._idx] = 0
         
         self._portfolio  = TargetPortfolio(
             # 初始化投资组合。
@@ -207,11 +432,17 @@ class TradingEnv(gym.Env):
             price = self._get_price()
         )
         
-        self.historical_info = History(max_size= len(self.df)) # 初始化历史信息记录器。
+        # 初始化历史信息记录器：容量为episode的最大长度，或history_size步的环形缓冲区。
+        if self.history_size is None:
+            history_size = len(self._price_array) - self._idx
+            if isinstance(self.max_episode_duration, int): history_size = min(history_size, self.max_episode_duration)
+            self.historical_info = History(max_size= history_size, dtypes= self._history_dtypes)
+        else:
+            self.historical_info = History(max_size= self.history_size, dtypes= self._history_dtypes, ring= True)
         self.historical_info.set(
             idx = self._idx,
             step = self._step,
-            date = self.df.index.values[self._idx],
+            date = self._dates_array[self._idx],
             position_index =self.positions.index(self._position),
             position = self._position,
             real_position = self._position,
@@ -220,11 +451,26 @@ class TradingEnv(gym.Env):
             portfolio_distribution = self._portfolio.get_portfolio_distribution(),
             reward = 0, # 初始奖励为0。
         )
+        self._portfolio_features.reset(position = self._position, real_position = self._position, valuation = self.portfolio_initial_value)
+        self._reset_incremental_functions()
 
-        return self._get_obs(), self.historical_info[0] # 返回初始观察值和历史信息。
+        return self._get_obs(), self._get_info() # 返回初始观察值和历史信息。
 
-    def render(self):
-        pass
+    def _get_start_idx(self):
+        # episode的起始索引。
+        idx = 0 # 初始化当前索引为0。
+        if self.windows is not None: idx = self.windows - 1 # 如果设置了窗口，调整初始索引。
+        if self.max_episode_duration != 'max':
+            # 如果设置了最大episode持续时间，则随机选择起始索引。
+            idx = np.random.randint(
+                low = idx, 
+                high = len(self._price_array) - self.max_episode_duration - idx
+            )
+        return idx
+
+    def _is_end_of_data(self):
+        # 当前索引是否为数据的最后一个时间步（episode被截断）。
+        return self._idx >= len(self._price_array) - 1
 
     def _trade(self, position, price = None):
         self._portfolio.trade_to_position(
@@ -239,21 +485,167 @@ class TradingEnv(gym.Env):
         if position != self._position:
             self._trade(position)
     
+    def _get_order_price_arrays(self):
+        # 订单使用的最高价、最低价和开盘价数组（第一次需要时从信息列中提取并缓存）。
+        if self._order_price_arrays is None:
+            assert "high" in self._info_columns and "low" in self._info_columns, "Your DataFrame needs to contain columns : high, low to use orders !"
+            arrays = {
+                column : np.array(self._get_info_column(self._info_columns.index(column), slice(None)), dtype= np.float64)
+                for column in ["high", "low", "open"] if column in self._info_columns
+            }
+            self._order_price_arrays = (arrays["high"], arrays["low"], arrays.get("open"))
+        return self._order_price_arrays
+
+    def _get_price_index(self):
+        # 最高价/最低价的分块索引（第一次需要时构建并缓存）。
+        if self._price_index is None:
+            high_array, low_array, _ = self._get_order_price_arrays()
+            self._price_index = PriceIndex(high_array, low_array)
+        return self._price_index
+
     def _take_action_order_limit(self):
-        if len(self._limit_orders) > 0:
-            ticker = self._get_ticker()
-            for position, params in self._limit_orders.items():
-                if position != self._position and params['limit'] <= ticker["high"] and params['limit'] >= ticker["low"]:
-                    self._trade(position, price= params['limit'])
-                    if not params['persistent']: del self._limit_orders[position]
+        # 检查当前时间步被触发的订单（一次向量化比较），并按添加顺序执行。
+        if len(self._orders) == 0: return
+        self._orders.expire(self._idx)
+        high_array, low_array, open_array = self._get_order_price_arrays()
+        for slot in self._orders.triggered(high_array[self._idx], low_array[self._idx]):
+            # 前一个订单成交后头寸可能已经改变：目标头寸与当前头寸相同的订单不执行（保留在订单簿中）。
+            position = self._orders.position[slot]
+            if position == self._position or not self._orders.active[slot]: continue
+            self._trade(position, price= self._orders.fill_price(slot, None if open_array is None else open_array[self._idx]))
+            self._orders.fill(slot)
 
+    def add_limit_order(self, position, limit, persistent = False, expiry = None):
+        """
+        Add a limit order : the portfolio trades to ``position`` at the ``limit`` price as soon as the price of a step touches it (``low <= limit <= high``).
+        Several orders can rest at the same time, but a new limit order replaces the resting limit order(s) with the same ``position`` (stop orders are kept). Orders are cleared at each reset.
 
-    
-    def add_limit_order(self, position, limit, persistent = False):
-        self._limit_orders[position] = {
-            'limit' : limit,
-            'persistent': persistent
-        }
+        :param position: Target position of the order.
+        :type position: float or int
+
+        :param limit: Limit price.
+        :type limit: float
+
+        :param persistent: If True, the order stays in the order book after being filled (it can be filled again later).
+        :type persistent: optional - bool
+
+        :param expiry: Number of steps after which the order is cancelled if it has not been filled. None (default) means no expiry.
+        :type expiry: optional - None or int
+
+        :return: The id of the order (see ``cancel_order``).
+        """
+        # 与之前的行为相同：同一头寸只保留最新的限价单。
+        self._orders.cancel_position(position, (LIMIT,))
+        return self._orders.add(position, limit, persistent = persistent, kind = LIMIT, expiry = self._order_expiry(expiry))
+
+    def add_stop_order(self, position, stop, persistent = False, expiry = None):
+        """
+        Add a stop order : the portfolio trades to ``position`` when the price reaches ``stop`` in the direction of the trade.
+        An order that increases the position (compared to the position when the order is added) triggers when ``high >= stop`` (buy stop), an order that decreases the position triggers when ``low <= stop`` (stop loss).
+        It is executed at the ``stop`` price, or at the open price if the price gapped over the stop price.
+        A new stop order replaces the resting stop order(s) with the same ``position`` (limit orders are kept).
+
+        Same parameters as ``add_limit_order``.
+
+        :return: The id of the order (see ``cancel_order``).
+        """
+        kind = STOP_UP if position > self._position else STOP_DOWN
+        self._orders.cancel_position(position, (STOP_UP, STOP_DOWN))
+        return self._orders.add(position, stop, persistent = persistent, kind = kind, expiry = self._order_expiry(expiry))
+
+    def find_limit_fill(self, limit, start = None, stop = None):
+        """
+        Find the first step where the price touches ``limit`` (``low <= limit <= high``), that is to say when a limit order at this price would be filled, in one call.
+        The search uses precomputed per-block high/low ranges, so it does not need to check each step.
+
+        :param limit: Limit price.
+        :type limit: float
+
+        :param start: First index (of the dataset) to check. By default, the current index.
+        :type start: optional - int
+
+        :param stop: Last index to check (included). By default, the end of the dataset.
+        :type stop: optional - int
+
+        :return: The index of the first step that touches the limit, or None if the limit is never touched.
+        """
+        start = self._idx if start is None else start
+        stop = len(self._price_array) - 1 if stop is None else stop
+        return self._get_price_index().first_touch(limit, limit, start, stop)
+
+    def _next_order_trigger(self, stop):
+        # 在头寸不变的情况下，返回订单簿中的订单在(_idx, stop]中第一次被触发的时间步（没有则返回None）。
+        orders, first_trigger = self._orders, None
+        for slot in np.flatnonzero(orders.active[:orders.size]):
+            if orders.position[slot] == self._position: continue
+            order_stop = min(stop, orders.expiry[slot]) if first_trigger is None else min(stop, orders.expiry[slot], first_trigger - 1)
+            trigger = self._get_price_index().first_touch(orders.upper[slot], orders.lower[slot], self._idx + 1, order_stop)
+            if trigger is not None: first_trigger = trigger
+        return first_trigger
+
+    def fast_forward(self, max_steps = None):
+        """
+        Advance the environment without changing the position, until the first step where an order of the order book is triggered, in one call.
+        It is equivalent to calling ``step()`` (without action) until an order is filled, but the steps before the fill are computed with vectorized operations
+        (the borrow interests are applied as in ``step``, and the History is filled for every step).
+
+        .. code-block:: python
+
+            env.add_limit_order(position = 1, limit = 30000)
+            observation, reward, done, truncated, info = env.fast_forward()
+
+        :param max_steps: Maximum number of steps to advance. By default, until the end of the episode.
+        :type max_steps: optional - int
+
+        :return: Same as ``step`` (for the last step : the step where the order is filled, or the last step of the episode).
+        """
+        nb_steps = len(self._price_array) - 1 - self._idx
+        if isinstance(self.max_episode_duration, int): nb_steps = min(nb_steps, self.max_episode_duration - 1 - self._step)
+        if max_steps is not None: nb_steps = min(nb_steps, max_steps)
+        trigger = self._next_order_trigger(self._idx + nb_steps) if len(self._orders) > 0 else None
+        # 在触发订单（或最后一步）之前的步中，头寸不变：一次性计算。
+        # 环形缓冲区则分段计算，使每一段的所有步都还在History中（内置特征和IncrementalFunction需要看到每一步）。
+        nb_quiet_steps = (self._idx + nb_steps if trigger is None else trigger) - self._idx - 1
+        chunk_size = max(1, self.historical_info.height - 1) if self.historical_info.ring else nb_quiet_steps
+        while nb_quiet_steps > 0:
+            chunk = min(nb_quiet_steps, chunk_size)
+            chunk, done, real_position, portfolio_valuation = self._replay(np.full(chunk, self._position, dtype= np.float64), position_indexes = np.full(chunk, NO_POSITION_INDEX, dtype= np.int64))
+            self._skip_dynamic_features(chunk, real_position, portfolio_valuation)
+            if done:
+                self.calculate_metrics()
+                self.log()
+                return self._observation(), 0, True, False, self._get_info()
+            nb_quiet_steps -= chunk
+        return self.step()
+
+    def _skip_dynamic_features(self, nb_steps, real_position, portfolio_valuation):
+        # 快进之后补上被跳过的步的动态特征。内置特征和IncrementalFunction需要看到每一步以保持状态正确，
+        # 其他动态特征函数只需要计算下一个观察窗口中可见的步。
+        history, idx, size = self.historical_info, self._idx, self.historical_info.size
+        # 可见的步：观察窗口中的步（包括最后一步，episode在快进中结束时它就是当前观察）。
+        visible = min(nb_steps, 1 if self.windows is None else self.windows)
+        incremental = any(reader is not None for reader in self._dynamic_feature_readers)
+        # 环形缓冲区中可能已经没有最早的几步。
+        first = max(0 if incremental else nb_steps - visible, nb_steps - size)
+        if first > 0:
+            self._portfolio_features.advance(first, portfolio_valuation[:first].max(), portfolio_valuation[first - 1])
+        for i in range(first, nb_steps):
+            self._portfolio_features.update(self._position, real_position[i], portfolio_valuation[i])
+            # 临时将环境和History移到第i步。
+            self._idx, history.size = idx - nb_steps + 1 + i, size - nb_steps + 1 + i
+            self._update_dynamic_obs(incremental_only = i < nb_steps - visible)
+        self._idx, history.size = idx, size
+
+    def _order_expiry(self, expiry):
+        return NO_EXPIRY if expiry is None else self._idx + expiry
+
+    def cancel_order(self, order_id):
+        # 取消一个订单。返回是否取消了订单（已成交或过期的订单返回False）。
+        return self._orders.cancel(order_id)
+
+    def cancel_orders(self):
+        # 取消所有订单。
+        self._orders.clear()
     
     def step(self, position_index = None):
         if position_index is not None: self._take_action(self.positions[position_index])
@@ -264,69 +656,164 @@ class TradingEnv(gym.Env):
         price = self._get_price()
         self._portfolio.update_interest(borrow_interest_rate= self.borrow_interest_rate)
         portfolio_value = self._portfolio.valorisation(price)
-        portfolio_distribution = self._portfolio.get_portfolio_distribution()
+        real_position = self._portfolio.real_position(price)
+        self._portfolio_features.update(position = self._position, real_position = real_position, valuation = portfolio_value)
 
         done, truncated = False, False
 
         if portfolio_value <= 0:
             done = True
-        if self._idx >= len(self.df) - 1:
+        if self._is_end_of_data():
             truncated = True
         if isinstance(self.max_episode_duration,int) and self._step >= self.max_episode_duration - 1:
             truncated = True
 
-        self.historical_info.add(
-            idx = self._idx,
-            step = self._step,
-            date = self.df.index.values[self._idx],
-            position_index =position_index,
-            position = self._position,
-            real_position = self._portfolio.real_position(price),
-            data =  dict(zip(self._info_columns, self._info_array[self._idx])),
-            portfolio_valuation = portfolio_value,
-            portfolio_distribution = portfolio_distribution, 
-            reward = 0
-        )
+        # 按reset中set的列顺序直接写入一行（不构建中间字典）。
+        self.historical_info.add_row([
+            self._idx,
+            self._step,
+            self._dates_array[self._idx],
+            NO_POSITION_INDEX if position_index is None else position_index,
+            self._position,
+            real_position,
+            *self._info_array[self._idx],
+            portfolio_value,
+            *self._portfolio.get_portfolio_distribution_values(),
+            0, # reward
+        ])
+        reward = 0
         if not done:
-            reward = self.reward_function(self.historical_info)
+            reward = self.reward_function(self.historical_info if self._reward_reader is None else self._reward_reader())
             self.historical_info["reward", -1] = reward
 
         if done or truncated:
             self.calculate_metrics()
             self.log()
-        return self._get_obs(),  self.historical_info["reward", -1], done, truncated, self.historical_info[-1]
+        return self._get_obs(), reward, done, truncated, self._get_info()
 
-    def add_metric(self, name, function):
-        self.log_metrics.append({
-            'name': name,
-            'function': function
-        })
-    def calculate_metrics(self):
-        self.results_metrics = {
-            "Market Return" : f"{100*(self.historical_info['data_close', -1] / self.historical_info['data_close', 0] -1):5.2f}%",
-            "Portfolio Return" : f"{100*(self.historical_info['portfolio_valuation', -1] / self.historical_info['portfolio_valuation', 0] -1):5.2f}%",
-        }
+    def _get_info(self):
+        # 返回History最新一行的惰性视图（return_info为False时返回空字典）。
+        return self.historical_info.row_view(-1) if self.return_info else {}
 
-        for metric in self.log_metrics:
-            self.results_metrics[metric['name']] = metric['function'](self.historical_info)
-    def get_metrics(self):
-        return self.results_metrics
-    def log(self):
-        if self.verbose > 0:
-            text = ""
-            for key, value in self.results_metrics.items():
-                text += f"{key} : {value}   |   "
-            print(text)
+    def backtest(self, actions, seed = None, options = None):
+        """
+        Replay a whole sequence of actions in one call, without calling ``step`` at each time step.
+        The environment is reset, then each action is applied exactly as ``step`` would do (same trading fees and borrow interest rules),
+        but valuations, real positions and rewards are computed with vectorized operations. The History of the environment is filled and the episode metrics are computed.
+
+        .. code-block:: python
+
+            history, metrics = env.backtest(position_indexes)
+
+        :param actions: Position indexes (in the ``positions`` list) to apply at each step. The replay stops earlier if the episode ends (end of the DataFrame, ``max_episode_duration`` or portfolio valuation <= 0).
+        :type actions: list[int] or numpy.ndarray
+
+        :return: The filled History object and the ``results_metrics`` dict.
+
+        .. note::
+
+            Limit orders are not taken into account during a backtest. The History keeps every step of the backtest, even if ``history_size`` is set.
+
+        .. hint::
+
+            If `numba <https://numba.pydata.org/>`_ is installed (``pip install gym-trading-env[numba]``), the trading loop is JIT-compiled and used automatically. The results are exactly the same as without numba.
+        """
+        self.reset(seed = seed, options = options)
+        actions = np.asarray(actions, dtype= np.int64)
+        start = self._idx
+        nb_steps = min(len(actions), len(self._price_array) - 1 - start)
+        if isinstance(self.max_episode_duration, int):
+            nb_steps = min(nb_steps, self.max_episode_duration - 1)
+        actions = actions[:nb_steps]
+        positions = np.array(self.positions)[actions]
+        self.historical_info.reserve(nb_steps + 1)
+
+        nb_steps, _, _, _ = self._replay(positions, position_indexes = actions)
+        if nb_steps > 0: self._position = self.positions[actions[nb_steps - 1]]
+        self.calculate_metrics()
+        self.log()
+        return self.historical_info, self.results_metrics
+
+    def _replay(self, positions, position_indexes):
+        # 从当前状态一次执行多步（第i步的目标头寸为positions[i]），与逐步调用step相同（不考虑订单簿和动态特征），
+        # 但估值、实际头寸和奖励用向量化运算计算，History一次性填充。估值<=0时提前结束。
+        # 返回：实际执行的步数、episode是否因估值<=0而结束、每步的实际头寸和估值。
+        start = self._idx
+        asset, fiat, interest_asset, interest_fiat = simulate_positions(
+            self._portfolio,
+            prices = self._price_array[start : start + len(positions) + 1],
+            positions = positions,
+            current_position = self._position,
+            trading_fees = self.trading_fees,
+            borrow_interest_rate = self.borrow_interest_rate
+        )
+        nb_steps = len(asset)
+        idx = np.arange(start + 1, start + nb_steps + 1)
+        price = self._price_array[idx]
+        portfolio_valuation = asset * price + fiat - interest_asset * price - interest_fiat
+        with np.errstate(divide= "ignore", invalid= "ignore"):
+            real_position = (asset - interest_asset) * price / portfolio_valuation
+        done = nb_steps > 0 and portfolio_valuation[-1] <= 0
+
+        self.historical_info.extend(
+            idx = idx,
+            step = np.arange(self._step + 1, self._step + nb_steps + 1),
+            date = self._dates_array[idx],
+            position_index = position_indexes[:nb_steps],
+            position = positions[:nb_steps],
+            real_position = real_position,
+            data = {column : self._get_info_column(i, idx) for i, column in enumerate(self._info_columns)},
+            portfolio_valuation = portfolio_valuation,
+            portfolio_distribution = {
+                "asset": np.maximum(0, asset),
+                "fiat": np.maximum(0, fiat),
+                "borrowed_asset": np.maximum(0, -asset),
+                "borrowed_fiat": np.maximum(0, -fiat),
+                "interest_asset": interest_asset,
+                "interest_fiat": interest_fiat,
+            },
+            reward = np.zeros(nb_steps),
+        )
+        # 估值<=0的最后一步没有奖励（与step相同）。
+        size = self.historical_info.size
+        self._fill_rewards(size - nb_steps, size - 1 if done else size)
+        self._idx += nb_steps
+        self._step += nb_steps
+        return nb_steps, done, real_position, portfolio_valuation
+
+    def _fill_rewards(self, start, stop):
+        # 计算History第start到stop - 1行的奖励（与step中相同，每行的奖励需要前一行）。
+        # 默认奖励函数直接向量化计算，IncrementalFunction逐行调用，其他自定义奖励函数则在逐步截断的History上调用。
+        history = self.historical_info
+        start = max(start, 1)
+        if start >= stop: return
+        if self.reward_function is basic_reward_function:
+            valuations = history["portfolio_valuation", start - 1 : stop]
+            history["reward", start : stop] = np.log(valuations[1:] / valuations[:-1])
+        elif self._reward_reader is not None:
+            for t in range(start, stop):
+                history["reward", t] = self.reward_function(self._reward_reader(t))
+        else:
+            size = history.size
+            for t in range(start, stop):
+                history.size = t + 1
+                reward = self.reward_function(history)
+                history.size = size
+                history["reward", t] = reward
+
+    def _market_return(self):
+        return self.historical_info['data_close', -1] / self.historical_info['data_close', 0] - 1
 
     def save_for_render(self, dir = "render_logs"):
-        assert "open" in self.df and "high" in self.df and "low" in self.df and "close" in self.df, "Your DataFrame needs to contain columns : open, high, low, close to render !"
+        df = self._get_dataframe()
+        assert "open" in df and "high" in df and "low" in df and "close" in df, "Your DataFrame needs to contain columns : open, high, low, close to render !"
         columns = list(set(self.historical_info.columns) - set([f"date_{col}" for col in self._info_columns]))
         history_df = pd.DataFrame(
-            self.historical_info[columns], columns= columns
+            {column : self.historical_info[column] for column in columns}
         )
         history_df.set_index("date", inplace= True)
         history_df.sort_index(inplace = True)
-        render_df = self.df.join(history_df, how = "inner")
+        render_df = df.join(history_df, how = "inner")
         
         if not os.path.exists(dir):os.makedirs(dir)
         render_df.to_pickle(f"{dir}/{self.name}_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.pkl")
@@ -352,6 +839,7 @@ class MultiDatasetTradingEnv(TradingEnv):
     
     
     :param dataset_dir: A `glob path <https://docs.python.org/3.6/library/glob.html>`_ that needs to match your datasets. All of your datasets needs to match the dataset requirements (see docs from TradingEnv). If it is not the case, you can use the ``preprocess`` param to make your datasets match the requirements.
+        The datasets can be ``.pkl`` files, OHLCV store directories (see ``gym_trading_env.utils.ohlcv_store.OHLCVStore``) or memory-mapped dataset directories (see ``gym_trading_env.utils.market_data.convert_pickle_datasets``), which are much faster to switch to. ``preprocess`` is not applied to memory-mapped datasets : apply it when converting them.
     :type dataset_dir: str
 
     :param preprocess: This function takes a pandas.DataFrame and returns a pandas.DataFrame. This function is applied to each dataset before being used in the environment.
@@ -386,6 +874,18 @@ class MultiDatasetTradingEnv(TradingEnv):
 
     :param episodes_between_dataset_switch: Number of times a dataset is used to create an episode, before moving on to another dataset. It can be useful for performances when `max_episode_duration` is low.
     :type episodes_between_dataset_switch: optional - int
+
+    :param preprocess_cache_dir: If set, the preprocessed datasets are cached in this directory (see ``gym_trading_env.utils.preprocess_cache.PreprocessCache``), so ``preprocess`` runs only once per dataset, even across training runs. The cache is invalidated when the dataset file or ``preprocess`` (its code, closure variables, referenced globals and helper functions) changes. Changes in imported modules or inside other objects used by ``preprocess`` are not detected: use ``preprocess_cache_key`` in this case.
+    :type preprocess_cache_dir: optional - str
+
+    :param preprocess_cache_key: If set, identifies ``preprocess`` in the cache instead of the hash of the function. Change it whenever the preprocessing changes.
+    :type preprocess_cache_key: optional - str
+
+    :param preprocess_cache_max_size: Maximum size of the preprocess cache in bytes. The least recently used datasets are removed first.
+    :type preprocess_cache_max_size: optional - int
+
+    :param dataset_prefetch_depth: Number of upcoming datasets picked in advance (with the same least-used rule) and loaded and preprocessed in a background thread, so that switching datasets at reset is nearly instant. Prefetching only changes when the datasets are loaded: the environment uses the same data as with synchronous loading. 0 (default) loads each dataset synchronously at reset. The time reset had to wait for the dataset is stored in ``dataset_wait_time`` (seconds).
+    :type dataset_prefetch_depth: optional - int
     """
     def __init__(self,
                 dataset_dir, 
@@ -393,17 +893,29 @@ class MultiDatasetTradingEnv(TradingEnv):
 
                 preprocess = lambda df : df,
                 episodes_between_dataset_switch = 1,
+                preprocess_cache_dir = None,
+                preprocess_cache_max_size = 10 * 2**30,
+                preprocess_cache_key = None,
+                dataset_prefetch_depth = 0,
                 **kwargs):
         self.dataset_dir = dataset_dir
         self.preprocess = preprocess
         self.episodes_between_dataset_switch = episodes_between_dataset_switch
+        self.preprocess_cache = None if preprocess_cache_dir is None else PreprocessCache(preprocess_cache_dir, max_size= preprocess_cache_max_size, preprocess_key= preprocess_cache_key)
         self.dataset_pathes = glob.glob(self.dataset_dir)
         if len(self.dataset_pathes) == 0:raise FileNotFoundError(f"No dataset found with the path : {self.dataset_dir}")
         self.dataset_nb_uses = np.zeros(shape=(len(self.dataset_pathes), ))
+        self.dataset_prefetch_depth = dataset_prefetch_depth
+        self._prefetched_datasets = deque()
+        self._prefetch_executor = None
+        self.dataset_wait_time = 0
         super().__init__(self.next_dataset(), *args, **kwargs)
+        # 环境配置完成后才开始预加载（后台线程根据info_columns等配置构建数组）。
+        if dataset_prefetch_depth > 0:
+            self._prefetch_executor = ThreadPoolExecutor(max_workers= 1)
+            self._prefetch_datasets()
 
-    def next_dataset(self):
-        self._episodes_on_this_dataset = 0
+    def _pick_dataset_path(self):
         # Find the indexes of the less explored dataset
         potential_dataset_pathes = np.where(self.dataset_nb_uses == self.dataset_nb_uses.min())[0]
         # Pick one of them
@@ -411,16 +923,714 @@ class MultiDatasetTradingEnv(TradingEnv):
         dataset_idx = potential_dataset_pathes[ random_int ]
         dataset_path = self.dataset_pathes[dataset_idx]
         self.dataset_nb_uses[dataset_idx] += 1 # Update nb use counts
+        return dataset_path
+
+    def _load_dataset(self, dataset_path, build_arrays = False):
+        # 加载（并预处理）数据集，返回 (数据集, 数组)。
+        # build_arrays: 是否同时构建DataFrame对应的环境数组（在后台线程中构建，重置时无需再复制数据）。
+        # 数据集的表示与同步加载时相同（DataFrame仍然是DataFrame，info_columns、info_dtype和keep_df同样生效）。
+        if is_memmap_dataset(dataset_path):
+            # 预编译的内存映射数据集：只需打开文件，episode用到的行才会从磁盘读取。
+            return MemmapMarketData(dataset_path), None
+        if self.preprocess_cache is not None:
+            return self.preprocess_cache.load(dataset_path, self.preprocess), None
+        df = self.preprocess(read_dataset(dataset_path))
+        return df, (self._dataframe_arrays(df) if build_arrays else None)
 
+    def _prefetch_datasets(self):
+        # 预先选择接下来的数据集，并在后台线程中加载，直到队列中有dataset_prefetch_depth个数据集。
+        while len(self._prefetched_datasets) < self.dataset_prefetch_depth:
+            dataset_path = self._pick_dataset_path()
+            self._prefetched_datasets.append(
+                (dataset_path, self._prefetch_executor.submit(self._load_dataset, dataset_path, True))
+            )
+
+    def _next_dataset(self):
+        # 返回下一个数据集和（预加载时在后台线程中构建的）数组。
+        self._episodes_on_this_dataset = 0
+        start = time.perf_counter()
+        if self._prefetch_executor is None:
+            dataset_path = self._pick_dataset_path()
+            dataset, arrays = self._load_dataset(dataset_path)
+        else:
+            self._prefetch_datasets()
+            dataset_path, future = self._prefetched_datasets.popleft()
+            dataset, arrays = future.result()
+            self._prefetch_datasets()
+        self.dataset_wait_time = time.perf_counter() - start
         self.name = Path(dataset_path).name
-        return self.preprocess(pd.read_pickle(dataset_path))
+        return dataset, arrays
+
+    def next_dataset(self):
+        return self._next_dataset()[0]
 
     def reset(self, seed=None, options = None, **kwargs):
         self._episodes_on_this_dataset += 1
         if self._episodes_on_this_dataset % self.episodes_between_dataset_switch == 0:
-            self._set_df(
-                self.next_dataset()
-            )
-        if self.verbose > 1: print(f"Selected dataset {self.name} ...")
+            self._set_df(*self._next_dataset())
+        if self.verbose > 1: print(f"Selected dataset {self.name} ... (waited {self.dataset_wait_time*1000:0.1f}ms)")
         return super().reset(seed = seed, options = options, **kwargs)
+
+    def close(self):
+        if self._prefetch_executor is not None:
+            self._prefetch_executor.shutdown(wait= False, cancel_futures= True)
+        super().close()
     
+
+
+class StreamingTradingEnv(TradingEnv):
+    """
+    (Inherits from TradingEnv) A TradingEnv environment fed by an append-only data source (live feed, or local replay of ``downloader`` output) instead of a complete DataFrame.
+    Bars are pulled from the ``feed`` only when the environment needs them: ``step`` waits for the next bar, so the same policy code can run in paper-trading against a live feed.
+    The observation arrays and the History grow in amortized O(1) per bar (their capacity doubles when they are full), instead of rebuilding an environment with a bigger DataFrame.
+
+    .. code-block:: python
+
+        import gymnasium as gym
+        import gym_trading_env
+        from gym_trading_env.utils.stream import dataframe_feed
+
+        env = gym.make('StreamingTradingEnv', feed = dataframe_feed(df), windows = 10, ...)
+
+    Each episode starts at the latest available bar. The episode is truncated when the feed ends (``step`` then returns the current observation without advancing), or after ``max_episode_duration`` steps.
+
+    :param feed: Source of the bars: an iterable (or iterator), or a ``queue.Queue`` filled by another thread. Each item is a DataFrame (one or several bars, indexed by date), a Series (one bar, named by its date) or a dict (one bar, with a ``"date"`` key), with the same columns as ``df``. The feed ends when the iterator is exhausted, or when it produces ``None``. If None, bars are only added with :meth:`append`.
+    :type feed: iterable or queue.Queue
+
+    :param df: Bars already available (warm-up history). By default, the first item of the feed. It defines the columns of the environment (same requirements as the ``df`` of TradingEnv).
+    :type df: optional - pandas.DataFrame
+
+    :param capacity: Initial number of bars the arrays can hold before growing.
+    :type capacity: optional - int
+
+    :param feed_timeout: Maximum time (seconds) to wait for an item of a ``queue.Queue`` feed (``queue.Empty`` is raised after it). By default, waits indefinitely.
+    :type feed_timeout: optional - float
+
+    Other parameters are the same as TradingEnv. Use ``history_size`` to keep only the latest steps in the History of endless episodes.
+    """
+    def __init__(self,
+                feed = None,
+                df = None,
+                *args,
+                capacity = 1024,
+                feed_timeout = None,
+                **kwargs):
+        self.capacity = capacity
+        self.feed_timeout = feed_timeout
+        self._feed_queue = feed if isinstance(feed, queue.Queue) else None
+        self._feed = None if feed is None or self._feed_queue is not None else iter(feed)
+        self.feed_exhausted = feed is None
+        if df is None:
+            df = self._next_item()
+            if df is None: raise RuntimeError("The feed ended before giving any bar.")
+        kwargs["keep_df"] = False
+        super().__init__(bars_to_dataframe(df), *args, **kwargs)
+
+    def _set_df(self, df):
+        # 构建初始数组，然后放入可增长的缓冲区。环境使用的数组是缓冲区已使用部分的视图。
+        super()._set_df(df)
+        self._buffers = {
+            "obs": GrowableArray(self._obs_array, self.capacity),
+            "price": GrowableArray(self._price_array, self.capacity),
+            "dates": GrowableArray(self._dates_array, self.capacity),
+            "info": GrowableArray(self._info_array, self.capacity),
+        }
+        self._order_price_buffers = None
+        self._set_views()
+
+    def _set_views(self):
+        # 追加K线后更新数组视图。
+        self._obs_array = self._buffers["obs"].array
+        self._price_array = self._buffers["price"].array
+        self._dates_array = self._buffers["dates"].array
+        self._info_array = self._buffers["info"].array
+        self._dynamic_obs_array = self._obs_array[:, self._nb_static_features:]
+        if self._order_price_buffers is not None:
+            self._order_price_arrays = tuple(None if buffer is None else buffer.array for buffer in self._order_price_buffers)
+        self._price_index = None
+
+    def _get_order_price_arrays(self):
+        # 订单使用的价格数组也放入可增长的缓冲区，追加K线时一起更新（不重新提取整列）。
+        if self._order_price_buffers is None:
+            self._order_price_arrays = None
+            self._order_price_buffers = [None if array is None else GrowableArray(array, self.capacity) for array in super()._get_order_price_arrays()]
+            self._set_views()
+        return self._order_price_arrays
+
+    def append(self, bars):
+        """
+        Add bars at the end of the data of the environment (without waiting for the feed).
+
+        :param bars: A DataFrame (one or several bars, indexed by date), a Series (one bar, named by its date) or a dict (one bar, with a ``"date"`` key).
+        :type bars: pandas.DataFrame, pandas.Series or dict
+        """
+        dates, columns = bars_to_columns(bars)
+        length = len(dates)
+        if length == 0: return
+        self._buffers["obs"].append(features_array(columns, self._features_columns[:self._nb_static_features], nb_extra_columns= len(self.dynamic_feature_functions), length= length))
+        self._buffers["price"].append(np.array(columns["close"], dtype= np.float64))
+        self._buffers["dates"].append(dates)
+        self._buffers["info"].append(info_records(columns, self._info_columns, length= length) if self.info_dtype is None else info_array(columns, self._info_columns, self.info_dtype, length= length))
+        if self._order_price_buffers is not None:
+            for buffer, column in zip(self._order_price_buffers, ["high", "low", "open"]):
+                if buffer is not None: buffer.append(np.array(columns[column], dtype= np.float64))
+        self._set_views()
+
+    def _next_item(self):
+        # 从数据源取出下一项（必要时等待），数据源结束时返回None。
+        if self.feed_exhausted: return None
+        if self._feed_queue is not None:
+            item = self._feed_queue.get(timeout= self.feed_timeout)
+        else:
+            item = next(self._feed, END_OF_FEED)
+        if item is END_OF_FEED: self.feed_exhausted = True
+        return item
+
+    def _wait_for_bar(self, idx):
+        # 从数据源取出K线，直到索引idx可用。数据源结束前无法取得时返回False。
+        while len(self._price_array) <= idx:
+            item = self._next_item()
+            if item is None: return False
+            self.append(item)
+        return True
+
+    def _get_start_idx(self):
+        # 每个episode从最新的K线开始（至少需要windows根K线）。
+        if not self._wait_for_bar(0 if self.windows is None else self.windows - 1):
+            raise RuntimeError(f"The feed ended before giving the {self.windows} bars needed by the observation window.")
+        return len(self._price_array) - 1
+
+    def _is_end_of_data(self):
+        # 只有数据源结束后，最新的K线才是数据的结尾。
+        return self.feed_exhausted and super()._is_end_of_data()
+
+    def step(self, position_index = None):
+        if not self._wait_for_bar(self._idx + 1):
+            # 数据源已结束：episode被截断，不再前进。
+            self.calculate_metrics()
+            self.log()
+            return self._observation(), 0, False, True, self._get_info()
+        if not self.historical_info.ring and self.historical_info.size == self.historical_info.height:
+            self.historical_info.reserve(2 * self.historical_info.height)
+        return super().step(position_index)
+
+class VectorTradingEnv(gym.vector.VectorEnv):
+    """
+    A natively batched version of TradingEnv: the N sub-environments share the same DataFrame and their portfolios
+    (asset, fiat, interests) are stored as arrays, so trades, interests, valuations, rewards and observations
+    of all the sub-environments are computed with a few NumPy operations per step (no Python loop over the sub-environments).
+
+    It follows the Gymnasium ``VectorEnv`` API (next-step autoreset). It is recommended to use it this way :
+
+    .. code-block:: python
+
+        import gymnasium as gym
+        import gym_trading_env
+        envs = gym.make_vec('VectorTradingEnv', num_envs = 512, df = df, ...)
+
+    :param df: Same requirements as the ``df`` of TradingEnv.
+    :type df: pandas.DataFrame
+
+    :param num_envs: Number of sub-environments.
+    :type num_envs: int
+
+    :param positions: Same as TradingEnv.
+    :type positions: optional - list[int or float]
+
+    :param dynamic_feature_functions: Built-in dynamic features, computed for all the sub-environments at once : ``"last_position"``, ``"real_position"``, ``"unrealized_pnl"``, ``"time_in_position"``, ``"drawdown"`` (see ``PortfolioFeatures``). Default : last position taken and real position, like TradingEnv.
+    :type dynamic_feature_functions: optional - list[str]
+
+    :param windows: Same as TradingEnv.
+    :type windows: optional - None or int
+
+    :param trading_fees: Same as TradingEnv.
+    :type trading_fees: optional - float
+
+    :param borrow_interest_rate: Same as TradingEnv.
+    :type borrow_interest_rate: optional - float
+
+    :param portfolio_initial_value: Same as TradingEnv.
+    :type portfolio_initial_value: float or int
+
+    :param initial_position: Same as TradingEnv ('random' picks one position per sub-environment).
+    :type initial_position: optional - float or int
+
+    :param max_episode_duration: Same as TradingEnv.
+    :type max_episode_duration: optional - int or 'max'
+
+    :param name: Same as TradingEnv.
+    :type name: optional - str
+
+    .. note::
+
+        The observation of each sub-environment is made of the static features followed by the built-in dynamic features. The reward is the default one :math:`r_{t} = ln(\\frac{p_{t}}{p_{t-1}})`.
+        Custom dynamic feature functions and ``reward_function`` (which need one History per sub-environment) are not supported : use ``gym.make_vec('TradingEnv', ...)`` for those.
+    """
+    metadata = {'render_modes': [], 'autoreset_mode': AutoresetMode.NEXT_STEP}
+    def __init__(self,
+                df : pd.DataFrame,
+                num_envs = 1,
+                positions : list = [0, 1],
+                dynamic_feature_functions = ["last_position", "real_position"],
+                windows = None,
+                trading_fees = 0,
+                borrow_interest_rate = 0,
+                portfolio_initial_value = 1000,
+                initial_position ='random',
+                max_episode_duration = 'max',
+                name = "Stock",
+                render_mode = None,
+                ):
+        self.num_envs = num_envs
+        portfolio_features_names, _, function_indexes = split_dynamic_features(dynamic_feature_functions)
+        if len(function_indexes) > 0:
+            raise ValueError("VectorTradingEnv only supports built-in dynamic features. Use gym.make_vec('TradingEnv', ...) for custom dynamic feature functions.")
+        self._portfolio_features = PortfolioFeaturesArray(portfolio_features_names, num_envs)
+        self.name = name
+        self.positions = positions
+        self._positions_array = np.array(positions, dtype= np.float64)
+        self.windows = windows
+        self.trading_fees = trading_fees
+        self.borrow_interest_rate = borrow_interest_rate
+        self.portfolio_initial_value = float(portfolio_initial_value)
+        self.initial_position = initial_position
+        assert self.initial_position in self.positions or self.initial_position == 'random', "'initial_position'参数必须是'random'或'position'参数中提到的头寸（默认为[0, 1]）。"
+        self.max_episode_duration = max_episode_duration
+        self.render_mode = render_mode
+        self._set_df(df)
+
+        self.single_action_space = spaces.Discrete(len(positions))
+        obs_shape = [self._nb_features] if self.windows is None else [self.windows, self._nb_features]
+        self.single_observation_space = spaces.Box(-np.inf, np.inf, shape = obs_shape)
+        self.action_space = gym.vector.utils.batch_space(self.single_action_space, self.num_envs)
+        self.observation_space = gym.vector.utils.batch_space(self.single_observation_space, self.num_envs)
+
+        # 所有子环境的状态（数组）。
+        self._idx = np.zeros(self.num_envs, dtype= np.int64)
+        self._step = np.zeros(self.num_envs, dtype= np.int64)
+        self._position_index = np.zeros(self.num_envs, dtype= np.int64)
+        self._position = np.zeros(self.num_envs, dtype= np.float64)
+        self._portfolio = PortfolioArray(asset = np.zeros(self.num_envs), fiat = np.zeros(self.num_envs))
+        self._valuation = np.zeros(self.num_envs, dtype= np.float64)
+        self._autoreset_envs = np.zeros(self.num_envs, dtype= np.bool_)
+        # 动态特征的滚动窗口。
+        self._dynamic_obs = np.zeros((self.num_envs, 1 if self.windows is None else self.windows, len(self._portfolio_features.names)), dtype= np.float32)
+
+    def _set_df(self, df):
+        # 设置共享的DataFrame，只保留静态特征，动态特征由各子环境的状态数组计算。
+        self._features_columns = [col for col in df.columns if "feature" in col]
+        self._nb_static_features = len(self._features_columns)
+        self._nb_features = self._nb_static_features + len(self._portfolio_features.names)
+        self.df = df
+        self._obs_array = features_array(df, self._features_columns)
+        self._price_array = np.array(df["close"], dtype= np.float64)
+        self._dates_array = np.array(df.index.values)
+        if self.windows is not None:
+            self._window_offsets = np.arange(1 - self.windows, 1)
+
+    def _update_dynamic_obs(self, mask, real_position):
+        # 更新mask为True的子环境的动态特征，并推入它们的滚动窗口。
+        self._portfolio_features.update(mask, position = self._position, real_position = real_position, valuation = self._valuation)
+        if self.windows is not None:
+            self._dynamic_obs[mask, :-1] = self._dynamic_obs[mask, 1:]
+        np.copyto(self._dynamic_obs[:, -1], self._portfolio_features.values, where= mask[:, None])
+
+    def _get_obs(self):
+        # 批量获取所有子环境的观察值。
+        if self.windows is None:
+            static_obs = self._obs_array[self._idx]
+            dynamic_obs = self._dynamic_obs[:, -1]
+        else:
+            static_obs = self._obs_array[self._idx[:, None] + self._window_offsets]
+            dynamic_obs = self._dynamic_obs
+        return np.concatenate([static_obs, dynamic_obs], axis= -1)
+
+    def _get_info(self, real_position, reward):
+        return {
+            "idx": self._idx.copy(),
+            "step": self._step.copy(),
+            "date": self._dates_array[self._idx],
+            "position_index": self._position_index.copy(),
+            "position": self._position.copy(),
+            "real_position": real_position,
+            "data_close": self._price_array[self._idx],
+            "portfolio_valuation": self._valuation.copy(),
+            "reward": reward,
+        }
+
+    def _reset_envs(self, mask):
+        # 重置mask为True的子环境。
+        nb_resets = int(mask.sum())
+        if self.initial_position == 'random':
+            position_index = self.np_random.integers(len(self.positions), size= nb_resets)
+        else:
+            position_index = np.full(nb_resets, self.positions.index(self.initial_position))
+        self._position_index[mask] = position_index
+        self._position[mask] = self._positions_array[position_index]
+
+        idx = np.zeros(nb_resets, dtype= np.int64)
+        if self.windows is not None: idx[:] = self.windows - 1
+        if self.max_episode_duration != 'max':
+            # 如果设置了最大episode持续时间，则随机选择起始索引。
+            idx = self.np_random.integers(low = idx, high = len(self._price_array) - self.max_episode_duration - idx)
+        self._idx[mask] = idx
+        self._step[mask] = 0
+
+        # 初始化投资组合（与TargetPortfolio相同）。
+        price = self._price_array[self._idx[mask]]
+        self._portfolio.asset[mask] = self._position[mask] * self.portfolio_initial_value / price
+        self._portfolio.fiat[mask] = (1 - self._position[mask]) * self.portfolio_initial_value
+        self._portfolio.interest_asset[mask] = 0
+        self._portfolio.interest_fiat[mask] = 0
+        self._valuation[mask] = self.portfolio_initial_value
+
+        # 与TradingEnv相同：episode开始之前的窗口行用0填充，最后一行为初始的特征值。
+        self._portfolio_features.reset(mask, position = self._position, real_position = self._position, valuation = self._valuation)
+        self._dynamic_obs[mask] = 0
+        self._dynamic_obs[mask, -1] = self._portfolio_features.values[mask]
+        self._autoreset_envs[mask] = False
+
+    def reset(self, seed = None, options = None):
+        # 重置所有子环境（或options["reset_mask"]指定的子环境）。
+        if seed is not None:
+            self._np_random, self._np_random_seed = seeding.np_random(seed)
+        mask = np.ones(self.num_envs, dtype= np.bool_)
+        if options is not None and "reset_mask" in options:
+            mask = np.asarray(options["reset_mask"], dtype= np.bool_)
+        self._reset_envs(mask)
+        return self._get_obs(), self._get_info(real_position = self._position.copy(), reward = np.zeros(self.num_envs))
+
+    def step(self, actions):
+        # 批量执行一步。上一步结束的子环境在这一步被重置（忽略其动作）。
+        actions = np.asarray(actions, dtype= np.int64)
+        autoreset = self._autoreset_envs.copy()
+        running = ~autoreset
+
+        # 执行动作：只对头寸发生变化的子环境交易。
+        target_position = self._positions_array[actions]
+        trade_mask = running & (target_position != self._position)
+        if trade_mask.any():
+            self._portfolio.trade_to_position(target_position, price = self._price_array[self._idx], trading_fees = self.trading_fees, mask = trade_mask)
+            self._position = np.where(trade_mask, target_position, self._position)
+        self._position_index = np.where(running, actions, self._position_index)
+        self._idx += running
+        self._step += running
+
+        price = self._price_array[self._idx]
+        self._portfolio.update_interest(borrow_interest_rate= self.borrow_interest_rate)
+        previous_valuation = self._valuation
+        self._valuation = np.where(running, self._portfolio.valorisation(price), self._valuation)
+        real_position = self._portfolio.real_position(price)
+
+        terminated = running & (self._valuation <= 0)
+        truncated = running & (self._idx >= len(self._price_array) - 1)
+        if isinstance(self.max_episode_duration, int):
+            truncated |= running & (self._step >= self.max_episode_duration - 1)
+
+        reward = np.zeros(self.num_envs)
+        rewarded = running & ~terminated
+        reward[rewarded] = np.log(self._valuation[rewarded] / previous_valuation[rewarded])
+
+        self._update_dynamic_obs(running, real_position)
+        if autoreset.any():
+            self._reset_envs(autoreset)
+            real_position = np.where(autoreset, self._position, real_position)
+        self._autoreset_envs = terminated | truncated
+        return self._get_obs(), reward, terminated, truncated, self._get_info(real_position = real_position, reward = reward)
+
+class MultiAssetTradingEnv(BaseTradingEnv):
+    """
+    A trading environment whose portfolio holds K instruments at once (plus fiat), built from K aligned DataFrames.
+    The close prices form a K-column price matrix, and trades, trading fees, borrow interests and valuations are computed with vector operations over the K assets.
+    The position is a vector of K weights: the weight of an asset is the value of its holding divided by the portfolio valuation
+    (a negative weight means the asset is borrowed, a sum of weights above 1 means fiat is borrowed).
+
+    .. code-block:: python
+
+        import gymnasium as gym
+        import gym_trading_env
+        env = gym.make('MultiAssetTradingEnv', dfs = {"BTC": df_btc, "ETH": df_eth}, positions = [[0, 0], [1, 0], [0, 1], [0.5, 0.5]])
+
+    :param dfs: DataFrames of the K assets (same requirements as the ``df`` of TradingEnv), by asset name. Only the dates present in all the DataFrames are kept. The columns are prefixed by the asset name (for example ``BTC_feature_close`` in the observation and ``data_BTC_close`` in the History).
+    :type dfs: dict[str, pandas.DataFrame]
+
+    :param positions: Discrete allocations allowed: a list of weight vectors (one weight per asset). The action is the index of the allocation in this list. If None, the action is directly the target weight vector (continuous ``Box`` action space bounded by ``weight_bounds``).
+    :type positions: optional - None or list[list[float]]
+
+    :param weight_bounds: Bounds of each weight when ``positions`` is None. Target weights are clipped to these bounds.
+    :type weight_bounds: optional - tuple[float, float]
+
+    :param dynamic_feature_functions: Same as TradingEnv. The built-in features ``"last_position"`` and ``"real_position"`` add one column per asset, the other built-in features (``"unrealized_pnl"``, ``"time_in_position"``, ``"drawdown"``) are computed on the whole portfolio. Other functions receive the History and return a float.
+    :type dynamic_feature_functions: optional - list
+
+    :param reward_function: Same as TradingEnv.
+    :type reward_function: optional - function<History->float> or gym_trading_env.utils.incremental.IncrementalFunction
+
+    :param windows: Same as TradingEnv.
+    :type windows: optional - None or int
+
+    :param trading_fees: Same as TradingEnv, applied to the traded value of each asset.
+    :type trading_fees: optional - float
+
+    :param borrow_interest_rate: Same as TradingEnv, applied to each borrowed asset and to the borrowed fiat.
+    :type borrow_interest_rate: optional - float
+
+    :param portfolio_initial_value: Same as TradingEnv.
+    :type portfolio_initial_value: float or int
+
+    :param initial_position: Initial weight vector. By default, the portfolio is fully in fiat. 'random' picks one of the ``positions``.
+    :type initial_position: optional - None, 'random' or list[float]
+
+    :param max_episode_duration: Same as TradingEnv.
+    :type max_episode_duration: optional - int or 'max'
+
+    :param verbose: Same as TradingEnv.
+    :type verbose: optional - int
+
+    :param name: Same as TradingEnv.
+    :type name: optional - str
+
+    .. note::
+
+        The "Market Return" metric is the return of an equally weighted buy and hold of the K assets.
+    """
+    def __init__(self,
+                dfs : dict,
+                positions = None,
+                weight_bounds = (0, 1),
+                dynamic_feature_functions = ["last_position", "real_position"],
+                reward_function = basic_reward_function,
+                windows = None,
+                trading_fees = 0,
+                borrow_interest_rate = 0,
+                portfolio_initial_value = 1000,
+                initial_position = None,
+                max_episode_duration = 'max',
+                verbose = 1,
+                name = "Portfolio",
+                render_mode = "logs",
+                ):
+        self.max_episode_duration = max_episode_duration
+        self.name = name
+        self.verbose = verbose
+        self.assets = [str(asset) for asset in dfs.keys()]
+        self.nb_assets = len(self.assets)
+        self.positions = positions
+        self.weight_bounds = weight_bounds
+        if positions is not None:
+            self._positions_array = np.array(positions, dtype= np.float64).reshape(len(positions), self.nb_assets)
+
+        # 动态特征：内置的"last_position"和"real_position"每种资产一列，其他内置特征和函数各一列。
+        self.dynamic_feature_functions = dynamic_feature_functions
+        portfolio_features_names, _, self._dynamic_feature_functions_indexes = split_dynamic_features(dynamic_feature_functions)
+        self._weight_features = [name for name in portfolio_features_names if name in ("last_position", "real_position")]
+        self._portfolio_features = PortfolioFeatures([name for name in portfolio_features_names if name not in self._weight_features])
+        self._dynamic_columns, start = [], 0
+        for dynamic_feature_function in dynamic_feature_functions:
+            name = BUILTIN_DYNAMIC_FEATURES.get(dynamic_feature_function, dynamic_feature_function) if not isinstance(dynamic_feature_function, IncrementalFunction) else None
+            width = self.nb_assets if name in ("last_position", "real_position") else 1
+            self._dynamic_columns.append(slice(start, start + width))
+            start += width
+        self._nb_dynamic_features = start
+
+        self.reward_function = reward_function
+        self.windows = windows
+        self.trading_fees = trading_fees
+        self.borrow_interest_rate = borrow_interest_rate
+        self.portfolio_initial_value = float(portfolio_initial_value)
+        self.initial_position = self._check_initial_position(initial_position)
+        assert render_mode is None or render_mode in self.metadata["render_modes"]
+        self.render_mode = render_mode
+        self._set_dfs(dfs)
+
+        if positions is None:
+            self.action_space = spaces.Box(weight_bounds[0], weight_bounds[1], shape = [self.nb_assets], dtype= np.float64)
+        else:
+            self.action_space = spaces.Discrete(len(positions))
+        obs_shape = [self._nb_features] if self.windows is None else [self.windows, self._nb_features]
+        self.observation_space = spaces.Box(-np.inf, np.inf, shape = obs_shape)
+
+        self.log_metrics = []
+        self._history_dtypes = {
+            "position": np.float64,
+            "real_position": np.float64,
+            "portfolio_valuation": np.float64,
+            "portfolio_distribution": np.float64,
+            "reward": np.float64,
+        }
+
+    def _check_initial_position(self, initial_position):
+        # 检查初始头寸：None、'random'（需要positions）或K个权重（离散动作时为positions之一，连续动作时在weight_bounds之内）。
+        if initial_position is None: return None
+        if isinstance(initial_position, str):
+            if initial_position != 'random':
+                raise ValueError(f"'initial_position' must be None, 'random' or a vector of {self.nb_assets} weights, got '{initial_position}'.")
+            if self.positions is None:
+                raise ValueError("'initial_position' = 'random' requires 'positions'.")
+            return initial_position
+        weights = np.asarray(initial_position, dtype= np.float64)
+        if weights.shape != (self.nb_assets,):
+            raise ValueError(f"'initial_position' must contain one weight per asset ({self.nb_assets} : {self.assets}), got shape {weights.shape}.")
+        if not np.all(np.isfinite(weights)):
+            raise ValueError(f"'initial_position' must contain finite weights, got {weights.tolist()}.")
+        if self.positions is None and np.any((weights < self.weight_bounds[0]) | (weights > self.weight_bounds[1])):
+            raise ValueError(f"'initial_position' {weights.tolist()} is out of 'weight_bounds' {tuple(self.weight_bounds)}.")
+        return weights
+
+    def _set_dfs(self, dfs):
+        # 对齐K个DataFrame（只保留所有DataFrame都有的日期），并构建静态特征矩阵、K列价格矩阵和信息数组。
+        dfs = list(dfs.values())
+        index = dfs[0].index
+        for df in dfs[1:]:
+            index = index.intersection(df.index, sort= False)
+        index = index.sort_values()
+        dfs = [df if df.index.equals(index) else df.loc[index] for df in dfs]
+
+        self._features_columns, self._info_columns = [], []
+        for asset, df in zip(self.assets, dfs):
+            self._features_columns.extend([(asset, col) for col in df.columns if "feature" in col])
+            self._info_columns.append([col for col in df.columns if "feature" not in col])
+        self._nb_static_features = len(self._features_columns)
+        self._nb_features = self._nb_static_features + self._nb_dynamic_features
+
+        # 静态特征后预留动态特征的列（与TradingEnv相同）。
+        self._obs_array = np.zeros((len(index), self._nb_features), dtype= np.float32)
+        for i, (asset, col) in enumerate(self._features_columns):
+            self._obs_array[:, i] = dfs[self.assets.index(asset)][col].to_numpy()
+        self._features_columns = [f"{asset}_{col}" for asset, col in self._features_columns]
+        self._features_columns.extend([f"dynamic_feature__{i}" for i in range(self._nb_dynamic_features)])
+        self._dynamic_obs_array = self._obs_array[:, self._nb_static_features:]
+
+        self._price_array = np.column_stack([df["close"].to_numpy(dtype= np.float64) for df in dfs])
+        self._dates_array = np.array(index.values)
+        self._info_arrays = [info_records(df, columns) for df, columns in zip(dfs, self._info_columns)]
+        self._data_columns = [f"{asset}_{col}" for asset, columns in zip(self.assets, self._info_columns) for col in columns]
+
+    def _get_prices(self, delta = 0):
+        # 获取当前时间步K种资产的价格。
+        return self._price_array[self._idx + delta]
+
+    def _get_data(self):
+        # 当前时间步所有资产的信息列的值（按_data_columns的顺序）。
+        values = []
+        for info_array in self._info_arrays:
+            values.extend(info_array[self._idx])
+        return values
+
+    def _get_weights(self, action):
+        # 将动作转换为目标权重数组。
+        if self.positions is not None:
+            return self._positions_array[action]
+        return np.clip(np.asarray(action, dtype= np.float64).reshape(self.nb_assets), self.weight_bounds[0], self.weight_bounds[1])
+
+    def _update_dynamic_obs(self, real_position):
+        # 计算当前时间步的动态特征。
+        row = self._dynamic_obs_array[self._idx]
+        features = iter(self._portfolio_features.values)
+        readers = iter(self._dynamic_feature_readers)
+        for i, (dynamic_feature_function, columns) in enumerate(zip(self.dynamic_feature_functions, self._dynamic_columns)):
+            if i in self._dynamic_feature_functions_indexes:
+                reader = next(readers)
+                row[columns] = dynamic_feature_function(self.historical_info if reader is None else reader())
+                continue
+            name = BUILTIN_DYNAMIC_FEATURES.get(dynamic_feature_function, dynamic_feature_function)
+            if name == "last_position": row[columns] = self._position
+            elif name == "real_position": row[columns] = real_position
+            else: row[columns] = next(features)
+
+    def _get_obs(self, real_position):
+        self._update_dynamic_obs(real_position)
+        if self.windows is None:
+            obs = self._obs_array[self._idx]
+        else:
+            obs = self._obs_array[self._idx + 1 - self.windows : self._idx + 1]
+        obs.flags.writeable = False
+        return obs
+
+    def reset(self, seed = None, options = None, **kwargs):
+        super().reset(seed = seed, options = options, **kwargs)
+        self._step = 0
+        if self.initial_position is None:
+            self._position = np.zeros(self.nb_assets)
+        elif isinstance(self.initial_position, str) and self.initial_position == 'random':
+            self._position = self._positions_array[self.np_random.integers(len(self.positions))]
+        else:
+            self._position = self.initial_position.copy()
+
+        self._idx = 0
+        if self.windows is not None: self._idx = self.windows - 1
+        if self.max_episode_duration != 'max':
+            # 如果设置了最大episode持续时间，则随机选择起始索引。
+            self._idx = int(self.np_random.integers(low = self._idx, high = len(self._price_array) - self.max_episode_duration - self._idx))
+
+        self._portfolio = TargetMultiAssetPortfolio(position = self._position, value = self.portfolio_initial_value, prices = self._get_prices())
+
+        history_size = len(self._price_array) - self._idx
+        if isinstance(self.max_episode_duration, int): history_size = min(history_size, self.max_episode_duration)
+        self.historical_info = History(max_size= history_size, dtypes= self._history_dtypes)
+        self.historical_info.set(
+            idx = self._idx,
+            step = self._step,
+            date = self._dates_array[self._idx],
+            position = dict(zip(self.assets, self._position.tolist())),
+            real_position = dict(zip(self.assets, self._position.tolist())),
+            data = dict(zip(self._data_columns, self._get_data())),
+            portfolio_valuation = self.portfolio_initial_value,
+            portfolio_distribution = self._portfolio.get_portfolio_distribution(self.assets),
+            reward = 0,
+        )
+        self._portfolio_features.reset(position = tuple(self._position), real_position = 0, valuation = self.portfolio_initial_value)
+        self._reset_incremental_functions()
+        return self._get_obs(self._position), self._get_info()
+
+    def step(self, action = None):
+        if action is not None:
+            position = self._get_weights(action)
+            if not np.array_equal(position, self._position):
+                self._portfolio.trade_to_position(position, prices = self._get_prices(), trading_fees = self.trading_fees)
+                self._position = position
+        self._idx += 1
+        self._step += 1
+
+        prices = self._get_prices()
+        self._portfolio.update_interest(borrow_interest_rate= self.borrow_interest_rate)
+        portfolio_value = self._portfolio.valorisation(prices)
+        real_position = self._portfolio.real_position(prices)
+        self._portfolio_features.update(position = tuple(self._position), real_position = 0, valuation = portfolio_value)
+
+        done, truncated = False, False
+        if portfolio_value <= 0:
+            done = True
+        if self._idx >= len(self._price_array) - 1:
+            truncated = True
+        if isinstance(self.max_episode_duration,int) and self._step >= self.max_episode_duration - 1:
+            truncated = True
+
+        # 按reset中set的列顺序直接写入一行。
+        self.historical_info.add_row([
+            self._idx,
+            self._step,
+            self._dates_array[self._idx],
+            *self._position.tolist(),
+            *real_position.tolist(),
+            *self._get_data(),
+            portfolio_value,
+            *self._portfolio.get_portfolio_distribution_values(),
+            0, # reward
+        ])
+        reward = 0
+        if not done:
+            reward = self.reward_function(self.historical_info if self._reward_reader is None else self._reward_reader())
+            self.historical_info["reward", -1] = reward
+
+        if done or truncated:
+            self.calculate_metrics()
+            self.log()
+        return self._get_obs(real_position), reward, done, truncated, self._get_info()
+
+    def _get_info(self):
+        return self.historical_info.row_view(-1)
+
+    def _market_return(self):
+        # 市场收益：K种资产等权重买入持有的收益。
+        return np.mean([self.historical_info[f'data_{asset}_close', -1] / self.historical_info[f'data_{asset}_close', 0] for asset in self.assets]) - 1
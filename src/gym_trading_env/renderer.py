@@ -1,25 +1,37 @@
-from flask import Flask, render_template, jsonify, make_response
+from flask import Flask, render_template, jsonify, make_response, request
 
 from pyecharts.globals import CurrentConfig
 from pyecharts import options as opts
 from pyecharts.charts import Bar
 
 from .utils.charts import charts
+from .utils.downsampling import bucket_edges, aggregate_ohlc, aggregate_sum, lttb
 from pathlib import Path 
 import glob
+import json
+import threading
+import numpy as np
 import pandas as pd
 
+# 图表中的曲线（除K线、交易量和自定义线条外），按图表中的顺序。
+CHART_LINES = ["portfolio_valuation", "position", "cumulative_rewards"]
+
 
 class Renderer():
     # 渲染器类，用于可视化交易环境的运行结果。
-    def __init__(self, render_logs_dir):
+    def __init__(self, render_logs_dir, max_points = 2000):
         # 初始化渲染器。
         # render_logs_dir: 渲染日志文件所在的目录。
+        # max_points: 每次发送给浏览器的最大点数（K线数）。更长的范围会被降采样，缩放时浏览器再请求可见范围的数据。
         self.app = Flask(__name__, static_folder="./templates/")
         # self.app.debug = True # 调试模式，生产环境应关闭。
         self.app.config["EXPLAIN_TEMPLATE_LOADING"] = True
-        self.df = None
+        # 当前的渲染日志（load返回的字典）。Flask在多个线程中处理请求：每个请求使用自己取得的字典，
+        # 而不是分别读取共享的属性（另一个请求可能同时加载其他渲染日志）。
+        self._loaded = None
+        self._lock = threading.Lock()
         self.render_logs_dir = render_logs_dir
+        self.max_points = max_points
         self.metrics = [
             # 默认指标列表。
             {
@@ -51,6 +63,64 @@ class Renderer():
             {"name": name, "function":function}
         )
         if line_options is not None: self.lines[-1]["line_options"] = line_options
+    def load(self, name):
+        # 读取一个渲染日志，并预先计算完整分辨率的序列（自定义线条和累计奖励只在读取时计算一次）。
+        # 返回加载的数据（字典：name, df, series, line_values），并将它设为当前的渲染日志。
+        df = pd.read_pickle(f"{self.render_logs_dir}/{name}")
+        series = {column : df[column].to_numpy(dtype= np.float64) for column in ["open", "high", "low", "close", "volume", "portfolio_valuation", "position"]}
+        series["cumulative_rewards"] = df["reward"].cumsum().to_numpy(dtype= np.float64)
+        loaded = {
+            "name": name,
+            "df": df,
+            "series": series,
+            "line_values": [np.asarray(line["function"](df), dtype= np.float64) for line in self.lines],
+        }
+        with self._lock:
+            self._loaded = loaded
+        return loaded
+
+    def _get_loaded(self, name):
+        # 返回名称为name的渲染日志（如果不是当前的渲染日志则读取它）。
+        with self._lock:
+            loaded = self._loaded
+        if loaded is None or loaded["name"] != name:
+            loaded = self.load(name)
+        return loaded
+
+    @property
+    def df(self):
+        # 当前渲染日志的DataFrame。
+        return None if self._loaded is None else self._loaded["df"]
+
+    @property
+    def name(self):
+        return None if self._loaded is None else self._loaded["name"]
+
+    def window(self, start, end, points = None, loaded = None):
+        # 图表在 [start, end) （行索引）范围内的数据。为了可以平移和缩小，两边各多包含一个可见范围的长度（不超过数据的范围）。
+        # 数据被降采样到最多points个点：每个桶的K线合并为一根（开、高、低、收），交易量求和，其他曲线使用LTTB选择一个点。
+        # loaded: load返回的渲染日志，默认为当前的渲染日志。
+        # 返回：桶的开始日期、各序列（字典，"lines"为自定义线条的列表）以及范围信息（zoom_start, zoom_end为可见范围的百分比）。
+        if loaded is None: loaded = self._loaded
+        series = loaded["series"]
+        length = len(loaded["df"])
+        start = min(max(0, int(start)), length - 1)
+        end = min(max(start + 1, int(end)), length)
+        window_start, window_end = max(0, 2 * start - end), min(length, 2 * end - start)
+        edges = bucket_edges(window_start, window_end, points or self.max_points)
+        data = dict(zip(["open", "high", "low", "close"], aggregate_ohlc(*[series[key] for key in ["open", "high", "low", "close"]], edges)))
+        data["volume"] = aggregate_sum(series["volume"], edges)
+        for key in CHART_LINES:
+            data[key] = series[key][lttb(series[key], edges)]
+        data["lines"] = [values[lttb(values, edges)] for values in loaded["line_values"]]
+        info = {
+            "start": start, "end": end, "window_start": window_start, "window_end": window_end,
+            "length": length, "bucket_size": int(edges[1] - edges[0]),
+            "zoom_start": (start - window_start) / (window_end - window_start) * 100,
+            "zoom_end": (end - window_start) / (window_end - window_start) * 100,
+        }
+        return loaded["df"].index[edges[:-1]], data, info
+
     def compute_metrics(self, df):
         # 计算所有指标。
         # df: 包含市场和投资组合数据的DataFrame。
@@ -66,20 +136,47 @@ class Renderer():
             return render_template('index.html', render_names = render_names)
 
         @self.app.route("/update_data/<name>")
-        # 更新图表数据的路由。
+        # 更新图表数据的路由：返回图表配置（初始显示最后5%的数据）和范围信息。
         def update(name = None):
             if name is None or name == "":
                 render_pathes = glob.glob(f"{self.render_logs_dir}/*.pkl")
                 name = Path(render_pathes[-1]).name
-            self.df = pd.read_pickle(f"{self.render_logs_dir}/{name}")
-            chart = charts(self.df, self.lines)
-            return chart.dump_options_with_quotes()
+            loaded = self.load(name)
+            length = len(loaded["df"])
+            dates, data, info = self.window(length - max(1, length // 20), length, loaded = loaded)
+            df = pd.DataFrame({key : data[key] for key in ["open", "high", "low", "close", "volume"] + CHART_LINES}, index = dates)
+            lines = []
+            for i, (line, values) in enumerate(zip(self.lines, data["lines"])):
+                df[f"line_{i}"] = values
+                lines.append({**line, "function" : lambda df, column = f"line_{i}" : df[column]})
+            chart = charts(df, lines, range_start = info["zoom_start"], range_end = info["zoom_end"])
+            return jsonify({"name" : name, "options" : json.loads(chart.dump_options_with_quotes()), "window" : info})
+
+        @self.app.route("/chart_data/<name>")
+        # 按范围获取图表数据的路由（缩放或平移时由浏览器请求）：参数start, end（行索引）和可选的points。
+        def chart_data(name):
+            loaded = self._get_loaded(name)
+            dates, data, info = self.window(
+                request.args.get("start", 0, type = int),
+                request.args.get("end", len(loaded["df"]), type = int),
+                request.args.get("points", None, type = int),
+                loaded = loaded,
+            )
+            candles = np.column_stack([data["open"], data["close"], data["low"], data["high"]])
+            series = [candles] + data["lines"] + [data["volume"]] + [data[key] for key in CHART_LINES]
+            return jsonify({
+                "dates" : dates.strftime("%Y-%m-%d %H:%M").tolist(),
+                # 与图表中的序列顺序相同：K线、自定义线条、交易量、投资组合价值、头寸、累计奖励。NaN转换为null。
+                "series" : [np.where(np.isnan(values), None, values).tolist() for values in series],
+                "window" : info,
+            })
 
         @self.app.route("/metrics")
         # 获取指标数据的路由。
         def get_metrics():
-            self.compute_metrics(self.df)
-            return jsonify([{'name':metric['name'], 'value':metric['value']} for metric in self.metrics])
+            # 不写入共享的self.metrics（其他请求可能同时计算）。
+            df = self.df
+            return jsonify([{'name':metric['name'], 'value':metric['function'](df)} for metric in self.metrics])
 
         self.app.run()
 
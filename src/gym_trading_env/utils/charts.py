@@ -7,16 +7,18 @@ import numpy as np
 
 import pandas as pd
 
-def charts(df, lines = []):
+def charts(df, lines = [], range_start = 95, range_end = 100):
     # 定义图表函数，接受DataFrame和可选的线条列表作为输入。
     # `df` 是包含市场数据的DataFrame。
     # `lines` 是一个列表，包含要在图表上绘制的额外线条的配置。
+    # `range_start`, `range_end` 是初始可见范围（百分比）。
     line_key = "ievi4G3vG678Vszad"
     for line in lines:
         df[line_key + line["name"]] = line["function"](df)
     
     df['date_str'] = df.index.strftime("%Y-%m-%d %H:%M")
-    df["cumulative_rewards"] = df["reward"].cumsum()
+    # 降采样后的数据已经包含累计奖励（不能再对降采样后的奖励求和）。
+    if "cumulative_rewards" not in df: df["cumulative_rewards"] = df["reward"].cumsum()
     datas = df[["date_str", "open", "close","low","high"]].to_numpy()
 
     x_data = datas[:, 0].tolist()
@@ -71,16 +73,16 @@ def charts(df, lines = []):
                     is_show=False,
                     type_="inside",
                     xaxis_index=[0, 1, 2, 3, 4],
-                    range_start=98,
-                    range_end=100,
+                    range_start=range_start,
+                    range_end=range_end,
                 ),
                 opts.DataZoomOpts(
                     is_show=True,
                     xaxis_index=[0, 1, 2, 3, 4],
                     type_="slider",
                     pos_top=architecture["randle_slider"]["top_%"],
-                    range_start=95,
-                    range_end=100,
+                    range_start=range_start,
+                    range_end=range_end,
                 ),],
             legend_opts=opts.LegendOpts(is_show=False),
             # tooltip_opts=opts.TooltipOpts(trigger="axis", axis_pointer_type="line"), # 提示框配置，当鼠标悬停在图表上时显示数据信息。
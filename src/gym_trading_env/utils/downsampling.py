@@ -0,0 +1,51 @@
+import numpy as np
+
+def bucket_edges(start, end, points):
+    # 将 [start, end) 分成最多points个等长的桶（最后一个桶可能更短）。
+    # 返回桶的边界（长度为桶数 + 1，第i个桶为 [edges[i], edges[i+1])）。
+    size = max(1, -(-(end - start) // points))
+    return np.append(np.arange(start, end, size), end).astype(np.int64)
+
+def aggregate_ohlc(opens, highs, lows, closes, edges):
+    # 每个桶合并为一根K线：第一根的开盘价、最高价的最大值、最低价的最小值、最后一根的收盘价。
+    first, last = edges[0], edges[-1]
+    starts = edges[:-1] - first
+    return (
+        opens[edges[:-1]],
+        np.maximum.reduceat(highs[first:last], starts),
+        np.minimum.reduceat(lows[first:last], starts),
+        closes[edges[1:] - 1],
+    )
+
+def aggregate_sum(values, edges):
+    # 每个桶的和（例如交易量）。
+    return np.add.reduceat(values[edges[0]:edges[-1]], edges[:-1] - edges[0])
+
+def lttb(values, edges):
+    # Largest-Triangle-Three-Buckets降采样：在每个桶中选择一个点，使它与上一个选中的点、下一个桶的平均点组成的三角形面积最大，
+    # 从而保留曲线的形状（峰值和谷值）。x坐标为索引；第一个桶选择第一个点，最后一个桶选择最后一个点。
+    # 返回选中的点的索引（每个桶一个）。NaN（例如移动平均线的开头）不会被优先选中。
+    values = np.asarray(values, dtype= np.float64)
+    nb_buckets = len(edges) - 1
+    # 每个桶只有一个点：不需要降采样。
+    if nb_buckets == edges[-1] - edges[0]: return np.arange(edges[0], edges[-1])
+    selected = np.empty(nb_buckets, dtype= np.int64)
+    selected[0] = edges[0]
+    if nb_buckets == 1: return selected
+    selected[-1] = edges[-1] - 1
+    for i in range(1, nb_buckets - 1):
+        previous = selected[i - 1]
+        following = values[edges[i + 1]:edges[i + 2]]
+        valid = ~np.isnan(following)
+        if valid.any():
+            # 平均点只使用下一个桶中非NaN的点（x和y使用相同的点）。
+            mean_x = np.flatnonzero(valid).mean() + edges[i + 1]
+            mean_y = following[valid].mean()
+        else:
+            mean_x, mean_y = (edges[i + 1] + edges[i + 2] - 1) / 2, values[previous]
+        x = np.arange(edges[i], edges[i + 1])
+        y = values[edges[i]:edges[i + 1]]
+        area = np.abs((previous - mean_x) * (y - values[previous]) - (previous - x) * (mean_y - values[previous]))
+        area[np.isnan(area)] = -1
+        selected[i] = edges[i] + int(np.argmax(area))
+    return selected
@@ -0,0 +1,107 @@
+import numpy as np
+
+# 内置动态特征的名称（可以直接放在dynamic_feature_functions列表中）。
+PORTFOLIO_FEATURES = ("last_position", "real_position", "unrealized_pnl", "time_in_position", "drawdown")
+
+def check_portfolio_features(names):
+    unknown = [name for name in names if name not in PORTFOLIO_FEATURES]
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown dynamic features {unknown}. Available features : {PORTFOLIO_FEATURES}")
+
+class PortfolioFeatures:
+    """
+    Built-in dynamic features, maintained directly from the portfolio state of the environment (no History lookup) :
+
+    * ``"last_position"`` : last position taken by the agent.
+    * ``"real_position"`` : real position of the portfolio (that varies with the price).
+    * ``"unrealized_pnl"`` : return of the portfolio since the last position change (:math:`\\frac{v_{t}}{v_{entry}} - 1`).
+    * ``"time_in_position"`` : number of steps since the last position change.
+    * ``"drawdown"`` : drawdown of the portfolio valuation since the beginning of the episode (:math:`\\frac{v_{t}}{max(v)} - 1`).
+
+    :param names: Names of the features, in the order of the observation.
+    :type names: list[str]
+    """
+    def __init__(self, names):
+        check_portfolio_features(names)
+        self.names = list(names)
+        self.values = [0.0] * len(self.names)
+
+    def reset(self, position, real_position, valuation):
+        # 用episode开始时的状态重置特征。
+        self.position = position
+        self.valuation = valuation
+        self.entry_valuation = valuation
+        self.peak_valuation = valuation
+        self.time_in_position = 0
+        self._write(position, real_position, valuation)
+
+    def update(self, position, real_position, valuation):
+        # 在每一步之后更新特征（position为这一步结束时的头寸）。
+        if position != self.position:
+            # 头寸变化时，以交易时（上一步）的估值作为入场估值。
+            self.entry_valuation = self.valuation
+            self.time_in_position = 0
+        else:
+            self.time_in_position += 1
+        if valuation > self.peak_valuation: self.peak_valuation = valuation
+        self.position = position
+        self.valuation = valuation
+        self._write(position, real_position, valuation)
+
+    def advance(self, nb_steps, peak_valuation, valuation):
+        # 在头寸不变的情况下一次前进nb_steps步（例如TradingEnv.fast_forward），不计算中间步的特征值。
+        # peak_valuation: 这些步中的最高估值；valuation: 最后一步的估值。
+        self.time_in_position += nb_steps
+        if peak_valuation > self.peak_valuation: self.peak_valuation = peak_valuation
+        self.valuation = valuation
+
+    def _write(self, position, real_position, valuation):
+        for i, name in enumerate(self.names):
+            if name == "last_position": self.values[i] = position
+            elif name == "real_position": self.values[i] = real_position
+            elif name == "unrealized_pnl": self.values[i] = valuation / self.entry_valuation - 1
+            elif name == "time_in_position": self.values[i] = self.time_in_position
+            else: self.values[i] = valuation / self.peak_valuation - 1
+
+class PortfolioFeaturesArray:
+    # PortfolioFeatures的数组版本：同时维护多个环境（例如VectorTradingEnv的所有子环境）的内置动态特征。
+    # reset和update的输入是所有环境的值（长度为num_envs的数组），只有mask为True的环境会被更新。
+    def __init__(self, names, num_envs):
+        check_portfolio_features(names)
+        self.names = list(names)
+        self.num_envs = num_envs
+        self.position = np.zeros(num_envs)
+        self.valuation = np.ones(num_envs)
+        self.entry_valuation = np.ones(num_envs)
+        self.peak_valuation = np.ones(num_envs)
+        self.time_in_position = np.zeros(num_envs)
+        # 当前的特征值（每个环境一行）。
+        self.values = np.zeros((num_envs, len(self.names)), dtype= np.float32)
+
+    def reset(self, mask, position, real_position, valuation):
+        np.copyto(self.position, position, where= mask)
+        np.copyto(self.valuation, valuation, where= mask)
+        np.copyto(self.entry_valuation, valuation, where= mask)
+        np.copyto(self.peak_valuation, valuation, where= mask)
+        np.copyto(self.time_in_position, 0, where= mask)
+        self._write(mask, position, real_position, valuation)
+
+    def update(self, mask, position, real_position, valuation):
+        # 使用np.copyto(..., where = mask)而不是布尔索引，避免每步复制被选中的元素。
+        changed = mask & (self.position != position)
+        np.copyto(self.entry_valuation, self.valuation, where= changed)
+        self.time_in_position += mask
+        np.copyto(self.time_in_position, 0, where= changed)
+        np.copyto(self.peak_valuation, np.maximum(self.peak_valuation, valuation), where= mask)
+        np.copyto(self.position, position, where= mask)
+        np.copyto(self.valuation, valuation, where= mask)
+        self._write(mask, position, real_position, valuation)
+
+    def _write(self, mask, position, real_position, valuation):
+        for i, name in enumerate(self.names):
+            if name == "last_position": value = position
+            elif name == "real_position": value = real_position
+            elif name == "unrealized_pnl": value = valuation / self.entry_valuation - 1
+            elif name == "time_in_position": value = self.time_in_position
+            else: value = valuation / self.peak_valuation - 1
+            np.copyto(self.values[:, i], value, where= mask, casting= "same_kind")
@@ -0,0 +1,101 @@
+import time
+import zlib
+import random
+import asyncio
+import numpy as np
+import pandas as pd
+import ccxt.async_support as ccxt
+
+class FakeExchange:
+    """
+    Local exchange with the ``fetch_ohlcv`` and ``close`` coroutines of a ccxt async exchange, serving deterministic synthetic candles.
+    It simulates the network latency, the rate limit and the errors of a real exchange, to measure and tune the downloader offline
+    (see ``gym_trading_env.downloader.benchmark``). It can also be passed to ``download(..., exchanges = {"fake": FakeExchange()})``.
+
+    :param latency: Duration of each request (seconds).
+    :type latency: optional - float
+
+    :param latency_jitter: Maximum random delay added to the latency of each request (seconds).
+    :type latency_jitter: optional - float
+
+    :param rate_limit: Maximum number of requests per second accepted by the exchange (token bucket). Requests above it fail with ``ccxt.RateLimitExceeded``. By default, no limit.
+    :type rate_limit: optional - float
+
+    :param burst: Maximum number of consecutive requests accepted when the exchange is idle (with ``rate_limit``).
+    :type burst: optional - int
+
+    :param error_rate: Probability that a request fails with ``ccxt.RequestTimeout``.
+    :type error_rate: optional - float
+
+    :param max_limit: Maximum number of candles per response.
+    :type max_limit: optional - int
+
+    :param seed: Seed of the latency and error draws.
+    :type seed: optional - int
+    """
+    def __init__(self, latency = 0.05, latency_jitter = 0, rate_limit = None, burst = 1, error_rate = 0, max_limit = 1000, seed = None):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.error_rate = error_rate
+        self.max_limit = max_limit
+        self._random = random.Random(seed)
+        self._tokens = burst
+        self._last = time.monotonic()
+        # 统计：请求数、被限速拒绝的请求数、注入的错误数、返回的K线数、同时进行的最大请求数。
+        self.nb_requests = 0
+        self.nb_rate_limited = 0
+        self.nb_errors = 0
+        self.nb_candles = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _accept(self):
+        # 交易所一侧的令牌桶：没有令牌时拒绝请求（而不是等待）。
+        if self.rate_limit is None: return True
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate_limit)
+        self._last = now
+        if self._tokens < 1: return False
+        self._tokens -= 1
+        return True
+
+    @staticmethod
+    def candles(symbol, timestamps, timedelta):
+        # 合成的K线（只取决于交易对和时间戳，不同请求返回的同一根K线相同）。
+        phase = zlib.crc32(symbol.encode()) % 1000
+        def price(t):
+            return 100 * np.exp(0.2 * np.sin(t / 8.64E7 / 30 + phase) + 0.02 * np.sin(t / 3.6E6 + phase))
+        opens, closes = price(timestamps - timedelta), price(timestamps)
+        highs = np.maximum(opens, closes) * 1.001
+        lows = np.minimum(opens, closes) * 0.999
+        volumes = 10 + 5 * np.sin(timestamps / 3.6E6 / 6 + phase) ** 2
+        return [list(candle) for candle in zip(timestamps.tolist(), opens.tolist(), highs.tolist(), lows.tolist(), closes.tolist(), volumes.tolist())]
+
+    async def fetch_ohlcv(self, symbol, timeframe = "1m", since = None, limit = None, params = {}):
+        self.nb_requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if not self._accept():
+                self.nb_rate_limited += 1
+                raise ccxt.RateLimitExceeded(f"Rate limit exceeded ({self.rate_limit} requests per second)")
+            await asyncio.sleep(self.latency + self._random.uniform(0, self.latency_jitter))
+            if self._random.random() < self.error_rate:
+                self.nb_errors += 1
+                raise ccxt.RequestTimeout("Injected request timeout")
+            timedelta = int(pd.Timedelta(timeframe).total_seconds()*1E3)
+            limit = self.max_limit if limit is None else min(limit, self.max_limit)
+            now = int(time.time()*1E3)
+            if since is None: since = now - limit * timedelta
+            first = -(-since // timedelta) * timedelta
+            # 与真实的交易所一样，只返回已经开始的K线。
+            timestamps = np.arange(first, min(first + limit * timedelta, now + 1), timedelta, dtype= np.int64)
+            self.nb_candles += len(timestamps)
+            return self.candles(symbol, timestamps, timedelta)
+        finally:
+            self.in_flight -= 1
+
+    async def close(self):
+        pass
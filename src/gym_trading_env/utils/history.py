@@ -1,34 +1,33 @@
+import numbers
+import weakref
+import functools
 import numpy as np
+from collections import namedtuple
 
 class History:
     # 历史记录类，用于存储和管理环境运行过程中的各种信息。
-    def __init__(self, max_size = 10000):
+    # 每一列单独存储为一个连续的、带类型的numpy数组（float64、int64、datetime64...），
+    # 只有无法用数值类型表示的列（例如字符串）才使用object数组。
+    def __init__(self, max_size = 10000, dtypes = None, ring = False):
         # 初始化历史记录。
         # max_size: 历史记录的最大容量。
+        # dtypes: 可选字典，为某些输入强制指定列类型，例如 {"reward": np.float64}。
+        #         键可以是set/add的参数名（作用于其展开后的所有列），也可以是展开后的列名。
+        # ring: 如果为True，历史记录是一个环形缓冲区：容量已满后，新的一行覆盖最旧的一行（只保留最近max_size行）。
+        #       否则，容量已满时添加数据会抛出错误。
         self.height = max_size
-    def set(self, **kwargs):
-        # 设置历史记录的初始状态和列名。
-        # kwargs: 键值对，表示要记录的初始数据。
-        # 将输入展平以放入np.array中
-        self.columns = []
-        for name, value in kwargs.items():
-            if isinstance(value, list):
-                self.columns.extend([f"{name}_{i}" for i in range(len(value))])
-            elif isinstance(value, dict):
-                self.columns.extend([f"{name}_{key}" for key in value.keys()])
-            else:
-            # 如果列不匹配，则抛出错误。
-                self.columns.append(name)
-        
-        self.width = len(self.columns)
-        self.history_storage = np.zeros(shape=(self.height, self.width), dtype= 'O')
+        self.dtypes = {} if dtypes is None else dict(dtypes)
+        self.ring = ring
         self.size = 0
-        self.add(**kwargs)
-    def add(self, **kwargs):
-        # 向历史记录中添加新的数据。
-        # kwargs: 键值对，表示要添加的数据。
-        values = []
-        columns = []
+        # 第0行（最旧的一行）在存储中的位置。只有环形缓冲区已满时才不为0。
+        self._start = 0
+        self._storage = []
+        # 尚未完整取值的HistoryRowView（行号 -> 弱引用列表），在它们的行被覆盖前取出所有值。
+        # 视图被回收时，弱引用的回调将它从字典中删除（字典的大小不超过仍然存在的视图数量）。
+        self._views = {}
+    def _flatten(self, kwargs):
+        # 将输入展平为列名列表和值列表。
+        columns, values = [], []
         for name, value in kwargs.items():
             if isinstance(value, list):
                 columns.extend([f"{name}_{i}" for i in range(len(value))])
@@ -39,63 +38,353 @@ class History:
             else:
                 columns.append(name)
                 values.append(value)
+        return columns, values
+    def _infer_dtype(self, value):
+        # 根据初始值推断列类型。
+        if isinstance(value, (bool, np.bool_)):
+            return np.bool_
+        if isinstance(value, numbers.Integral):
+            return np.int64
+        if isinstance(value, numbers.Real):
+            return np.float64
+        if isinstance(value, np.datetime64):
+            return value.dtype
+        return object
+    def _set_storage(self, column_index, storage):
+        # 设置某列的存储数组，并记录该列能无损接受的Python/numpy类型（object列为None，接受一切）。
+        self._storage[column_index] = storage
+        self._accepted_types[column_index] = {
+            "f": (float, int, np.floating, np.integer),
+            "i": (int, np.integer),
+            "b": (bool, np.bool_),
+            "M": (np.datetime64,),
+        }.get(storage.dtype.kind, None if storage.dtype.kind == "O" else ())
+    def _widen(self, column_index, value):
+        # 当新值无法用当前列类型表示时（例如int列收到float），将该列提升为更宽的类型。
+        storage = self._storage[column_index]
+        if storage.dtype.kind in "ib" and isinstance(value, numbers.Real) and not isinstance(value, (bool, np.bool_)):
+            dtype = np.float64
+        else:
+            dtype = object
+        self._set_storage(column_index, storage.astype(dtype))
+    def _widen_to_array(self, column_index, values):
+        # extend使用的版本：确保该列能无损接受values数组的所有值，否则提升列类型。
+        storage = self._storage[column_index]
+        kind, values_kind = storage.dtype.kind, values.dtype.kind
+        if kind == "O" or values.size == 0: return
+        if kind == values_kind == "M": return
+        if kind in "biuf" and values_kind in "biuf":
+            dtype = np.result_type(storage.dtype, values.dtype)
+            if dtype == storage.dtype: return
+            if dtype.kind in "biuf":
+                self._set_storage(column_index, storage.astype(dtype))
+                return
+        self._set_storage(column_index, storage.astype(object))
+    def _write(self, column_index, row, value):
+        # 将单个值写入指定列的指定行。
+        accepted_types = self._accepted_types[column_index]
+        if accepted_types is not None and not isinstance(value, accepted_types):
+            self._widen(column_index, value)
+        self._storage[column_index][row] = value
+    def _get_column_index(self, column):
+        try:
+            return self._columns_index[column]
+        except KeyError as e:
+            # 如果指定的特征不存在，则抛出错误。
+            raise ValueError(f"Feature {column} does not exist ... Check the available features : {self.columns}")
+    def set(self, **kwargs):
+        # 设置历史记录的初始状态和列名。
+        # kwargs: 键值对，表示要记录的初始数据。
+        self._release_views()
+        # 将输入展平以放入按列存储的np.array中
+        self.columns, values = self._flatten(kwargs)
+        self._columns_index = {column : i for i, column in enumerate(self.columns)}
+        # 记录每一列来自哪个参数，以便按参数名查找dtypes。
+        names = []
+        for name, value in kwargs.items():
+            names.extend([name] * (len(value) if isinstance(value, (list, dict)) else 1))
 
-        if columns == self.columns:
+        self.width = len(self.columns)
+        self._storage = [None] * self.width
+        self._accepted_types = [None] * self.width
+        for column_index, (column, value, name) in enumerate(zip(self.columns, values, names)):
+            dtype = self.dtypes.get(column, self.dtypes.get(name, None))
+            if dtype is None: dtype = self._infer_dtype(value)
+            self._set_storage(column_index, np.zeros(shape=(self.height,), dtype= dtype))
+        self.size = 0
+        self._start = 0
+        self._last_layout = None
+        self.add(**kwargs)
+    def _layout(self, kwargs):
+        # 输入结构的轻量签名，用于在每步中快速判断列是否与初始列一致，避免重复构造列名。
+        return tuple(
+            (name, tuple(value) if isinstance(value, dict) else len(value) if isinstance(value, list) else None)
+            for name, value in kwargs.items()
+        )
+    def add(self, **kwargs):
+        # 向历史记录中添加新的数据。
+        # kwargs: 键值对，表示要添加的数据。
+        layout = self._layout(kwargs)
+        if layout != self._last_layout:
             # 检查新数据的列是否与现有列匹配。
-            # 如果匹配，则将数据添加到存储中。
-            self.history_storage[self.size, :] = values
-            self.size = min(self.size+1, self.height)
+            columns, _ = self._flatten(kwargs)
+            if columns != self.columns:
+                raise ValueError(f"Make sur that your inputs match the initial ones... Initial ones : {self.columns}. New ones {columns}")
+            self._last_layout = layout
+
+        values = []
+        for value in kwargs.values():
+            if isinstance(value, dict): values.extend(value.values())
+            elif isinstance(value, list): values.extend(value)
+            else: values.append(value)
+        self.add_row(values)
+    def add_row(self, values):
+        # 按列的顺序添加一行已经展平的数据（跳过add中的展平和列名检查，供环境每步调用）。
+        # values: 长度为width的序列。
+        if len(values) != self.width:
+            raise ValueError(f"Expected {self.width} values (one per column : {self.columns}), got {len(values)}")
+        if self.size < self.height:
+            row = self.size
+            self.size += 1
+        elif self.ring:
+            # 覆盖最旧的一行。
+            row = self._start
+            self._start = (self._start + 1) % self.height
         else:
+            raise ValueError(f"History is full (max_size = {self.height}). Use a larger max_size or ring = True.")
+        if self._views: self._release_views([row])
+        # 将数据逐列写入存储中。
+        for column_index, (storage, accepted_types, value) in enumerate(zip(self._storage, self._accepted_types, values)):
+            if accepted_types is not None and not isinstance(value, accepted_types):
+                self._widen(column_index, value)
+                storage = self._storage[column_index]
+            storage[row] = value
+    def extend(self, **kwargs):
+        # 一次性向历史记录中添加多行数据（按列写入）。
+        # kwargs: 与add相同的键值对，但每个值为长度相同的数组（字典的值也为数组，列表的元素也为数组）。
+        columns, values = self._flatten(kwargs)
+        if columns != self.columns:
             raise ValueError(f"Make sur that your inputs match the initial ones... Initial ones : {self.columns}. New ones {columns}")
+        values = [np.asarray(value) for value in values]
+        length = len(values[0]) if len(values) > 0 else 0
+        if self.size + length > self.height and not self.ring:
+            raise ValueError(f"Cannot add {length} rows to a History of size {self.size} and max_size {self.height}")
+        if length > self.height:
+            # 环形缓冲区只保留最后height行。
+            values = [value[-self.height:] for value in values]
+            self.size, self._start, length = 0, 0, self.height
+        first = (self._start + self.size) % self.height
+        rows = slice(first, first + length) if first + length <= self.height else (first + np.arange(length)) % self.height
+        if self._views: self._release_views(np.arange(self.height)[rows].tolist())
+        for column_index, value in enumerate(values):
+            if value.dtype.kind == "O":
+                # 让numpy根据实际值推断更具体的类型（例如object数组中全是浮点数）。
+                value = np.array(value.tolist())
+            self._widen_to_array(column_index, value)
+            self._storage[column_index][rows] = value
+        overwritten = max(0, self.size + length - self.height)
+        self.size += length - overwritten
+        self._start = (self._start + overwritten) % self.height
+    def reserve(self, capacity):
+        # 将容量扩大到至少capacity行（存储按时间顺序重新排列）。
+        if capacity <= self.height: return
+        # 行号会改变：先让所有视图取出它们的值。
+        self._release_views()
+        for column_index, storage in enumerate(self._storage):
+            new_storage = np.zeros(shape=(capacity,), dtype= storage.dtype)
+            new_storage[:self.size] = self._column(column_index)
+            self._storage[column_index] = new_storage
+        self._start = 0
+        self.height = capacity
     def __len__(self):
         # 返回历史记录中当前存储的条目数量。
         return self.size
+    def _row(self, t):
+        # 将时间索引（支持负数）转换为存储中的行号（环形缓冲区中可能绕回存储的开头）。
+        if t < 0: t += self.size
+        if not 0 <= t < self.size:
+            raise IndexError(f"Index {t} is out of bounds for History of size {self.size}")
+        t += self._start
+        return t - self.height if t >= self.height else t
+    def _column(self, column_index):
+        # 按时间顺序返回某列的数组：未绕回时为存储的视图，否则为拼接后的副本。
+        storage = self._storage[column_index]
+        if self._start == 0:
+            return storage[:self.size]
+        return np.concatenate([storage[self._start:], storage[:self._start]])
+    def row_reader(self, columns):
+        # 返回一个函数read(t = -1)：读取指定列在第t行的值，返回一个轻量的namedtuple（HistoryRow）。
+        # 列索引只解析一次，之后每次读取不再查找列名，也不构造整行的字典。
+        # 列名不是合法的Python标识符时（例如"data_Volume USD"），对应字段按位置访问。
+        column_indexes = [self._get_column_index(column) for column in columns]
+        row_type = namedtuple("HistoryRow", columns, rename= True)
+        storage = self._storage
+        def read(t = -1):
+            t = self._row(t)
+            return row_type._make([storage[column_index][t] for column_index in column_indexes])
+        return read
+    def row_view(self, t = -1):
+        # 返回第t行的惰性字典视图（HistoryRowView）：只有在读取某个键时才从存储中取值。
+        # 在这一行被覆盖或修改之前（环形缓冲区绕回、__setitem__、reserve、set），视图会先取出所有值，因此它的内容不会改变。
+        row = self._row(t)
+        view = HistoryRowView(self, row)
+        self._views.setdefault(row, []).append(weakref.ref(view, functools.partial(_forget_view, self._views, row)))
+        return view
+    def _release_views(self, rows = None):
+        # 让指定行（默认为所有行）的视图取出所有值，并与History断开。
+        if rows is None:
+            references = [reference for references in self._views.values() for reference in references]
+            self._views = {}
+        else:
+            references = [reference for row in rows for reference in self._views.pop(row, ())]
+        for reference in references:
+            view = reference()
+            if view is not None: view._detach()
     def __getitem__(self, arg):
         # 允许通过索引或切片访问历史记录中的数据。
         # arg: 可以是列名、索引或两者的组合。
         if isinstance(arg, tuple):
-            column, t = arg
-        # 解析列名和时间索引。
             # 如果arg是元组，表示按列和时间索引访问。
-            try:
-                column_index = self.columns.index(column)
-            except ValueError as e:
-            # 如果指定的特征不存在，则抛出错误。
-                # 如果指定的特征不存在，则抛出错误。
-                # 如果指定的特征不存在，则抛出错误。
-                raise ValueError(f"Feature {column} does not exist ... Check the available features : {self.columns}")
-            return self.history_storage[:self.size][t, column_index]
+            column, t = arg
+            column_index = self._get_column_index(column)
+            if isinstance(t, (int, np.integer)):
+                return self._storage[column_index][self._row(t)]
+            return self._column(column_index)[t]
         if isinstance(arg, int):
             # 如果arg是整数，表示按时间索引访问。
-            t = arg
-            return dict(zip(self.columns, self.history_storage[:self.size][t]))
+            t = self._row(arg)
+            return {column : storage[t] for column, storage in zip(self.columns, self._storage)}
         if isinstance(arg, str):
-            # 如果arg是字符串，表示按列名访问。
-            column = arg
-            try:
-                column_index = self.columns.index(column)
-            except ValueError as e:
-                raise ValueError(f"Feature {column} does not exist ... Check the available features : {self.columns}")
-            return self.history_storage[:self.size][:, column_index]
+            # 如果arg是字符串，表示按列名访问。返回该列的类型化数组（按时间顺序）。
+            return self._column(self._get_column_index(arg))
         if isinstance(arg, list):
             # 如果arg是列表，表示按多个列名访问。
-            columns = arg
-            column_indexes = []
-            for column in columns:
-                try:
-                    column_indexes.append(self.columns.index(column))
-                except ValueError as e:
-                    # 如果指定的特征不存在，则抛出错误。
-                    raise ValueError(f"Feature {column} does not exist ... Check the available features : {self.columns}")
-            return self.history_storage[:self.size][:, column_indexes]
+            # 若所有列类型相同（或均为数值类型）则返回带类型的二维数组，否则返回object数组。
+            column_indexes = [self._get_column_index(column) for column in arg]
+            arrays = [self._column(column_index) for column_index in column_indexes]
+            if len(arrays) == 0:
+                return np.zeros(shape=(self.size, 0))
+            dtypes = set(array.dtype for array in arrays)
+            if len(dtypes) == 1 or all(dtype.kind in "biuf" for dtype in dtypes):
+                return np.stack(arrays, axis = 1)
+            result = np.empty(shape=(self.size, len(arrays)), dtype= 'O')
+            for i, array in enumerate(arrays):
+                result[:, i] = array
+            return result
 
     def __setitem__(self, arg, value):
         # 允许设置历史记录中特定位置的值。
-        # arg: 列名和时间索引的元组。
-        # value: 要设置的新值。
+        # arg: 列名和时间索引（整数或切片）的元组。
+        # value: 要设置的新值（切片时为数组）。
         column, t = arg
+        column_index = self._get_column_index(column)
+        if isinstance(t, (int, np.integer)):
+            row = self._row(t)
+            if self._views: self._release_views([row])
+            self._write(column_index, row, value)
+            return
+        # 将时间索引转换为存储中的行号（环形缓冲区中可能绕回存储的开头）。
+        rows = (self._start + np.arange(self.size)[t]) % self.height
+        if self._views: self._release_views(np.atleast_1d(rows).tolist())
+        value = np.asarray(value)
+        self._widen_to_array(column_index, value)
+        self._storage[column_index][rows] = value
+
+def _forget_view(views, row, reference):
+    # 弱引用的回调：视图被回收后，从views（History._views）中删除它的弱引用（行没有其他视图时删除这一行）。
+    # 视图可能已经被_release_views取出（此时views中没有它）。
+    references = views.get(row)
+    if references is None: return
+    try:
+        references.remove(reference)
+    except ValueError:
+        return
+    if len(references) == 0: del views[row]
+
+class HistoryRowView(dict):
+    # History中一行的惰性字典视图（step返回的info）。
+    # 创建时不复制任何值：读取某个键时才从History的存储中取值（并缓存）；
+    # 需要整个字典时（遍历、len、items、打印、序列化...）才一次性取出所有列。
+    # 它是dict的子类，可以在任何需要dict的地方使用（例如gymnasium的检查和向量化环境）。
+    # 生命周期：视图读取的是History中的一个物理行，该行被覆盖或修改之前（环形缓冲区绕回、extend、__setitem__、reserve、set），
+    # History会先调用_detach取出所有值并断开连接，因此视图的值始终是创建时那一步的值，之后不再变化。
+    # 例外：在视图创建之后、该行被修改之前，直接修改History存储数组（_storage）的代码会被视图看到。
+    __slots__ = ("_history", "_t", "_complete", "__weakref__")
+    def __init__(self, history, t):
+        super().__init__()
+        self._history = history
+        self._t = t
+        self._complete = False
+    def _value(self, key):
+        column_index = self._history._columns_index[key]
+        return self._history._storage[column_index][self._t]
+    def _materialize(self):
+        # 取出所有尚未读取的列（不覆盖已经设置的键）。
+        if not self._complete:
+            self._complete = True
+            for key in self._history.columns:
+                if not dict.__contains__(self, key): dict.__setitem__(self, key, self._value(key))
+    def _detach(self):
+        # 取出所有值并与History断开（History即将覆盖或移动这一行时调用）。
+        self._materialize()
+        self._history = None
+    def __missing__(self, key):
+        if self._complete or key not in self._history._columns_index:
+            raise KeyError(key)
+        value = self._value(key)
+        dict.__setitem__(self, key, value)
+        return value
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or (not self._complete and key in self._history._columns_index)
+    def get(self, key, default = None):
         try:
-            column_index = self.columns.index(column)
-        except ValueError as e:
-            raise ValueError(f"Feature {column} does not exist ... Check the available features : {self.columns}")
-        self.history_storage[:self.size][t, column_index] = value
\ No newline at end of file
+            return self[key]
+        except KeyError:
+            return default
+    def __iter__(self):
+        self._materialize()
+        return dict.__iter__(self)
+    def __len__(self):
+        self._materialize()
+        return dict.__len__(self)
+    def keys(self):
+        self._materialize()
+        return dict.keys(self)
+    def values(self):
+        self._materialize()
+        return dict.values(self)
+    def items(self):
+        self._materialize()
+        return dict.items(self)
+    def __delitem__(self, key):
+        self._materialize()
+        dict.__delitem__(self, key)
+    def pop(self, key, *args):
+        self._materialize()
+        return dict.pop(self, key, *args)
+    def popitem(self):
+        self._materialize()
+        return dict.popitem(self)
+    def setdefault(self, key, default = None):
+        if key not in self: dict.__setitem__(self, key, default)
+        return self[key]
+    def clear(self):
+        self._complete = True
+        dict.clear(self)
+    def copy(self):
+        self._materialize()
+        return dict(dict.items(self))
+    def __eq__(self, other):
+        self._materialize()
+        return dict.__eq__(self, other)
+    def __ne__(self, other):
+        return not self == other
+    def __or__(self, other):
+        self._materialize()
+        return dict.__or__(self, other)
+    def __repr__(self):
+        self._materialize()
+        return dict.__repr__(self)
+    def __reduce__(self):
+        # 序列化为普通字典（例如发送到其他进程时），不序列化整个History。
+        return (dict, (self.copy(),))
@@ -0,0 +1,78 @@
+import numpy as np
+
+class IncrementalFunction:
+    """
+    Base class of the incremental reward functions and dynamic features.
+    Instead of receiving the whole History at each step, an incremental function declares the History ``columns`` it needs,
+    and receives the latest row as a lightweight ``namedtuple`` (column indexes are resolved once per episode, at reset).
+    It can keep its own state between steps (running sums, previous values...), which makes each step O(1) instead of rescanning the History.
+
+    .. code-block:: python
+
+        from gym_trading_env.utils.incremental import IncrementalFunction
+
+        class LogReturnReward(IncrementalFunction):
+            columns = ["portfolio_valuation"]
+            def reset(self, row):
+                self.last_valuation = row.portfolio_valuation
+            def __call__(self, row):
+                reward = np.log(row.portfolio_valuation / self.last_valuation)
+                self.last_valuation = row.portfolio_valuation
+                return reward
+
+        env = gym.make("TradingEnv", ..., reward_function = LogReturnReward())
+
+    * ``reset(row)`` is called once per episode with the first row of the History.
+    * ``__call__(row)`` is called with the latest row and returns a float : at each step for a reward function (not at reset), at reset and at each step for a dynamic feature.
+
+    Fields of the row are accessed by attribute (``row.portfolio_valuation``), or by position when the column name is not a valid Python identifier.
+    """
+    columns = []
+    def reset(self, row):
+        pass
+    def __call__(self, row):
+        raise NotImplementedError
+
+class LogReturnReward(IncrementalFunction):
+    """
+    Incremental version of the default reward function : :math:`r_{t} = ln(\\frac{p_{t}}{p_{t-1}})`, where :math:`p_{t}` is the portfolio valuation at step t.
+    """
+    columns = ["portfolio_valuation"]
+    def reset(self, row):
+        self.last_valuation = row.portfolio_valuation
+    def __call__(self, row):
+        reward = np.log(row.portfolio_valuation / self.last_valuation)
+        self.last_valuation = row.portfolio_valuation
+        return reward
+
+class DifferentialSharpeRatioReward(IncrementalFunction):
+    """
+    Differential Sharpe ratio (Moody & Saffell, 2001) computed on the log returns of the portfolio.
+    The mean :math:`A_{t}` and the second moment :math:`B_{t}` of the returns are exponential moving averages updated at each step, so each step costs O(1) :
+
+    .. math::
+
+        D_{t} = \\frac{B_{t-1} \\Delta A_{t} - \\frac{1}{2} A_{t-1} \\Delta B_{t}}{(B_{t-1} - A_{t-1}^2)^{3/2}}
+        \\text{, where } \\Delta A_{t} = R_{t} - A_{t-1} \\text{ and } \\Delta B_{t} = R_{t}^2 - B_{t-1}
+
+    :param eta: Adaptation rate of the moving averages (about 1 / number of steps taken into account).
+    :type eta: optional - float
+    """
+    columns = ["portfolio_valuation"]
+    def __init__(self, eta = 0.01):
+        self.eta = eta
+    def reset(self, row):
+        self.last_valuation = row.portfolio_valuation
+        self.mean = 0.0
+        self.second_moment = 0.0
+    def __call__(self, row):
+        log_return = np.log(row.portfolio_valuation / self.last_valuation)
+        self.last_valuation = row.portfolio_valuation
+        delta_mean = log_return - self.mean
+        delta_second_moment = log_return**2 - self.second_moment
+        variance = self.second_moment - self.mean**2
+        # 前几步方差为0时，奖励为0。
+        reward = (self.second_moment * delta_mean - 0.5 * self.mean * delta_second_moment) / variance**1.5 if variance > 1E-12 else 0.0
+        self.mean += self.eta * delta_mean
+        self.second_moment += self.eta * delta_second_moment
+        return reward
@@ -0,0 +1,238 @@
+import sys
+import os
+import json
+import glob
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+from .ohlcv_store import read_dataset
+
+# MemmapMarketData数据集格式的版本号。
+MEMMAP_DATASET_VERSION = 1
+
+def market_arrays(df):
+    # 将DataFrame转换为TradingEnv使用的静态数组。
+    # 返回：数组字典（features、price、dates、info）、特征列名列表、信息列名列表。
+    features_columns = [col for col in df.columns if "feature" in col]
+    info_columns = [col for col in df.columns if col not in features_columns]
+    arrays = {
+        "features": features_array(df, features_columns),
+        "price": np.array(df["close"], dtype= np.float64),
+        "dates": np.array(df.index.values),
+        "info": info_records(df, info_columns),
+    }
+    return arrays, features_columns, info_columns
+
+def column_values(df, column):
+    # 返回一列的numpy数组（df可以是DataFrame或列名到数组的字典）。
+    values = df[column]
+    return values.to_numpy() if isinstance(values, pd.Series) else np.asarray(values)
+
+def features_array(df, columns, nb_extra_columns = 0, length = None):
+    # 逐列构建float32特征矩阵，不复制整个DataFrame（峰值内存只多出一列）。
+    # df也可以是列名到数组的字典（此时需要指定行数length）。
+    # nb_extra_columns: 在末尾额外预留的列（以0填充），例如用于动态特征。
+    array = np.zeros((len(df) if length is None else length, len(columns) + nb_extra_columns), dtype= np.float32)
+    for i, column in enumerate(columns):
+        array[:, i] = column_values(df, column)
+    return array
+
+def info_array(df, columns, dtype, length = None):
+    # 逐列构建指定类型的二维信息数组（例如np.float64或object）。
+    array = np.empty((len(df) if length is None else length, len(columns)), dtype= dtype)
+    for i, column in enumerate(columns):
+        array[:, i] = column_values(df, column)
+    return array
+
+def info_records(df, columns = None, length = None):
+    # 将信息列转换为结构化数组（每列一个字段），以便放入共享内存或文件中。
+    # 数值、布尔和日期列保留原类型，其余列（例如字符串）转换为定长unicode。
+    fields, values = [], []
+    for column in (df.columns if columns is None else columns):
+        values_array = column_values(df, column)
+        if values_array.dtype.kind not in "biufM":
+            values_array = values_array.astype(str)
+        fields.append((str(column), values_array.dtype))
+        values.append(values_array)
+    info = np.empty(len(df) if length is None else length, dtype= fields)
+    for (name, _), values_array in zip(fields, values):
+        info[name] = values_array
+    return info
+
+class MarketData:
+    # 市场数据基类：保存TradingEnv所需的静态数组，可以代替DataFrame传给TradingEnv的df参数。
+    # features: 静态特征（float32二维数组）。
+    # price: 收盘价（float64）。
+    # dates: 日期（datetime64）。
+    # info: 其他列（结构化数组，每列一个字段）。
+    # features_columns / info_columns: 对应的列名。
+    # 直接使用MarketData(df)时，数组保存在普通内存中。
+    def __init__(self, df):
+        arrays, self.features_columns, self.info_columns = market_arrays(df)
+        for key, array in arrays.items():
+            setattr(self, key, array)
+    def __len__(self):
+        return len(self.price)
+    def to_dataframe(self):
+        # 重新构建DataFrame（例如用于渲染）。
+        df = pd.DataFrame({column : self.info[column] for column in self.info_columns}, index = pd.DatetimeIndex(self.dates))
+        for i, column in enumerate(self.features_columns):
+            df[column] = self.features[:, i]
+        return df
+
+def _attach_shared_memory(name):
+    # 连接到已存在的共享内存块。Python 3.13+ 中不让resource_tracker跟踪它（只有创建者负责释放）。
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name = name, track = False)
+    return shared_memory.SharedMemory(name = name)
+
+class SharedMarketData(MarketData):
+    """
+    Market data placed once in shared memory (``multiprocessing.shared_memory``), to be used in place of a DataFrame as the ``df`` argument of ``TradingEnv``.
+    When it is pickled (for example when ``gym.make_vec(..., vectorization_mode="async")`` sends the environment arguments to its workers), only the names of the shared memory blocks are sent: each worker attaches the same memory, read-only, instead of copying the dataset.
+    Dynamic features stay private to each environment.
+
+    .. code-block:: python
+
+        from gym_trading_env.utils.market_data import SharedMarketData
+
+        data = SharedMarketData(df)
+        envs = gym.make_vec("TradingEnv", num_envs = 32, vectorization_mode = "async", df = data, ...)
+        ...
+        envs.close()
+        data.unlink() # Free the shared memory
+
+    :param df: Same requirements as the ``df`` of TradingEnv.
+    :type df: pandas.DataFrame
+    """
+    def __init__(self, df):
+        arrays, self.features_columns, self.info_columns = market_arrays(df)
+        self._owner = True
+        self._shared_memories = {}
+        self._specs = {}
+        for key, array in arrays.items():
+            shm = shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype= array.dtype, buffer= shm.buf)[...] = array
+            self._shared_memories[key] = shm
+            self._specs[key] = (shm.name, array.shape, array.dtype)
+        self._set_arrays()
+
+    def _set_arrays(self):
+        # 在共享内存上创建只读的numpy数组视图。
+        for key, (name, shape, dtype) in self._specs.items():
+            array = np.ndarray(shape, dtype= dtype, buffer= self._shared_memories[key].buf)
+            array.flags.writeable = False
+            setattr(self, key, array)
+
+    def __getstate__(self):
+        # 序列化时只传递共享内存块的名称、形状和类型。
+        return {
+            "features_columns": self.features_columns,
+            "info_columns": self.info_columns,
+            "_specs": self._specs,
+        }
+
+    def __setstate__(self, state):
+        # 反序列化时连接到已存在的共享内存块。
+        self.__dict__.update(state)
+        self._owner = False
+        self._shared_memories = {key : _attach_shared_memory(name) for key, (name, _, _) in self._specs.items()}
+        self._set_arrays()
+
+    def close(self):
+        # 断开与共享内存的连接（使用这些数组的环境需要先关闭）。
+        for key in self._specs: setattr(self, key, None)
+        for shm in self._shared_memories.values(): shm.close()
+
+    def unlink(self):
+        # 释放共享内存（只有创建者可以调用），内存会在所有进程断开连接后真正释放。
+        if not self._owner:
+            raise RuntimeError("Only the process that created the SharedMarketData can unlink it.")
+        for shm in self._shared_memories.values(): shm.unlink()
+
+class MemmapMarketData(MarketData):
+    """
+    Market data stored on disk in a precompiled format, opened with ``numpy`` memory-mapping (``np.load(..., mmap_mode='r')``).
+    Opening a dataset only costs a few file-opens, and only the rows used by an episode are actually read from disk.
+    It can be used in place of a DataFrame as the ``df`` argument of ``TradingEnv``, and ``MultiDatasetTradingEnv`` opens such datasets automatically.
+
+    A dataset is a directory containing ``metadata.json``, ``features.npy`` (float32 feature matrix), ``price.npy`` (close prices), ``dates.npy`` (datetime64 index) and ``info.npy`` (other columns, one field per column).
+    Use :func:`save_memmap_dataset` or :func:`convert_pickle_datasets` to create them.
+
+    :param path: Path of the dataset directory.
+    :type path: str
+    """
+    def __init__(self, path):
+        self.path = str(path)
+        with open(os.path.join(self.path, "metadata.json"), "r") as file:
+            metadata = json.load(file)
+        if metadata.get("version") != MEMMAP_DATASET_VERSION:
+            raise ValueError(f"Unsupported dataset version {metadata.get('version')} at {self.path} (expected {MEMMAP_DATASET_VERSION}).")
+        self.features_columns = metadata["features_columns"]
+        self.info_columns = metadata["info_columns"]
+        for key in ["features", "price", "dates", "info"]:
+            setattr(self, key, np.load(os.path.join(self.path, f"{key}.npy"), mmap_mode= "r"))
+
+    def __getstate__(self):
+        # 序列化时只传递路径（而不是整个数组）。
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+def is_memmap_dataset(path):
+    # 判断路径是否为MemmapMarketData数据集目录。
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, "metadata.json"))
+
+def save_memmap_dataset(df, path):
+    """
+    Write a DataFrame in the memory-mapped dataset format read by :class:`MemmapMarketData`.
+
+    :param df: Same requirements as the ``df`` of TradingEnv (the features need to be already computed).
+    :type df: pandas.DataFrame
+
+    :param path: Path of the dataset directory to create.
+    :type path: str
+    """
+    arrays, features_columns, info_columns = market_arrays(df)
+    os.makedirs(path, exist_ok= True)
+    for key, array in arrays.items():
+        np.save(os.path.join(path, f"{key}.npy"), array)
+    with open(os.path.join(path, "metadata.json"), "w") as file:
+        json.dump({
+            "version": MEMMAP_DATASET_VERSION,
+            "features_columns": features_columns,
+            "info_columns": [str(column) for column in info_columns],
+            "length": len(df),
+        }, file)
+    return path
+
+def convert_pickle_datasets(dataset_dir, output_dir = None, preprocess = lambda df : df):
+    """
+    Convert the ``.pkl`` datasets or OHLCV store directories (for example the ones produced by ``gym_trading_env.downloader``) into memory-mapped datasets.
+
+    .. code-block:: python
+
+        from gym_trading_env.utils.market_data import convert_pickle_datasets
+
+        convert_pickle_datasets("data/*.pkl", preprocess = preprocess)
+        env = gym.make("MultiDatasetTradingEnv", dataset_dir = "data/*.mmap", ...)
+
+    :param dataset_dir: A glob path that matches the datasets.
+    :type dataset_dir: str
+
+    :param output_dir: Directory where the datasets are written. By default, next to the ``.pkl`` files.
+    :type output_dir: optional - str
+
+    :param preprocess: Function applied to each DataFrame before writing it (same as the ``preprocess`` argument of MultiDatasetTradingEnv).
+    :type preprocess: optional - function<pandas.DataFrame->pandas.DataFrame>
+
+    :return: List of the created dataset directories (``<name>.mmap``).
+    """
+    pathes = []
+    for dataset_path in glob.glob(dataset_dir):
+        name = Path(dataset_path).stem + ".mmap"
+        directory = Path(dataset_path).parent if output_dir is None else Path(output_dir)
+        pathes.append(save_memmap_dataset(preprocess(read_dataset(dataset_path)), str(directory / name)))
+    return pathes
@@ -0,0 +1,191 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+# OHLCVStore的格式版本号。
+OHLCV_STORE_VERSION = 1
+
+def _month_start(timestamp):
+    # 时间戳（毫秒）所在月份的第一毫秒。
+    date = pd.Timestamp(timestamp, unit= "ms")
+    return int(pd.Timestamp(year= date.year, month= date.month, day= 1).value // 10**6)
+
+def _next_month_start(timestamp):
+    date = pd.Timestamp(_month_start(timestamp), unit= "ms") + pd.DateOffset(months= 1)
+    return int(date.value // 10**6)
+
+def _grid(start, stop, timedelta):
+    # [start, stop) 中所有timedelta的整数倍（K线的开盘时间戳）。
+    first = -(-start // timedelta) * timedelta
+    return np.arange(first, stop, timedelta, dtype= np.int64)
+
+def _ranges(timestamps, timedelta):
+    # 将有序的时间戳分组为连续的区间 [first, last + timedelta)。
+    if len(timestamps) == 0: return []
+    breaks = np.flatnonzero(np.diff(timestamps) != timedelta) + 1
+    return [(int(group[0]), int(group[-1]) + timedelta) for group in np.split(timestamps, breaks)]
+
+def _merge_ranges(ranges):
+    # 合并重叠或相邻的区间 [first, stop)，返回有序的区间列表。
+    merged = []
+    for first, stop in sorted(ranges):
+        if len(merged) > 0 and first <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([first, stop])
+    return merged
+
+def _in_ranges(timestamps, ranges):
+    # timestamps中每个时间戳是否位于某个有序且不重叠的区间 [first, stop) 中。
+    if len(ranges) == 0: return np.zeros(len(timestamps), dtype= bool)
+    firsts, stops = np.array(ranges, dtype= np.int64).T
+    i = np.searchsorted(firsts, timestamps, side= "right") - 1
+    return (i >= 0) & (timestamps < stops[np.maximum(i, 0)])
+
+def is_ohlcv_store(path):
+    # 判断路径是否为OHLCVStore目录。
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, "store.json"))
+
+def read_dataset(path):
+    # 读取一个数据集：OHLCVStore目录（合并所有分区）或.pkl文件。
+    if is_ohlcv_store(path): return OHLCVStore(path).read()
+    return pd.read_pickle(path)
+
+def dataset_stat_path(path):
+    # 修改时间代表数据集内容的文件（OHLCVStore每次写入都会更新store.json）。
+    return os.path.join(path, "store.json") if is_ohlcv_store(path) else path
+
+class OHLCVStore:
+    """
+    On-disk dataset of the candles of one symbol, partitioned by month: a directory with one pickle file per month (``2023-01.pkl``, ``2023-02.pkl``...)
+    and ``store.json``, which records the first and last timestamps and the number of candles of each partition,
+    and the ranges already requested from the exchange (``covered``), so that ranges without candles (before the listing of the symbol, exchange outages) are not requested again.
+    New candles are merged into the partitions they belong to (deduplicated and sorted), so refreshing a dataset only rewrites the months that changed.
+    It is written by ``gym_trading_env.downloader.download(..., incremental = True)``, batch by batch as the candles are downloaded,
+    and ``MultiDatasetTradingEnv`` can load such directories directly (``dataset_dir = "data/*-1m"``).
+
+    .. code-block:: python
+
+        from gym_trading_env.utils.ohlcv_store import OHLCVStore
+
+        df = OHLCVStore("data/binance-BTCUSDT-1m").read()
+
+    :param path: Path of the store directory (created if it does not exist).
+    :type path: str
+    """
+    def __init__(self, path):
+        self.path = str(path)
+        os.makedirs(self.path, exist_ok= True)
+        metadata_path = os.path.join(self.path, "store.json")
+        self.partitions = {}
+        self.covered = []
+        if os.path.isfile(metadata_path):
+            with open(metadata_path, "r") as file:
+                metadata = json.load(file)
+            if metadata.get("version") != OHLCV_STORE_VERSION:
+                raise ValueError(f"Unsupported store version {metadata.get('version')} at {self.path} (expected {OHLCV_STORE_VERSION}).")
+            self.partitions = metadata["partitions"]
+            self.covered = metadata.get("covered", [])
+
+    def _partition_path(self, name):
+        return os.path.join(self.path, f"{name}.pkl")
+
+    def _save_metadata(self):
+        # 先写入临时文件再替换，避免中断时留下损坏的元数据。
+        temporary_path = os.path.join(self.path, "store.json.tmp")
+        with open(temporary_path, "w") as file:
+            json.dump({"version": OHLCV_STORE_VERSION, "partitions": self.partitions, "covered": self.covered}, file)
+        os.replace(temporary_path, os.path.join(self.path, "store.json"))
+
+    def __len__(self):
+        return sum(partition["count"] for partition in self.partitions.values())
+
+    def read_partition(self, name):
+        # 读取一个月的K线（name为"YYYY-MM"）。
+        return pd.read_pickle(self._partition_path(name))
+
+    def _partition_names(self, since = None, until = None):
+        # 与 [since, until) 有交集的分区名称（按时间顺序）。
+        return [
+            name for name, partition in sorted(self.partitions.items())
+            if (since is None or partition["last"] >= since) and (until is None or partition["first"] < until)
+        ]
+
+    def iter_partitions(self, since = None, until = None):
+        """
+        Iterate over the candles of the store one month at a time, in chronological order, without loading the whole dataset in memory.
+        Parameters are the same as :meth:`read`.
+        """
+        for name in self._partition_names(since, until):
+            df = self.read_partition(name)
+            if since is not None: df = df.loc[df.index >= pd.Timestamp(since, unit= "ms")]
+            if until is not None: df = df.loc[df.index < pd.Timestamp(until, unit= "ms")]
+            yield df
+
+    def read(self, since = None, until = None):
+        """
+        Read the candles of the store, in chronological order. Only the partitions that overlap the requested range are loaded.
+
+        :param since: First timestamp (ms) to read (included). By default, the beginning of the store.
+        :type since: optional - int
+
+        :param until: Last timestamp (ms) to read (excluded). By default, the end of the store.
+        :type until: optional - int
+        """
+        dfs = list(self.iter_partitions(since, until))
+        if len(dfs) == 0: return pd.DataFrame()
+        return pd.concat(dfs)
+
+    def write(self, df, covered = None):
+        # 将K线（以开盘时间为索引）合并到对应的月份分区中：去重（新的K线优先）并排序，只重写受影响的分区。
+        # covered: 已向交易所请求过的区间列表 [(first, stop), ...]（毫秒，不含stop），与K线一起记录到store.json中，
+        # 之后missing_ranges不再返回这些区间中缺失的K线（交易所在这些时间没有K线）。
+        if covered is not None and len(covered) > 0:
+            self.covered = _merge_ranges(self.covered + [list(covered_range) for covered_range in covered])
+        if len(df) == 0:
+            if covered is not None and len(covered) > 0: self._save_metadata()
+            return
+        months = pd.DatetimeIndex(df.index).strftime("%Y-%m")
+        for name in pd.unique(months):
+            partition_df = df.loc[months == name]
+            if name in self.partitions:
+                partition_df = pd.concat([self.read_partition(name), partition_df])
+            partition_df = partition_df.loc[~partition_df.index.duplicated(keep= "last")].sort_index()
+            temporary_path = self._partition_path(name) + ".tmp"
+            partition_df.to_pickle(temporary_path)
+            os.replace(temporary_path, self._partition_path(name))
+            partition_timestamps = partition_df.index.values.astype("datetime64[ms]").astype(np.int64)
+            self.partitions[name] = {
+                "first": int(partition_timestamps[0]),
+                "last": int(partition_timestamps[-1]),
+                "count": len(partition_df),
+            }
+        self._save_metadata()
+
+    def missing_ranges(self, since, until, timedelta):
+        """
+        Find the candles missing from the store between ``since`` and ``until`` : the end of the series, but also holes in the middle of it.
+        Candles are expected at every multiple of ``timedelta``. Complete months are detected from ``store.json`` without reading them.
+        Ranges recorded as covered (already requested from the exchange, see :meth:`write`) are never returned.
+
+        :return: List of ranges ``(first, stop)`` (ms, ``stop`` excluded) of consecutive missing candles.
+        """
+        missing = []
+        month = _month_start(since)
+        while month < until:
+            next_month = _next_month_start(month)
+            expected = _grid(max(since, month), min(until, next_month), timedelta)
+            expected = expected[~_in_ranges(expected, self.covered)]
+            name = pd.Timestamp(month, unit= "ms").strftime("%Y-%m")
+            partition = self.partitions.get(name)
+            if len(expected) == 0:
+                pass
+            elif partition is None:
+                missing.append(expected)
+            elif partition["count"] < len(_grid(month, next_month, timedelta)):
+                # 分区不完整：读取它的时间戳，找出缺失的K线。
+                stored = self.read_partition(name).index.values.astype("datetime64[ms]").astype(np.int64)
+                missing.append(expected[~np.isin(expected, stored)])
+            month = next_month
+        return _ranges(np.concatenate(missing) if len(missing) > 0 else np.zeros(0, dtype= np.int64), timedelta)
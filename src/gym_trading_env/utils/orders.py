@@ -0,0 +1,150 @@
+import numpy as np
+
+# 没有过期时间的订单的过期索引。
+NO_EXPIRY = np.iinfo(np.int64).max
+
+# 订单类型。
+LIMIT = 0 # 限价单：价格在[low, high]之间时触发。
+STOP_UP = 1 # 向上的止损单（买入止损）：high >= 价格时触发。
+STOP_DOWN = -1 # 向下的止损单（止损卖出）：low <= 价格时触发。
+
+class OrderBook:
+    # 订单簿：所有挂单（限价单和止损单）保存在数组中，每步用一次向量化比较找出被触发的订单。
+    # 每个订单由两个阈值表示：当 high >= upper 且 low <= lower 时触发
+    # （限价单：upper = lower = 价格；向上止损单：lower = +inf；向下止损单：upper = -inf）。
+    # 订单按添加顺序保存在数组的前size个位置中，被取消、过期或成交（非持久）的订单标记为不活跃，
+    # 数组已满时先压缩（丢弃不活跃的订单），必要时再扩容。
+    _arrays = ["id", "position", "price", "persistent", "kind", "upper", "lower", "expiry", "active"]
+    def __init__(self, capacity = 16):
+        self._next_id = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        self.size = 0 # 已使用的位置数量。
+        self.nb_active = 0 # 活跃订单的数量。
+        self.min_expiry = NO_EXPIRY # 活跃订单中最早的过期索引。
+        self.id = np.zeros(capacity, dtype= np.int64)
+        self.position = np.zeros(capacity, dtype= np.float64)
+        self.price = np.zeros(capacity, dtype= np.float64)
+        self.persistent = np.zeros(capacity, dtype= np.bool_)
+        self.kind = np.zeros(capacity, dtype= np.int8)
+        self.upper = np.zeros(capacity, dtype= np.float64)
+        self.lower = np.zeros(capacity, dtype= np.float64)
+        self.expiry = np.zeros(capacity, dtype= np.int64)
+        self.active = np.zeros(capacity, dtype= np.bool_)
+
+    def __len__(self):
+        return self.nb_active
+
+    def _compact(self):
+        # 丢弃不活跃的订单；如果仍然没有空位，容量翻倍。
+        keep = np.flatnonzero(self.active[:self.size])
+        capacity = len(self.id) if len(keep) < len(self.id) else 2 * len(self.id)
+        arrays = {key : getattr(self, key)[keep] for key in self._arrays}
+        min_expiry = self.min_expiry
+        self._allocate(capacity)
+        for key, values in arrays.items():
+            getattr(self, key)[:len(keep)] = values
+        self.size = self.nb_active = len(keep)
+        self.min_expiry = min_expiry
+
+    def add(self, position, price, persistent = False, kind = LIMIT, expiry = NO_EXPIRY):
+        # 添加一个订单，返回订单的id（用于取消订单）。
+        if self.size == len(self.id): self._compact()
+        i = self.size
+        self.id[i] = self._next_id
+        self.position[i] = position
+        self.price[i] = price
+        self.persistent[i] = persistent
+        self.kind[i] = kind
+        self.upper[i] = -np.inf if kind == STOP_DOWN else price
+        self.lower[i] = np.inf if kind == STOP_UP else price
+        self.expiry[i] = expiry
+        self.active[i] = True
+        self.size += 1
+        self.nb_active += 1
+        self.min_expiry = min(self.min_expiry, expiry)
+        self._next_id += 1
+        return self._next_id - 1
+
+    def cancel_position(self, position, kinds):
+        # 取消目标头寸为position、类型在kinds中的活跃订单（用于替换同一头寸的订单），返回取消的订单数量。
+        n = self.size
+        slots = np.flatnonzero((self.position[:n] == position) & np.isin(self.kind[:n], kinds) & self.active[:n])
+        for slot in slots: self._deactivate(slot)
+        return len(slots)
+
+    def cancel(self, order_id):
+        # 取消一个订单（如果订单已经成交或过期，则不做任何事）。返回是否取消了订单。
+        slots = np.flatnonzero((self.id[:self.size] == order_id) & self.active[:self.size])
+        if len(slots) == 0: return False
+        self._deactivate(slots[0])
+        return True
+
+    def _deactivate(self, slot):
+        self.active[slot] = False
+        self.nb_active -= 1
+
+    def clear(self):
+        self.active[:self.size] = False
+        self.size = self.nb_active = 0
+        self.min_expiry = NO_EXPIRY
+
+    def expire(self, idx):
+        # 将过期索引小于idx的订单标记为不活跃（只有在最早的过期索引已过时才需要检查数组）。
+        if idx <= self.min_expiry: return
+        n = self.size
+        active = self.active[:n]
+        expired = active & (self.expiry[:n] < idx)
+        active &= ~expired
+        self.nb_active -= int(expired.sum())
+        self.min_expiry = int(self.expiry[:n][active].min()) if self.nb_active > 0 else NO_EXPIRY
+
+    def triggered(self, high, low):
+        # 返回被最高价high和最低价low触发的活跃订单的位置（按添加顺序）。
+        n = self.size
+        return np.flatnonzero((self.upper[:n] <= high) & (self.lower[:n] >= low) & self.active[:n])
+
+    def fill_price(self, slot, open_):
+        # 成交价格：限价单以限价成交；止损单以止损价成交，如果开盘价open_已经越过止损价（跳空），则以开盘价成交。
+        price, kind = self.price[slot], self.kind[slot]
+        if kind == LIMIT or open_ is None: return price
+        return max(price, open_) if kind == STOP_UP else min(price, open_)
+
+    def fill(self, slot):
+        # 订单成交后调用：非持久订单变为不活跃。
+        if not self.persistent[slot]: self._deactivate(slot)
+
+class PriceIndex:
+    # 最高价/最低价的分块索引：预先计算每块（block_size个时间步）的最高价的最大值和最低价的最小值，
+    # 用于快速找到之后第一个触发某个订单的时间步，而不需要逐步检查。
+    def __init__(self, high, low, block_size = 256):
+        self.high = high
+        self.low = low
+        self.block_size = block_size
+        nb_blocks = -(-len(high) // block_size)
+        self.block_high = np.maximum.reduceat(high, np.arange(nb_blocks) * block_size) if len(high) > 0 else high
+        self.block_low = np.minimum.reduceat(low, np.arange(nb_blocks) * block_size) if len(low) > 0 else low
+
+    def _scan(self, upper, lower, start, end):
+        hit = np.flatnonzero((self.high[start:end] >= upper) & (self.low[start:end] <= lower))
+        return start + int(hit[0]) if len(hit) > 0 else None
+
+    def first_touch(self, upper, lower, start, stop):
+        # 返回[start, stop]中第一个满足 high >= upper 且 low <= lower 的时间步（没有则返回None）。
+        # 限价单：upper = lower = 限价；向上止损单：lower = +inf；向下止损单：upper = -inf（与OrderBook相同）。
+        stop = min(stop, len(self.high) - 1)
+        if start > stop: return None
+        block_size = self.block_size
+        # 先精确检查start所在的块的剩余部分。
+        first_block = start // block_size
+        touch = self._scan(upper, lower, start, min(stop + 1, (first_block + 1) * block_size))
+        if touch is not None: return touch
+        # 然后只检查可能包含触发时间步的块（块的最高价 >= upper 且最低价 <= lower）。
+        last_block = stop // block_size
+        blocks = slice(first_block + 1, last_block + 1)
+        candidates = np.flatnonzero((self.block_high[blocks] >= upper) & (self.block_low[blocks] <= lower)) + first_block + 1
+        for block in candidates:
+            touch = self._scan(upper, lower, block * block_size, min(stop + 1, (block + 1) * block_size))
+            if touch is not None: return touch
+        return None
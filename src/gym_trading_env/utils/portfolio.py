@@ -1,3 +1,12 @@
+import numpy as np
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# 如果安装了numba，simulate_positions会自动使用JIT编译的内核。
+NUMBA_AVAILABLE = numba is not None
+
 class Portfolio:
     def __init__(self, asset, fiat, interest_asset = 0, interest_fiat = 0):
         # 初始化投资组合。
@@ -12,12 +21,7 @@ class Portfolio:
     def valorisation(self, price):
         # 计算投资组合的总估值。
         # price: 当前资产价格。
-        return sum([
-            self.asset * price,
-            self.fiat,
-            - self.interest_asset * price,
-            - self.interest_fiat
-        ])
+        return self.asset * price + self.fiat - self.interest_asset * price - self.interest_fiat
     def real_position(self, price):
         # 计算实际头寸（考虑借入资产）。
         # price: 当前资产价格。
@@ -74,6 +78,16 @@ class Portfolio:
             "interest_asset":self.interest_asset,
             "interest_fiat":self.interest_fiat,
         }
+    def get_portfolio_distribution_values(self):
+        # 与get_portfolio_distribution相同，但只返回值（按相同顺序），不构建字典。
+        return (
+            max(0, self.asset),
+            max(0, self.fiat),
+            max(0, -self.asset),
+            max(0, -self.fiat),
+            self.interest_asset,
+            self.interest_fiat,
+        )
 
 class TargetPortfolio(Portfolio):
     # 目标投资组合类，继承自Portfolio。
@@ -89,3 +103,317 @@ class TargetPortfolio(Portfolio):
             interest_asset = 0,
             interest_fiat = 0
         )
+
+
+class PortfolioArray:
+    # 向量化投资组合类：同时保存多个投资组合的状态。
+    # asset、fiat、interest_asset、interest_fiat 均为形状相同的numpy数组（每个元素对应一个投资组合），
+    # 所有方法都是Portfolio对应方法的向量化版本，计算结果与Portfolio逐个计算完全一致。
+    def __init__(self, asset, fiat, interest_asset = 0, interest_fiat = 0):
+        # 初始化投资组合数组。
+        # asset: 各投资组合的资产数量（数组或标量）。
+        # fiat: 各投资组合的法币数量（数组或标量）。
+        # interest_asset: 各投资组合的资产利息（借入资产）。
+        # interest_fiat: 各投资组合的法币利息（借入法币）。
+        asset, fiat, interest_asset, interest_fiat = np.broadcast_arrays(
+            *[np.asarray(value, dtype= np.float64) for value in (asset, fiat, interest_asset, interest_fiat)]
+        )
+        self.asset = asset.copy()
+        self.fiat = fiat.copy()
+        self.interest_asset = interest_asset.copy()
+        self.interest_fiat = interest_fiat.copy()
+    def __len__(self):
+        # 返回投资组合的数量。
+        return len(self.asset)
+    def valorisation(self, price):
+        # 计算各投资组合的总估值。
+        # price: 当前资产价格（标量或与投资组合数量相同的数组）。
+        return self.asset * price + self.fiat - self.interest_asset * price - self.interest_fiat
+    def real_position(self, price):
+        # 计算各投资组合的实际头寸（考虑借入资产）。
+        with np.errstate(divide= "ignore", invalid= "ignore"):
+            return (self.asset - self.interest_asset)* price / self.valorisation(price)
+    def position(self, price):
+        # 计算各投资组合的名义头寸。
+        with np.errstate(divide= "ignore", invalid= "ignore"):
+            return self.asset * price / self.valorisation(price)
+    def trade_to_position(self, position, price, trading_fees, mask = None):
+        # 根据目标头寸进行交易。
+        # position: 目标头寸（标量或数组）。
+        # price: 当前资产价格（标量或数组）。
+        # trading_fees: 交易费用。
+        # mask: 可选的布尔数组，只有为True的投资组合会交易。
+        if mask is None: mask = np.ones(len(self), dtype= np.bool_)
+        with np.errstate(divide= "ignore", invalid= "ignore"):
+            # 偿还利息
+            current_position = self.position(price)
+            interest_reduction_ratio = np.ones(len(self))
+            short = (position <= 0) & (current_position < 0)
+            interest_reduction_ratio = np.where(short, np.minimum(1, position/current_position), interest_reduction_ratio)
+            long = (position >= 1) & (current_position > 1)
+            interest_reduction_ratio = np.where(long, np.minimum(1, (position-1)/(current_position-1)), interest_reduction_ratio)
+            reduce = mask & (interest_reduction_ratio < 1)
+            self.asset = np.where(reduce, self.asset - (1-interest_reduction_ratio) * self.interest_asset, self.asset)
+            self.fiat = np.where(reduce, self.fiat - (1-interest_reduction_ratio) * self.interest_fiat, self.fiat)
+            self.interest_asset = np.where(reduce, interest_reduction_ratio * self.interest_asset, self.interest_asset)
+            self.interest_fiat = np.where(reduce, interest_reduction_ratio * self.interest_fiat, self.interest_fiat)
+
+            # 进行交易
+            asset_trade = (position * self.valorisation(price) / price - self.asset)
+            buy = asset_trade > 0
+            asset_trade = np.where(buy,
+                asset_trade / (1 - trading_fees + trading_fees * position),
+                asset_trade / (1 - trading_fees * position)
+            )
+            asset_fiat = - asset_trade * price
+            self.asset = np.where(mask, np.where(buy, self.asset + asset_trade * (1 - trading_fees), self.asset + asset_trade), self.asset)
+            self.fiat = np.where(mask, np.where(buy, self.fiat + asset_fiat, self.fiat + asset_fiat * (1 - trading_fees)), self.fiat)
+    def update_interest(self, borrow_interest_rate):
+        # 更新借贷利息。
+        # borrow_interest_rate: 借贷利率。
+        self.interest_asset = np.maximum(0, - self.asset)*borrow_interest_rate
+        self.interest_fiat = np.maximum(0, - self.fiat)*borrow_interest_rate
+    def __getitem__(self, i):
+        # 返回第i个投资组合（Portfolio对象）。
+        return Portfolio(
+            asset = float(self.asset[i]),
+            fiat = float(self.fiat[i]),
+            interest_asset = float(self.interest_asset[i]),
+            interest_fiat = float(self.interest_fiat[i]),
+        )
+    def __str__(self): return f"{self.__class__.__name__}({self.__dict__})" # 返回投资组合数组的字符串表示。
+    def get_portfolio_distribution(self):
+        # 获取各投资组合的分布情况（每个值为数组）。
+        return {
+            "asset":np.maximum(0, self.asset),
+            "fiat":np.maximum(0, self.fiat),
+            "borrowed_asset":np.maximum(0, -self.asset),
+            "borrowed_fiat":np.maximum(0, -self.fiat),
+            "interest_asset":self.interest_asset.copy(),
+            "interest_fiat":self.interest_fiat.copy(),
+        }
+
+class TargetPortfolioArray(PortfolioArray):
+    # 目标投资组合数组类，继承自PortfolioArray。
+    # 用于根据各投资组合的目标头寸和价值初始化投资组合数组。
+    def __init__(self, position, value, price):
+        # 初始化目标投资组合数组。
+        # position: 目标头寸（数组或标量）。
+        # value: 投资组合的总价值（数组或标量）。
+        # price: 当前资产价格（数组或标量）。
+        position = np.asarray(position, dtype= np.float64)
+        super().__init__(
+            asset = position * value / price,
+            fiat = (1-position) * value,
+            interest_asset = 0,
+            interest_fiat = 0
+        )
+
+class MultiAssetPortfolio:
+    # 多资产投资组合类：K种资产的持仓和法币。
+    # asset、interest_asset 为长度K的numpy数组（每种资产一个元素），fiat、interest_fiat 为标量。
+    # 头寸（权重）为长度K的数组：第k个元素为第k种资产的价值占投资组合估值的比例，
+    # 权重之和大于1时借入法币，某个权重小于0时借入该资产。K = 1时与Portfolio的计算完全一致。
+    def __init__(self, asset, fiat, interest_asset = 0, interest_fiat = 0):
+        # 初始化投资组合。
+        # asset: 各资产的数量（长度K的数组）。
+        # fiat: 法币数量。
+        # interest_asset: 各资产的利息（借入资产）。
+        # interest_fiat: 法币的利息（借入法币）。
+        self.asset = np.array(asset, dtype= np.float64)
+        self.fiat = float(fiat)
+        self.interest_asset = np.broadcast_to(np.asarray(interest_asset, dtype= np.float64), self.asset.shape).copy()
+        self.interest_fiat = float(interest_fiat)
+    def __len__(self):
+        # 返回资产的数量K。
+        return len(self.asset)
+    def valorisation(self, prices):
+        # 计算投资组合的总估值。
+        # prices: 各资产的当前价格（长度K的数组）。
+        return float(np.dot(self.asset - self.interest_asset, prices)) + self.fiat - self.interest_fiat
+    def real_position(self, prices):
+        # 计算各资产的实际头寸（考虑借入资产）。
+        with np.errstate(divide= "ignore", invalid= "ignore"):
+            return (self.asset - self.interest_asset) * prices / self.valorisation(prices)
+    def position(self, prices):
+        # 计算各资产的名义头寸。
+        with np.errstate(divide= "ignore", invalid= "ignore"):
+            return self.asset * prices / self.valorisation(prices)
+    def trade_to_position(self, position, prices, trading_fees):
+        # 根据目标头寸（权重数组）进行交易。
+        # position: 各资产的目标头寸（长度K的数组）。
+        # prices: 各资产的当前价格。
+        # trading_fees: 交易费用。
+        position = np.asarray(position, dtype= np.float64)
+        # 偿还利息：减少做空的资产按比例偿还该资产的利息，减少杠杆（权重之和 > 1）按比例偿还法币的利息。
+        current_position = self.position(prices)
+        with np.errstate(divide= "ignore", invalid= "ignore"):
+            short = (position <= 0) & (current_position < 0)
+            interest_reduction_ratio = np.where(short, np.minimum(1, position/current_position), 1)
+        self.asset = self.asset - (1-interest_reduction_ratio) * self.interest_asset
+        self.interest_asset = interest_reduction_ratio * self.interest_asset
+        leverage, current_leverage = position.sum(), current_position.sum()
+        if leverage >= 1 and current_leverage > 1:
+            fiat_reduction_ratio = min(1, (leverage-1)/(current_leverage-1))
+            self.fiat = self.fiat - (1-fiat_reduction_ratio) * self.interest_fiat
+            self.interest_fiat = fiat_reduction_ratio * self.interest_fiat
+
+        # 进行交易：与Portfolio相同，买入时手续费从买入的资产中扣除（占净买入价值的 fees/(1-fees)），卖出时从得到的法币中扣除（占卖出价值的 fees），
+        # 目标头寸对应交易后的估值 v' = v - 总手续费。v'是买卖方向的分段线性函数：先假设方向，求解后如果方向改变则重新求解（最多K+1次）。
+        values = self.asset * prices
+        valuation = self.valorisation(prices)
+        new_valuation = valuation
+        buy = None
+        for _ in range(len(self) + 1):
+            new_buy = position * new_valuation > values
+            if buy is not None and np.array_equal(new_buy, buy): break
+            buy = new_buy
+            fees = np.where(buy, trading_fees / (1 - trading_fees), -trading_fees)
+            new_valuation = (valuation + np.dot(fees, values)) / (1 + np.dot(fees, position))
+        trade_values = position * new_valuation - values
+        self.asset = self.asset + trade_values / prices
+        self.fiat = self.fiat - float(trade_values.sum()) - float(np.dot(np.where(buy, trading_fees / (1 - trading_fees), trading_fees), np.abs(trade_values)))
+    def update_interest(self, borrow_interest_rate):
+        # 更新借贷利息。
+        # borrow_interest_rate: 借贷利率。
+        self.interest_asset = np.maximum(0, - self.asset)*borrow_interest_rate
+        self.interest_fiat = max(0, - self.fiat)*borrow_interest_rate
+    def __str__(self): return f"{self.__class__.__name__}({self.__dict__})" # 返回投资组合的字符串表示。
+    def get_portfolio_distribution(self, names):
+        # 获取投资组合的分布情况（各资产的值以资产名称为后缀）。
+        # names: 资产名称列表。
+        distribution = {}
+        for key, values in [("asset", np.maximum(0, self.asset)), ("borrowed_asset", np.maximum(0, -self.asset)), ("interest_asset", self.interest_asset)]:
+            distribution.update({f"{key}_{name}" : float(value) for name, value in zip(names, values)})
+        distribution.update({
+            "fiat":max(0, self.fiat),
+            "borrowed_fiat":max(0, -self.fiat),
+            "interest_fiat":self.interest_fiat,
+        })
+        return distribution
+    def get_portfolio_distribution_values(self):
+        # 与get_portfolio_distribution相同，但只返回值（按相同顺序），不构建字典。
+        return (
+            *np.maximum(0, self.asset).tolist(),
+            *np.maximum(0, -self.asset).tolist(),
+            *self.interest_asset.tolist(),
+            max(0, self.fiat),
+            max(0, -self.fiat),
+            self.interest_fiat,
+        )
+
+class TargetMultiAssetPortfolio(MultiAssetPortfolio):
+    # 目标多资产投资组合类，继承自MultiAssetPortfolio。
+    # 用于根据目标头寸（权重数组）和价值初始化投资组合。
+    def __init__(self, position, value, prices):
+        # position: 各资产的目标头寸（长度K的数组）。
+        # value: 投资组合的总价值。
+        # prices: 各资产的当前价格。
+        position = np.asarray(position, dtype= np.float64)
+        super().__init__(
+            asset = position * value / prices,
+            fiat = (1-position.sum()) * value,
+            interest_asset = 0,
+            interest_fiat = 0
+        )
+
+def _simulate_positions_kernel(prices, positions, current_position, asset, fiat, interest_asset, interest_fiat, trading_fees, borrow_interest_rate):
+    # simulate_positions的逐步内核（安装numba时被JIT编译）。
+    # 将Portfolio.trade_to_position、update_interest和valorisation内联为纯浮点运算，运算顺序与Portfolio完全相同，保证结果逐位一致。
+    nb_steps = len(positions)
+    states = np.zeros((4, nb_steps), dtype= np.float64)
+    end = nb_steps
+    for k in range(nb_steps):
+        position = positions[k]
+        if position != current_position:
+            price = prices[k]
+            # 偿还利息
+            current = asset * price / (asset * price + fiat - interest_asset * price - interest_fiat)
+            interest_reduction_ratio = 1.0
+            if position <= 0 and current < 0:
+                interest_reduction_ratio = min(1.0, position/current)
+            elif position >= 1 and current > 1:
+                interest_reduction_ratio = min(1.0, (position-1)/(current-1))
+            if interest_reduction_ratio < 1:
+                asset = asset - (1-interest_reduction_ratio) * interest_asset
+                fiat = fiat - (1-interest_reduction_ratio) * interest_fiat
+                interest_asset = interest_reduction_ratio * interest_asset
+                interest_fiat = interest_reduction_ratio * interest_fiat
+            # 进行交易
+            asset_trade = (position * (asset * price + fiat - interest_asset * price - interest_fiat) / price - asset)
+            if asset_trade > 0:
+                asset_trade = asset_trade / (1 - trading_fees + trading_fees * position)
+                asset_fiat = - asset_trade * price
+                asset = asset + asset_trade * (1 - trading_fees)
+                fiat = fiat + asset_fiat
+            else:
+                asset_trade = asset_trade / (1 - trading_fees * position)
+                asset_fiat = - asset_trade * price
+                asset = asset + asset_trade
+                fiat = fiat + asset_fiat * (1 - trading_fees)
+            current_position = position
+        # 更新利息（与max(0, -x)相同）
+        interest_asset = (-asset if -asset > 0 else 0.0) * borrow_interest_rate
+        interest_fiat = (-fiat if -fiat > 0 else 0.0) * borrow_interest_rate
+        states[0, k] = asset
+        states[1, k] = fiat
+        states[2, k] = interest_asset
+        states[3, k] = interest_fiat
+        price = prices[k+1]
+        if asset * price + fiat - interest_asset * price - interest_fiat <= 0:
+            end = k + 1
+            break
+    return states, end
+
+if NUMBA_AVAILABLE:
+    _simulate_positions_kernel = numba.njit(cache= True)(_simulate_positions_kernel)
+
+def simulate_positions(portfolio, prices, positions, current_position, trading_fees, borrow_interest_rate, use_numba = None):
+    # 从portfolio的当前状态出发，按与TradingEnv.step完全相同的规则回放一整段头寸序列。
+    # 第k步（k=1..n）：如果positions[k-1]与当前头寸不同，则以prices[k-1]调仓；然后更新利息，并以prices[k]估值。
+    # 如果某一步估值<=0，则在该步停止（与TradingEnv中的done相同）。
+    # portfolio: Portfolio对象，会被更新为最后一步的状态。
+    # prices: 长度为n+1的价格数组，prices[0]为当前价格。
+    # positions: 长度为n的目标头寸数组。
+    # current_position: 当前头寸。
+    # use_numba: 是否使用JIT编译的内核，默认为None（安装了numba时自动使用）。
+    # 返回：每一步结束时的asset、fiat、interest_asset、interest_fiat数组（长度为实际执行的步数）。
+    if use_numba is None: use_numba = NUMBA_AVAILABLE
+    if use_numba:
+        states, end = _simulate_positions_kernel(
+            np.asarray(prices, dtype= np.float64), np.asarray(positions, dtype= np.float64), float(current_position),
+            float(portfolio.asset), float(portfolio.fiat), float(portfolio.interest_asset), float(portfolio.interest_fiat),
+            float(trading_fees), float(borrow_interest_rate)
+        )
+        if end > 0:
+            portfolio.asset, portfolio.fiat, portfolio.interest_asset, portfolio.interest_fiat = states[:, end - 1].tolist()
+        return states[0, :end], states[1, :end], states[2, :end], states[3, :end]
+
+    # 未安装numba时使用Portfolio类：
+    # 在两次调仓之间投资组合的状态不变，因此只在调仓点（以及第一步）上用Portfolio逐个计算，其余时间步的估值通过向量化计算得到。
+    nb_steps = len(positions)
+    previous_positions = np.concatenate([[current_position], positions[:-1]])
+    trade_steps = np.flatnonzero(positions != previous_positions)
+    # 每一段从一个边界开始（第一步或一次调仓），在段内投资组合的状态保持不变。
+    boundaries = np.union1d([0], trade_steps) if nb_steps > 0 else np.array([], dtype= np.int64)
+    is_trade = np.isin(boundaries, trade_steps)
+
+    states = np.zeros((4, nb_steps), dtype= np.float64)
+    end = nb_steps
+    for i, (start, trade) in enumerate(zip(boundaries, is_trade)):
+        stop = boundaries[i+1] if i + 1 < len(boundaries) else nb_steps
+        if trade:
+            portfolio.trade_to_position(float(positions[start]), price = prices[start], trading_fees = trading_fees)
+        portfolio.update_interest(borrow_interest_rate = borrow_interest_rate)
+        states[0, start:stop] = portfolio.asset
+        states[1, start:stop] = portfolio.fiat
+        states[2, start:stop] = portfolio.interest_asset
+        states[3, start:stop] = portfolio.interest_fiat
+
+        segment_prices = prices[start + 1 : stop + 1]
+        valuations = portfolio.asset * segment_prices + portfolio.fiat - portfolio.interest_asset * segment_prices - portfolio.interest_fiat
+        bankrupt = np.flatnonzero(valuations <= 0)
+        if bankrupt.size > 0:
+            end = start + bankrupt[0] + 1
+            break
+    return states[0, :end], states[1, :end], states[2, :end], states[3, :end]
@@ -0,0 +1,159 @@
+import os
+import glob
+import shutil
+import hashlib
+import functools
+import marshal
+import tempfile
+import types
+
+from .market_data import MemmapMarketData, is_memmap_dataset, save_memmap_dataset
+from .ohlcv_store import read_dataset, dataset_stat_path
+
+def function_hash(function):
+    # 计算函数的哈希值，函数修改后缓存会自动失效。包括：字节码和常量（包括嵌套函数）、默认参数、闭包变量的值、
+    # 引用的全局变量的值（引用的函数递归计算），以及functools.partial的函数和参数。
+    # 限制：其他对象只根据类型和repr计算（repr包含内存地址的对象用类型代替），不能检测到对象内部状态的变化，
+    # 也不会检测到导入的模块中代码的变化。这些情况请使用preprocess_key参数。
+    digest = hashlib.sha256()
+    _update_hash(digest, function, set())
+    return digest.hexdigest()
+
+def _update_hash(digest, value, seen):
+    # 将value的内容加入哈希（seen用于避免递归引用导致的无限循环）。
+    if isinstance(value, (types.FunctionType, functools.partial, types.MethodType)):
+        if id(value) in seen:
+            digest.update(b"<recursion>")
+            return
+        seen.add(id(value))
+    if isinstance(value, types.FunctionType):
+        code = value.__code__
+        digest.update(marshal.dumps(code))
+        _update_hash(digest, value.__defaults__, seen)
+        _update_hash(digest, value.__kwdefaults__, seen)
+        for cell in value.__closure__ or ():
+            try:
+                _update_hash(digest, cell.cell_contents, seen)
+            except ValueError:
+                # 闭包变量尚未赋值。
+                digest.update(b"<empty cell>")
+        for name in _global_names(code):
+            if name in value.__globals__:
+                digest.update(name.encode())
+                _update_hash(digest, value.__globals__[name], seen)
+    elif isinstance(value, functools.partial):
+        _update_hash(digest, value.func, seen)
+        _update_hash(digest, value.args, seen)
+        _update_hash(digest, value.keywords, seen)
+    elif isinstance(value, types.MethodType):
+        _update_hash(digest, value.__func__, seen)
+        _update_hash(digest, value.__self__, seen)
+    elif isinstance(value, types.ModuleType):
+        digest.update(f"<module {value.__name__}>".encode())
+    elif isinstance(value, (type, types.BuiltinFunctionType)) or (callable(value) and hasattr(value, "__qualname__")):
+        # 类、内置函数和numpy的ufunc等：使用模块和名称。
+        digest.update(f"{getattr(value, '__module__', None)}.{value.__qualname__}".encode())
+    elif isinstance(value, (tuple, list)):
+        digest.update(f"<{type(value).__name__} {len(value)}>".encode())
+        for item in value:
+            _update_hash(digest, item, seen)
+    elif isinstance(value, dict):
+        digest.update(f"<dict {len(value)}>".encode())
+        for key, item in value.items():
+            _update_hash(digest, key, seen)
+            _update_hash(digest, item, seen)
+    else:
+        text = repr(value)
+        if " at 0x" in text:
+            # repr包含内存地址（每次运行都不同）：只使用类型。
+            text = f"<{type(value).__module__}.{type(value).__qualname__}>"
+        digest.update(text.encode())
+
+def _global_names(code):
+    # 代码（包括嵌套的函数和类）中引用的全局名称。
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            names |= _global_names(constant)
+    return sorted(names)
+
+class PreprocessCache:
+    """
+    Persistent on-disk cache of preprocessed datasets, used by ``MultiDatasetTradingEnv`` when ``preprocess_cache_dir`` is set.
+    Each entry is keyed by the dataset path, its modification time and size, and a hash of the ``preprocess`` function (see ``function_hash``):
+    its code, default arguments, closure variables, referenced globals (referenced functions are hashed recursively) and, for ``functools.partial`` objects, the wrapped function and its arguments.
+    Other objects are only identified by their type and ``repr``, and code of imported modules is not hashed: if ``preprocess`` depends on such state, set ``preprocess_key``.
+    Entries are stored in the memory-mapped dataset format (see ``MemmapMarketData``), so a cache hit only costs a few file-opens.
+    When the cache grows above ``max_size`` bytes, the least recently used entries are removed.
+
+    :param cache_dir: Directory of the cache.
+    :type cache_dir: str
+
+    :param max_size: Maximum size of the cache in bytes.
+    :type max_size: optional - int
+
+    :param preprocess_key: If set, this key identifies the ``preprocess`` function in the cache instead of the hash of the function. Change it whenever the preprocessing changes.
+    :type preprocess_key: optional - str
+    """
+    def __init__(self, cache_dir, max_size = 10 * 2**30, preprocess_key = None):
+        self.cache_dir = str(cache_dir)
+        self.max_size = max_size
+        self.preprocess_key = preprocess_key
+        os.makedirs(self.cache_dir, exist_ok= True)
+
+    def key(self, dataset_path, preprocess):
+        # 缓存键：数据集路径、修改时间、文件大小和preprocess函数的哈希值（或preprocess_key）。
+        stat = os.stat(dataset_stat_path(dataset_path))
+        preprocess_key = function_hash(preprocess) if self.preprocess_key is None else f"key:{self.preprocess_key}"
+        content = f"{os.path.abspath(dataset_path)}|{stat.st_mtime_ns}|{stat.st_size}|{preprocess_key}"
+        return hashlib.sha256(content.encode()).hexdigest()[:32]
+
+    def load(self, dataset_path, preprocess):
+        # 返回预处理后的数据集（MemmapMarketData），如果不在缓存中则预处理并写入缓存。
+        entry = os.path.join(self.cache_dir, f"{self.key(dataset_path, preprocess)}.mmap")
+        if is_memmap_dataset(entry):
+            # 更新访问时间（用于LRU淘汰）。
+            os.utime(os.path.join(entry, "metadata.json"))
+            return MemmapMarketData(entry)
+
+        # 先写入临时目录再重命名，避免多个进程同时写入同一个条目。
+        temporary_entry = tempfile.mkdtemp(dir= self.cache_dir, prefix= ".tmp-")
+        save_memmap_dataset(preprocess(read_dataset(dataset_path)), temporary_entry)
+        try:
+            os.rename(temporary_entry, entry)
+        except OSError:
+            # 其他进程已经写入了相同的条目。
+            shutil.rmtree(temporary_entry, ignore_errors= True)
+        self.evict(keep = entry)
+        return MemmapMarketData(entry)
+
+    def entries(self):
+        # 返回缓存中的所有条目：(路径, 大小, 最后访问时间)。
+        entries = []
+        for entry in glob.glob(os.path.join(self.cache_dir, "*.mmap")):
+            try:
+                size = sum(os.path.getsize(path) for path in glob.glob(os.path.join(entry, "*")))
+                entries.append((entry, size, os.path.getmtime(os.path.join(entry, "metadata.json"))))
+            except OSError:
+                # 条目可能刚被其他进程删除。
+                continue
+        return entries
+
+    def size(self):
+        # 返回缓存的总大小（字节）。
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep = None):
+        # 删除最久未使用的条目，直到缓存大小不超过max_size（keep指定的条目不会被删除）。
+        entries = sorted(self.entries(), key= lambda entry : entry[2])
+        total_size = sum(size for _, size, _ in entries)
+        for entry, size, _ in entries:
+            if total_size <= self.max_size: break
+            if entry == keep: continue
+            shutil.rmtree(entry, ignore_errors= True)
+            total_size -= size
+
+    def clear(self):
+        # 清空缓存。
+        for entry, _, _ in self.entries():
+            shutil.rmtree(entry, ignore_errors= True)
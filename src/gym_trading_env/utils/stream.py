@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+# 数据源的结束标记：迭代器产生它，或者它被放入队列时，环境认为数据源已结束。
+END_OF_FEED = None
+
+def dataframe_feed(df, chunk_size = 1):
+    """
+    Replay a DataFrame (for example a dataset produced by ``gym_trading_env.downloader``) as a feed for :class:`StreamingTradingEnv`, ``chunk_size`` bars at a time.
+
+    :param df: Same requirements as the ``df`` of TradingEnv.
+    :type df: pandas.DataFrame
+
+    :param chunk_size: Number of bars of each item of the feed.
+    :type chunk_size: optional - int
+    """
+    for start in range(0, len(df), chunk_size):
+        yield df.iloc[start : start + chunk_size]
+
+def bars_to_dataframe(bars):
+    # 将数据源的一项转换为DataFrame：
+    # DataFrame（一根或多根K线，索引为日期）、Series（一根K线，name为日期）或字典（一根K线，"date"键为日期）。
+    if isinstance(bars, pd.DataFrame):
+        return bars
+    if isinstance(bars, pd.Series):
+        return pd.DataFrame([bars.to_dict()], index = pd.DatetimeIndex([bars.name]))
+    if isinstance(bars, dict):
+        bar = dict(bars)
+        date = bar.pop("date")
+        return pd.DataFrame([bar], index = pd.DatetimeIndex([date]))
+    raise TypeError(f"Unsupported feed item of type {type(bars).__name__} : expected a DataFrame, a Series or a dict.")
+
+def bars_to_columns(bars):
+    # 与bars_to_dataframe相同，但返回日期数组和列（列名到数组的映射），单根K线不需要构建DataFrame。
+    if isinstance(bars, pd.DataFrame):
+        return np.array(bars.index.values), bars
+    if isinstance(bars, pd.Series):
+        bar, date = bars.to_dict(), bars.name
+    elif isinstance(bars, dict):
+        bar = dict(bars)
+        date = bar.pop("date")
+    else:
+        raise TypeError(f"Unsupported feed item of type {type(bars).__name__} : expected a DataFrame, a Series or a dict.")
+    return np.array([pd.Timestamp(date).to_datetime64()]), {column : np.asarray([value]) for column, value in bar.items()}
+
+def _promote_dtype(dtype, other):
+    # 能无损保存两种类型的值的类型（结构化数组逐字段提升，例如更长的字符串字段）。
+    if other == dtype: return dtype
+    if dtype.names is None:
+        return np.result_type(dtype, other)
+    return np.dtype([(name, np.result_type(dtype[name], other[name])) for name in dtype.names])
+
+class GrowableArray:
+    # 可按行追加的数组：预留容量，容量不足时翻倍（每行的追加成本为摊还O(1)）。
+    # array 为已使用的行的视图（追加后需要重新获取）。
+    def __init__(self, initial, capacity = 0):
+        self.size = len(initial)
+        self._buffer = np.zeros((max(capacity, self.size, 1),) + initial.shape[1:], dtype= initial.dtype)
+        self._buffer[:self.size] = initial
+
+    @property
+    def array(self):
+        return self._buffer[:self.size]
+
+    def append(self, rows):
+        size = self.size + len(rows)
+        dtype = _promote_dtype(self._buffer.dtype, rows.dtype)
+        if size > len(self._buffer) or dtype != self._buffer.dtype:
+            # 扩容（或提升类型）：复制到容量翻倍的新数组中。
+            buffer = np.zeros((max(size, 2 * len(self._buffer)),) + self._buffer.shape[1:], dtype= dtype)
+            buffer[:self.size] = self._buffer[:self.size]
+            self._buffer = buffer
+        self._buffer[self.size : size] = rows
+        self.size = size
@@ -0,0 +1,18 @@
+import pathlib
+import pandas as pd
+import pytest
+
+DATA_PATH = pathlib.Path(__file__).parent.parent / "examples" / "data" / "BTC_USD-Hourly.csv"
+
+@pytest.fixture(scope= "session")
+def df():
+    # 示例数据集的前2000行，带有简单的特征。
+    df = pd.read_csv(DATA_PATH, parse_dates= ["date"], index_col= "date")
+    df.sort_index(inplace= True)
+    df.dropna(inplace= True)
+    df.drop_duplicates(inplace= True)
+    df = df.iloc[:2000].copy()
+    df["feature_close"] = df["close"].pct_change()
+    df["feature_volume"] = df["volume"] / df["volume"].rolling(24).max()
+    df.dropna(inplace= True)
+    return df
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+from gym_trading_env.environments import TradingEnv
+from gym_trading_env.utils import portfolio
+
+POSITIONS = [-1, 0, 0.5, 1, 2]
+
+@pytest.fixture(params = [False, True], ids = ["python", "numba"])
+def use_numba(request, monkeypatch):
+    if request.param: pytest.importorskip("numba")
+    monkeypatch.setattr(portfolio, "NUMBA_AVAILABLE", request.param)
+    return request.param
+
+def make_env(df, **kwargs):
+    return TradingEnv(df, positions= POSITIONS, trading_fees= 0.01/100, borrow_interest_rate= 0.0003/100, initial_position= 1, verbose= 0, **kwargs)
+
+def step_loop(env, actions):
+    # 与backtest相同的动作序列，逐步调用step。
+    env.reset(seed= 0)
+    for action in actions:
+        _, _, terminated, truncated, _ = env.step(action)
+        if terminated or truncated: break
+    env.calculate_metrics()
+    return env.historical_info
+
+def assert_same_history(history, expected):
+    assert history.columns == expected.columns
+    assert len(history) == len(expected)
+    for column in expected.columns:
+        values, expected_values = history[column], expected[column]
+        if np.issubdtype(np.asarray(expected_values).dtype, np.number):
+            np.testing.assert_allclose(values, expected_values, rtol= 1e-9, atol= 1e-9, err_msg= column)
+        else:
+            np.testing.assert_array_equal(values, expected_values, err_msg= column)
+
+@pytest.mark.parametrize("nb_actions", [300, 5000])
+def test_backtest_matches_step_loop(df, use_numba, nb_actions):
+    # 分数头寸和杠杆头寸（做空、2倍做多），有交易费用和借贷利息；5000个动作时回测在数据末尾截断。
+    actions = np.random.default_rng(0).integers(len(POSITIONS), size= nb_actions)
+    env = make_env(df)
+    history, metrics = env.backtest(actions, seed= 0)
+    expected_env = make_env(df)
+    expected = step_loop(expected_env, actions)
+    assert_same_history(history, expected)
+    assert metrics == expected_env.results_metrics
+    assert env._position == expected_env._position
+
+def test_backtest_matches_step_loop_with_max_episode_duration(df, use_numba):
+    actions = np.random.default_rng(1).integers(len(POSITIONS), size= 500)
+    env = make_env(df, max_episode_duration= 100)
+    np.random.seed(0)
+    history, _ = env.backtest(actions)
+    expected_env = make_env(df, max_episode_duration= 100)
+    np.random.seed(0)
+    assert_same_history(history, step_loop(expected_env, actions))
+    assert len(history) == 100
+
+def test_backtest_stops_when_portfolio_is_ruined(use_numba):
+    # 价格崩盘时，2倍杠杆的投资组合估值<=0：回测与step在同一步结束，最后一步没有奖励。
+    close = np.concatenate([np.full(10, 100.0), np.linspace(100, 10, 10), np.full(10, 10.0)])
+    df = pd.DataFrame({"close": close, "feature_close": 0.0}, index= pd.date_range("2024-01-01", periods= len(close), freq= "h"))
+    actions = np.full(len(close), POSITIONS.index(2))
+    env = make_env(df)
+    history, _ = env.backtest(actions, seed= 0)
+    expected = step_loop(make_env(df), actions)
+    assert_same_history(history, expected)
+    assert history["portfolio_valuation", -1] <= 0
+    assert history["reward", -1] == 0
+    assert len(history) < len(close)
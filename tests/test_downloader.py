@@ -0,0 +1,148 @@
+import asyncio
+import time
+import numpy as np
+import pytest
+
+downloader = pytest.importorskip("gym_trading_env.downloader", exc_type= ImportError)
+from gym_trading_env.utils.fake_exchange import FakeExchange
+
+ROWS = [[1672531200000 + i * 60_000, 1.0, 2.0, 0.5, 1.5, 10.0] for i in range(3)]
+
+def test_parse_ohlcv_dates_are_nanoseconds():
+    df = downloader._parse_ohlcv(ROWS, 60_000)
+    assert df["date_open"].dtype == np.dtype("datetime64[ns]")
+    assert df["date_close"].dtype == np.dtype("datetime64[ns]")
+
+def test_parse_ohlcv_extra_fields():
+    # 额外的字段被忽略。
+    df = downloader._parse_ohlcv([row + [99] for row in ROWS], 60_000)
+    assert df.equals(downloader._parse_ohlcv(ROWS, 60_000))
+
+def test_parse_ohlcv_missing_fields():
+    with pytest.raises(ValueError, match= "at least 6 fields"):
+        downloader._parse_ohlcv([row[:5] for row in ROWS], 60_000)
+
+def test_download_symbol_matches_all_pages_at_once():
+    # 默认（非增量）下载使用有限的请求窗口和临时的OHLCVStore，结果与一次性请求所有页面相同。
+    since, until, timedelta = 1674172800000, 1674172800000 + 5432 * 60_000, 60_000
+    async def all_pages():
+        client = downloader.ExchangeClient(FakeExchange(latency= 0), rate= 1000, burst= 1000)
+        results = await asyncio.gather(*[
+            downloader._ohlcv(client, "BTC/USDT", "1m", 1000, step_since, timedelta)
+            for step_since in range(since, until, 1000 * timedelta)
+        ])
+        return downloader._format_ohlcv(results, since, until)
+    client = downloader.ExchangeClient(FakeExchange(latency= 0), rate= 1000, burst= 1000, max_in_flight= 2)
+    df = asyncio.run(downloader._download_symbol(client, "BTC/USDT", "1m", since, until, flush_size= 1500))
+    assert df.equals(asyncio.run(all_pages()))
+    assert client.exchange.max_in_flight <= 2
+
+def run_requests(client, nb_requests, timeframe = "1m"):
+    # 同时发出nb_requests个请求，返回结果和耗时。
+    async def run():
+        start = time.monotonic()
+        results = await asyncio.gather(*[client.fetch_ohlcv(symbol = "BTC/USDT", timeframe = timeframe, since = 1674172800000 + i * 60_000_000, limit = 10) for i in range(nb_requests)])
+        return results, time.monotonic() - start
+    return asyncio.run(run())
+
+def test_exchange_client_caps_in_flight_requests():
+    client = downloader.ExchangeClient(FakeExchange(latency= 0.01), rate= 10_000, burst= 100, max_in_flight= 3)
+    results, _ = run_requests(client, 30)
+    assert len(results) == 30
+    # 交易所一侧观察到的最大并发请求数。
+    assert client.exchange.max_in_flight == client.max_observed_in_flight == 3
+
+def test_exchange_client_respects_rate_limit():
+    # 调度器的令牌桶略低于交易所的限速：没有请求被交易所拒绝（max_retries= 0时拒绝会抛出异常），
+    # 除了最初的burst个请求以外，请求按rate的速度发出。
+    rate, burst, nb_requests = 40, 5, 25
+    client = downloader.ExchangeClient(FakeExchange(latency= 0, rate_limit= 50, burst= burst), rate= rate, burst= burst, max_in_flight= nb_requests, max_retries= 0)
+    _, elapsed = run_requests(client, nb_requests)
+    assert client.exchange.nb_rate_limited == 0
+    assert elapsed >= 0.95 * (nb_requests - burst) / rate
+    assert client.rate_limiter.wait_time > 0
+
+def test_token_bucket_spacing():
+    async def run():
+        bucket = downloader.TokenBucket(rate= 100, burst= 3)
+        start, times = time.monotonic(), []
+        for _ in range(10):
+            await bucket.acquire()
+            times.append(time.monotonic() - start)
+        return times
+    times = asyncio.run(run())
+    # 前burst个令牌立即可用，之后每个令牌间隔1 / rate秒。
+    assert times[2] < 0.005
+    for k, t in enumerate(times):
+        assert t >= (k - 2) / 100 - 1e-3
+
+@pytest.mark.parametrize("nb_failures", [0, 2, 3])
+def test_exchange_client_retries_transient_errors(nb_failures):
+    # 前nb_failures个请求失败：重试次数恰好为nb_failures（不超过max_retries= 3）。
+    exchange = FakeExchange(latency= 0)
+    fetch_ohlcv = exchange.fetch_ohlcv
+    async def flaky_fetch_ohlcv(**kwargs):
+        if exchange.nb_errors < nb_failures:
+            exchange.nb_errors += 1
+            raise downloader.ccxt.RequestTimeout("Injected request timeout")
+        return await fetch_ohlcv(**kwargs)
+    exchange.fetch_ohlcv = flaky_fetch_ohlcv
+    client = downloader.ExchangeClient(exchange, rate= 1000, burst= 10, max_retries= 3, retry_delay= 0)
+    result = asyncio.run(client.fetch_ohlcv(symbol = "BTC/USDT", timeframe = "1m", since = 1674172800000, limit = 10))
+    assert len(result) == 10
+    assert client.nb_retries == nb_failures
+    assert client.nb_requests == nb_failures + 1
+
+def test_exchange_client_gives_up_after_max_retries():
+    client = downloader.ExchangeClient(FakeExchange(latency= 0, error_rate= 1), rate= 1000, burst= 10, max_retries= 3, retry_delay= 0)
+    with pytest.raises(downloader.ccxt.RequestTimeout):
+        asyncio.run(client.fetch_ohlcv(symbol = "BTC/USDT", timeframe = "1m", since = 1674172800000, limit = 10))
+    assert client.nb_retries == 3
+    assert client.exchange.nb_requests == client.exchange.nb_errors == 4
+
+def test_exchange_client_does_not_retry_other_errors():
+    exchange = FakeExchange(latency= 0)
+    async def failing_fetch_ohlcv(**kwargs):
+        exchange.nb_requests += 1
+        raise ValueError("Invalid symbol")
+    exchange.fetch_ohlcv = failing_fetch_ohlcv
+    client = downloader.ExchangeClient(exchange, rate= 1000, burst= 10, max_retries= 3, retry_delay= 0)
+    with pytest.raises(ValueError):
+        asyncio.run(client.fetch_ohlcv(symbol = "BTC/USDT", timeframe = "1m", since = 1674172800000, limit = 10))
+    assert client.nb_retries == 0 and exchange.nb_requests == 1
+
+def test_fake_exchange_rejects_requests_above_rate_limit():
+    # 没有调度器时，超过交易所限速的请求以RateLimitExceeded失败（而不是等待）。
+    exchange = FakeExchange(latency= 0, rate_limit= 1, burst= 3)
+    async def run():
+        return await asyncio.gather(*[exchange.fetch_ohlcv("BTC/USDT", "1m", since= 1674172800000, limit= 10) for _ in range(5)], return_exceptions= True)
+    results = asyncio.run(run())
+    assert sum(isinstance(result, downloader.ccxt.RateLimitExceeded) for result in results) == exchange.nb_rate_limited == 2
+    assert exchange.nb_requests == 5
+
+def test_fake_exchange_candles_are_deterministic():
+    # 同一根K线在不同请求中相同；max_limit限制每次返回的K线数；只返回已经开始的K线。
+    since = 1674172800000
+    async def run():
+        exchange = FakeExchange(latency= 0, max_limit= 100, seed= 0)
+        first = await exchange.fetch_ohlcv("BTC/USDT", "1m", since= since, limit= 500)
+        second = await exchange.fetch_ohlcv("BTC/USDT", "1m", since= since + 50 * 60_000, limit= 100)
+        other = await exchange.fetch_ohlcv("ETH/USDT", "1m", since= since, limit= 100)
+        latest = await exchange.fetch_ohlcv("BTC/USDT", "1m", since= int(time.time() * 1000) - 5 * 60_000, limit= 100)
+        return first, second, other, latest
+    first, second, other, latest = asyncio.run(run())
+    assert len(first) == len(second) == 100
+    assert first[50:] == second[:50]
+    assert [candle[0] for candle in first] == list(range(since, since + 100 * 60_000, 60_000))
+    assert first != other
+    assert len(latest) <= 6 and latest[-1][0] <= time.time() * 1000
+
+def test_fake_exchange_error_rate():
+    exchange = FakeExchange(latency= 0, error_rate= 0.3, seed= 0)
+    async def run():
+        return await asyncio.gather(*[exchange.fetch_ohlcv("BTC/USDT", "1m", since= 1674172800000, limit= 10) for _ in range(200)], return_exceptions= True)
+    results = asyncio.run(run())
+    nb_errors = sum(isinstance(result, downloader.ccxt.RequestTimeout) for result in results)
+    assert nb_errors == exchange.nb_errors
+    assert 30 < nb_errors < 90
+    assert exchange.nb_candles == 10 * (200 - nb_errors)
@@ -0,0 +1,25 @@
+import numpy as np
+from gym_trading_env.utils.downsampling import bucket_edges, lttb
+
+def reference_lttb(values, edges):
+    # 直接按定义计算（平均点只使用下一个桶中非NaN的点）。
+    selected = [edges[0]]
+    for i in range(1, len(edges) - 2):
+        following = [(x, values[x]) for x in range(edges[i + 1], edges[i + 2]) if not np.isnan(values[x])]
+        mean_x, mean_y = np.mean(following, axis= 0)
+        previous = selected[-1]
+        areas = [
+            -1 if np.isnan(values[x]) else abs((previous - mean_x) * (values[x] - values[previous]) - (previous - x) * (mean_y - values[previous]))
+            for x in range(edges[i], edges[i + 1])
+        ]
+        selected.append(edges[i] + int(np.argmax(areas)))
+    return np.array(selected + [edges[-1] - 1])
+
+def test_lttb_mean_point_ignores_nan():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size= 400).cumsum()
+    # 部分桶的开头为NaN（例如移动平均线的开头或数据空洞）。
+    for start in range(20, 400, 40):
+        values[start:start + 7] = np.nan
+    edges = bucket_edges(0, len(values), 20)
+    assert np.array_equal(lttb(values, edges), reference_lttb(values, edges))
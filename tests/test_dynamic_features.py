@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from gym_trading_env.environments import TradingEnv
+from gym_trading_env.utils.dynamic_features import PORTFOLIO_FEATURES, PortfolioFeatures, PortfolioFeaturesArray
+
+POSITIONS = [-1, 0, 0.5, 1, 2]
+
+def features_from_history(history):
+    # 内置动态特征的完整重新计算：每一步从History重新扫描整个episode。
+    position, real_position, valuation = history["position"], history["real_position"], history["portfolio_valuation"]
+    changes = np.flatnonzero(position[1:] != position[:-1]) + 1
+    last_change = changes[-1] if len(changes) > 0 else 0
+    # 头寸变化时，以交易时（上一步）的估值作为入场估值。
+    entry_valuation = valuation[last_change - 1] if last_change > 0 else valuation[0]
+    return [
+        position[-1],
+        real_position[-1],
+        valuation[-1] / entry_valuation - 1,
+        len(position) - 1 - last_change,
+        valuation[-1] / valuation.max() - 1,
+    ]
+
+@pytest.mark.parametrize("windows", [None, 3])
+def test_portfolio_features_match_history(df, windows):
+    actions = np.random.default_rng(0).integers(len(POSITIONS), size= 600)
+    # 保持头寸若干步，使time_in_position和unrealized_pnl不总是0。
+    actions = np.repeat(actions, np.random.default_rng(1).integers(1, 6, size= len(actions)))[:600]
+    env = TradingEnv(df, positions= POSITIONS, dynamic_feature_functions= list(PORTFOLIO_FEATURES), windows= windows,
+        trading_fees= 0.01/100, borrow_interest_rate= 0.0003/100, initial_position= 1, verbose= 0)
+    nb_features = len(PORTFOLIO_FEATURES)
+    for _ in range(2):
+        obs, _ = env.reset(seed= 0)
+        for i, action in enumerate(actions):
+            expected = features_from_history(env.historical_info)
+            values = obs[-nb_features:] if windows is None else obs[-1, -nb_features:]
+            np.testing.assert_allclose(values, expected, rtol= 1e-5, atol= 1e-6)
+            obs, _, terminated, truncated, _ = env.fast_forward(max_steps= 10) if i % 50 == 49 else env.step(action)
+            if terminated or truncated: break
+
+@pytest.mark.parametrize("seed", range(3))
+def test_portfolio_features_array_matches_portfolio_features(seed):
+    # 每个环境的状态与一个独立的PortfolioFeatures相同，只有mask为True的环境被重置或更新。
+    rng = np.random.default_rng(seed)
+    num_envs, names = 8, list(PORTFOLIO_FEATURES)
+    features = PortfolioFeaturesArray(names, num_envs)
+    expected = [PortfolioFeatures(names) for _ in range(num_envs)]
+
+    def random_state():
+        return rng.choice(POSITIONS, size= num_envs), rng.uniform(-2, 2, size= num_envs), rng.uniform(500, 1500, size= num_envs)
+
+    position, real_position, valuation = random_state()
+    features.reset(np.ones(num_envs, dtype= bool), position, real_position, valuation)
+    for i, feature in enumerate(expected): feature.reset(position[i], real_position[i], valuation[i])
+    for step in range(300):
+        mask = rng.random(num_envs) < 0.8
+        new_position, real_position, valuation = random_state()
+        # 大部分步保持头寸不变。
+        position = np.where(rng.random(num_envs) < 0.2, new_position, position)
+        if step % 25 == 24:
+            features.reset(mask, position, real_position, valuation)
+            for i in np.flatnonzero(mask): expected[i].reset(position[i], real_position[i], valuation[i])
+        else:
+            features.update(mask, position, real_position, valuation)
+            for i in np.flatnonzero(mask): expected[i].update(position[i], real_position[i], valuation[i])
+        np.testing.assert_allclose(features.values, np.array([feature.values for feature in expected], dtype= np.float32), rtol= 1e-6)
+        np.testing.assert_array_equal(features.time_in_position, [feature.time_in_position for feature in expected])
+        np.testing.assert_array_equal(features.peak_valuation, [feature.peak_valuation for feature in expected])
+        np.testing.assert_array_equal(features.entry_valuation, [feature.entry_valuation for feature in expected])
+
+def test_unknown_portfolio_feature():
+    with pytest.raises(ValueError):
+        PortfolioFeatures(["last_position", "unknown"])
+    with pytest.raises(ValueError):
+        PortfolioFeaturesArray(["unknown"], 4)
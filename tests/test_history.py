@@ -0,0 +1,67 @@
+import numpy as np
+from gym_trading_env.environments import TradingEnv
+from gym_trading_env.utils.history import History
+
+def make_history(ring = False, max_size = 5):
+    history = History(max_size= max_size, ring= ring)
+    history.set(step = 0, value = 0.0)
+    return history
+
+def test_ring_history_infos_do_not_change_when_the_buffer_wraps(df):
+    env = TradingEnv(df= df, positions= [0, 1], history_size= 5, verbose= 0)
+    env.reset(seed= 0)
+    infos = [env.step(i % 2)[4] for i in range(10)]
+    assert [info["step"] for info in infos] == list(range(1, 11))
+    assert [info["position"] for info in infos] == [i % 2 for i in range(10)]
+
+def test_row_view_survives_ring_overwrite():
+    history = make_history(ring= True)
+    view = history.row_view(-1)
+    for step in range(1, 12):
+        history.add(step = step, value = float(step))
+    assert view["step"] == 0 and view["value"] == 0.0
+    assert history["step", 0] == 7
+
+def test_row_view_survives_extend_reserve_and_setitem():
+    history = make_history(ring= True)
+    view = history.row_view(-1)
+    history.extend(step = np.arange(1, 6), value = np.arange(1, 6, dtype= float))
+    assert view["step"] == 0
+
+    history = make_history(max_size= 2)
+    history.add(step = 1, value = 1.0)
+    view = history.row_view(-1)
+    history.reserve(10)
+    history.add(step = 2, value = 2.0)
+    assert view["step"] == 1
+
+    view = history.row_view(-1)
+    history["value", -1] = 5.0
+    assert view["value"] == 2.0
+    assert history["value", -1] == 5.0
+
+def test_row_view_is_lazy_until_needed():
+    history = make_history()
+    history.add(step = 1, value = 1.0)
+    view = history.row_view(-1)
+    assert dict.__len__(view) == 0
+    assert view["step"] == 1
+    assert view == {"step": 1, "value": 1.0}
+
+def test_discarded_row_views_are_not_tracked():
+    # 被丢弃的视图不会留在History._views中（没有环形缓冲区时行永远不会被覆盖）。
+    history = make_history(max_size= 20_000)
+    kept = []
+    for step in range(1, 20_000):
+        history.add(step = step, value = float(step))
+        view = history.row_view(-1)
+        if step % 1000 == 0: kept.append(view)
+    assert len(history._views) == len(kept) + 1
+    assert [view["step"] for view in kept] == list(range(1000, 20_000, 1000))
+
+def test_env_infos_are_not_tracked(df):
+    env = TradingEnv(df= df, positions= [0, 1], verbose= 0)
+    env.reset(seed= 0)
+    for i in range(1000):
+        env.step(i % 2)
+    assert len(env.historical_info._views) <= 1
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from gym_trading_env.environments import TradingEnv, basic_reward_function
+from gym_trading_env.utils.incremental import IncrementalFunction, LogReturnReward, DifferentialSharpeRatioReward
+
+POSITIONS = [-1, 0, 0.5, 1, 2]
+
+class MeanRealPosition(IncrementalFunction):
+    # 测试用的增量动态特征：episode开始以来实际头寸的平均值。
+    columns = ["real_position"]
+    def reset(self, row):
+        self.total, self.count = 0.0, 0
+    def __call__(self, row):
+        self.total += row.real_position
+        self.count += 1
+        return self.total / self.count
+
+def mean_real_position(history):
+    # 同一特征的完整重新计算。
+    return np.mean(history["real_position"])
+
+def differential_sharpe_ratio(history, eta = 0.01):
+    # DifferentialSharpeRatioReward的完整重新计算：每一步从episode开始重新遍历所有收益。
+    valuations = history["portfolio_valuation"]
+    mean, second_moment, reward = 0.0, 0.0, 0.0
+    for log_return in np.log(valuations[1:] / valuations[:-1]):
+        delta_mean, delta_second_moment = log_return - mean, log_return**2 - second_moment
+        variance = second_moment - mean**2
+        reward = (second_moment * delta_mean - 0.5 * mean * delta_second_moment) / variance**1.5 if variance > 1E-12 else 0.0
+        mean += eta * delta_mean
+        second_moment += eta * delta_second_moment
+    return reward
+
+def make_env(df, **kwargs):
+    return TradingEnv(df.iloc[:800], positions= POSITIONS, trading_fees= 0.01/100, borrow_interest_rate= 0.0003/100, initial_position= 1, verbose= 0, **kwargs)
+
+def run_episode(env, actions):
+    # 交替使用step和fast_forward，直到episode结束。返回每步的观察值和奖励。
+    # 观察值可能是环境数组的只读视图：保存副本。
+    observations, rewards = [np.array(env.reset(seed= 0)[0])], []
+    for i, action in enumerate(actions):
+        obs, reward, terminated, truncated, _ = env.fast_forward(max_steps= 20) if i % 10 == 9 else env.step(action)
+        observations.append(np.array(obs))
+        rewards.append(reward)
+        if terminated or truncated: break
+    return observations, rewards
+
+@pytest.mark.parametrize("incremental, reference", [
+    (LogReturnReward(), basic_reward_function),
+    (DifferentialSharpeRatioReward(), differential_sharpe_ratio),
+    (DifferentialSharpeRatioReward(eta = 0.1), lambda history : differential_sharpe_ratio(history, eta = 0.1)),
+], ids = ["log_return", "differential_sharpe_ratio", "differential_sharpe_ratio_eta"])
+def test_incremental_reward_matches_full_recompute(df, incremental, reference):
+    actions = np.random.default_rng(0).integers(len(POSITIONS), size= 1000)
+    env, expected_env = make_env(df, reward_function= incremental), make_env(df, reward_function= reference)
+    # 两个episode：reset需要重置增量状态。
+    for _ in range(2):
+        _, rewards = run_episode(env, actions)
+        _, expected_rewards = run_episode(expected_env, actions)
+        np.testing.assert_allclose(rewards, expected_rewards, rtol= 1e-9, atol= 1e-12)
+        np.testing.assert_allclose(env.historical_info["reward"], expected_env.historical_info["reward"], rtol= 1e-9, atol= 1e-12)
+
+@pytest.mark.parametrize("windows", [None, 5])
+def test_incremental_dynamic_feature_matches_full_recompute(df, windows):
+    # fast_forward跳过的步也要更新增量特征的状态。
+    actions = np.random.default_rng(1).integers(len(POSITIONS), size= 1000)
+    env = make_env(df, windows= windows, dynamic_feature_functions= ["last_position", MeanRealPosition()])
+    expected_env = make_env(df, windows= windows, dynamic_feature_functions= ["last_position", mean_real_position])
+    for _ in range(2):
+        observations, _ = run_episode(env, actions)
+        expected_observations, _ = run_episode(expected_env, actions)
+        assert len(observations) == len(expected_observations)
+        for obs, expected_obs in zip(observations, expected_observations):
+            np.testing.assert_allclose(obs, expected_obs, rtol= 1e-6)
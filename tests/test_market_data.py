@@ -0,0 +1,131 @@
+import json
+import os
+import pickle
+import multiprocessing
+import numpy as np
+import pandas as pd
+import pytest
+from gym_trading_env.environments import TradingEnv
+from gym_trading_env.utils.market_data import MarketData, SharedMarketData, MemmapMarketData, MEMMAP_DATASET_VERSION, is_memmap_dataset, save_memmap_dataset, convert_pickle_datasets
+
+ARRAYS = ["features", "price", "dates", "info"]
+
+@pytest.fixture
+def shared_data(df):
+    data = SharedMarketData(df)
+    yield data
+    data.close()
+    data.unlink()
+
+def assert_same_arrays(data, expected):
+    assert data.features_columns == expected.features_columns
+    assert data.info_columns == expected.info_columns
+    for key in ARRAYS:
+        np.testing.assert_array_equal(getattr(data, key), getattr(expected, key), err_msg= key)
+
+def attach_in_worker(data, queue):
+    # 在子进程中反序列化SharedMarketData：数组是只读的，不能unlink，写入共享内存块对父进程可见。
+    result = {"owner": data._owner, "writeable": any(getattr(data, key).flags.writeable for key in ARRAYS), "price_sum": float(data.price.sum())}
+    try:
+        data.unlink()
+        result["unlink"] = "allowed"
+    except RuntimeError:
+        result["unlink"] = "refused"
+    np.ndarray(data.price.shape, dtype= data.price.dtype, buffer= data._shared_memories["price"].buf)[0] = -1
+    data.close()
+    queue.put(result)
+
+def test_shared_market_data_matches_dataframe(df, shared_data):
+    assert_same_arrays(shared_data, MarketData(df))
+    assert all(not getattr(shared_data, key).flags.writeable for key in ARRAYS)
+
+def test_shared_market_data_pickle_only_sends_names(df, shared_data):
+    payload = pickle.dumps(shared_data)
+    assert len(payload) < 2000 < shared_data.features.nbytes
+    clone = pickle.loads(payload)
+    try:
+        assert not clone._owner
+        assert_same_arrays(clone, shared_data)
+        # 同一块内存：通过创建者的共享内存块写入，反序列化的副本立即可见。
+        np.ndarray(shared_data.price.shape, dtype= shared_data.price.dtype, buffer= shared_data._shared_memories["price"].buf)[1] = -2
+        assert clone.price[1] == -2
+    finally:
+        clone.close()
+
+def test_shared_market_data_attached_by_another_process(shared_data):
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    expected_price_sum = float(shared_data.price.sum())
+    process = context.Process(target= attach_in_worker, args= (shared_data, queue))
+    process.start()
+    result = queue.get(timeout= 60)
+    process.join(timeout= 60)
+    assert result == {"owner": False, "writeable": False, "price_sum": expected_price_sum, "unlink": "refused"}
+    assert shared_data.price[0] == -1
+
+def test_shared_market_data_unlink_requires_owner(shared_data):
+    clone = pickle.loads(pickle.dumps(shared_data))
+    with pytest.raises(RuntimeError):
+        clone.unlink()
+    clone.close()
+
+def test_memmap_dataset_round_trip(df, tmp_path):
+    path = save_memmap_dataset(df, str(tmp_path / "dataset.mmap"))
+    assert is_memmap_dataset(path)
+    data = MemmapMarketData(path)
+    assert_same_arrays(data, MarketData(df))
+    assert isinstance(data.features, np.memmap)
+    # 序列化时只传递路径。
+    payload = pickle.dumps(data)
+    assert len(payload) < 1000
+    assert_same_arrays(pickle.loads(payload), data)
+    # 特征以float32保存。
+    pd.testing.assert_frame_equal(data.to_dataframe(), df[data.info_columns + data.features_columns], check_names= False, check_freq= False, check_dtype= False)
+
+def test_memmap_dataset_version_mismatch(df, tmp_path):
+    path = save_memmap_dataset(df, str(tmp_path / "dataset.mmap"))
+    metadata_path = os.path.join(path, "metadata.json")
+    with open(metadata_path) as file: metadata = json.load(file)
+    metadata["version"] = MEMMAP_DATASET_VERSION + 1
+    with open(metadata_path, "w") as file: json.dump(metadata, file)
+    with pytest.raises(ValueError, match= "version"):
+        MemmapMarketData(path)
+
+def test_convert_pickle_datasets(df, tmp_path):
+    df.iloc[:500].to_pickle(tmp_path / "A.pkl")
+    df.iloc[500:].to_pickle(tmp_path / "B.pkl")
+    output_dir = tmp_path / "mmap"
+    def preprocess(df):
+        df = df.copy()
+        df["feature_double"] = 2 * df["feature_close"]
+        return df
+    pathes = convert_pickle_datasets(str(tmp_path / "*.pkl"), output_dir= str(output_dir), preprocess= preprocess)
+    assert sorted(pathes) == [str(output_dir / "A.mmap"), str(output_dir / "B.mmap")]
+    assert_same_arrays(MemmapMarketData(output_dir / "A.mmap"), MarketData(preprocess(df.iloc[:500])))
+    assert_same_arrays(MemmapMarketData(output_dir / "B.mmap"), MarketData(preprocess(df.iloc[500:])))
+
+@pytest.mark.parametrize("windows", [None, 5])
+@pytest.mark.parametrize("kind", ["market_data", "shared", "memmap"])
+def test_env_with_market_data_matches_dataframe(df, tmp_path, kind, windows):
+    # 同样的动作序列：使用DataFrame和MarketData的环境给出相同的观察值、奖励和History。
+    if kind == "market_data": data = MarketData(df)
+    elif kind == "shared": data = SharedMarketData(df)
+    else: data = MemmapMarketData(save_memmap_dataset(df, str(tmp_path / "dataset.mmap")))
+    kwargs = dict(positions= [-1, 0, 0.5, 1, 2], windows= windows, trading_fees= 0.01/100, borrow_interest_rate= 0.0003/100, initial_position= 1, verbose= 0)
+    env, expected_env = TradingEnv(data, **kwargs), TradingEnv(df, **kwargs)
+    try:
+        obs, _ = env.reset(seed= 0)
+        expected_obs, _ = expected_env.reset(seed= 0)
+        np.testing.assert_array_equal(obs, expected_obs)
+        for action in np.random.default_rng(0).integers(5, size= 300):
+            obs, reward, terminated, truncated, info = env.step(action)
+            expected_obs, expected_reward, expected_terminated, expected_truncated, expected_info = expected_env.step(action)
+            np.testing.assert_array_equal(obs, expected_obs)
+            assert (reward, terminated, truncated) == (expected_reward, expected_terminated, expected_truncated)
+        for column in expected_env.historical_info.columns:
+            np.testing.assert_array_equal(env.historical_info[column], expected_env.historical_info[column], err_msg= column)
+    finally:
+        if kind == "shared":
+            del env
+            data.close()
+            data.unlink()
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+from gym_trading_env.environments import MultiAssetTradingEnv
+
+@pytest.fixture
+def dfs(df):
+    return {"BTC": df, "ETH": df.assign(close = df["close"] / 10)}
+
+@pytest.mark.parametrize("initial_position", [[0.5, 0.5], np.array([0.5, 0.5]), (0.5, 0.5)])
+def test_initial_position_accepts_sequences_and_arrays(dfs, initial_position):
+    env = MultiAssetTradingEnv(dfs= dfs, initial_position= initial_position, verbose= 0)
+    env.reset(seed= 0)
+    assert np.array_equal(env._position, [0.5, 0.5])
+
+def test_random_initial_position(dfs):
+    positions = [[0, 0], [1, 0], [0, 1]]
+    env = MultiAssetTradingEnv(dfs= dfs, positions= positions, initial_position= 'random', verbose= 0)
+    env.reset(seed= 0)
+    assert env._position.tolist() in positions
+
+@pytest.mark.parametrize("initial_position, positions", [
+    ([0.5, 0.5, 0], None), # 权重数量错误
+    ([1.5, 0], None), # 超出weight_bounds
+    ('all-in', None),
+    ('random', None), # 需要positions
+])
+def test_invalid_initial_position(dfs, initial_position, positions):
+    with pytest.raises(ValueError):
+        MultiAssetTradingEnv(dfs= dfs, positions= positions, initial_position= initial_position, verbose= 0)
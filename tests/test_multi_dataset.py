@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import pytest
+from gym_trading_env.environments import MultiDatasetTradingEnv
+
+@pytest.fixture
+def dataset_dir(tmp_path, df):
+    df.iloc[:1000].to_pickle(tmp_path / "A.pkl")
+    df.iloc[1000:].to_pickle(tmp_path / "B.pkl")
+    return str(tmp_path / "*.pkl")
+
+@pytest.mark.parametrize("info_dtype", [None, np.float64])
+def test_prefetch_keeps_dataset_representation(dataset_dir, info_dtype):
+    # 预加载只改变数据集加载的时间，环境使用的数据与同步加载时相同。
+    envs = [
+        MultiDatasetTradingEnv(dataset_dir= dataset_dir, dataset_prefetch_depth= depth, info_columns= ["close", "volume"], info_dtype= info_dtype, verbose= 0)
+        for depth in (0, 1)
+    ]
+    for _ in range(3):
+        for env in envs: env.reset(seed= 0)
+        synchronous, prefetched = envs
+        assert isinstance(prefetched.df, pd.DataFrame)
+        assert prefetched._info_array.dtype == synchronous._info_array.dtype
+        assert prefetched._info_columns == synchronous._info_columns == ["close", "volume"]
+        assert prefetched._features_columns == synchronous._features_columns
+    for env in envs: env.close()
+
+@pytest.mark.parametrize("info_dtype", [None, np.float64])
+def test_preprocess_cache_keeps_dataset_representation(dataset_dir, tmp_path, info_dtype):
+    # 预处理缓存（内存映射数据集）不改变环境提供的数据：info_columns、info_dtype和keep_df同样生效。
+    envs = [
+        MultiDatasetTradingEnv(dataset_dir= dataset_dir.replace("*", "A"), preprocess_cache_dir= cache_dir, info_columns= ["close"], info_dtype= info_dtype, initial_position= 0, verbose= 0)
+        for cache_dir in (None, str(tmp_path / "cache"))
+    ]
+    for _ in range(3):
+        for env in envs: env.reset(seed= 0)
+        uncached, cached = envs
+        assert cached._info_columns == uncached._info_columns == ["close"]
+        # 缓存的结构化数组只是所选字段的视图（不复制数据），字段和值相同。
+        assert cached._info_array.dtype.names == uncached._info_array.dtype.names
+        assert np.array_equal(cached._get_info_column(0, slice(None)), uncached._get_info_column(0, slice(None)))
+        assert np.array_equal(cached._get_obs(), uncached._get_obs())
+        assert cached.historical_info.columns == uncached.historical_info.columns
+        # env.df从内存映射数组重新构建（特征为float32，字符串为定长unicode）。
+        pd.testing.assert_frame_equal(cached.df[list(uncached.df.columns)], uncached.df, check_names= False, check_dtype= False, check_freq= False)
+        for action in [1, 0, 1]:
+            assert np.array_equal(cached.step(action)[0], uncached.step(action)[0])
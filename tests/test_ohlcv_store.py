@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+from gym_trading_env.utils.ohlcv_store import OHLCVStore
+
+MINUTE = 60_000
+SINCE = int(pd.Timestamp("2023-01-01").value // 10**6)
+
+def candles(first, stop):
+    timestamps = np.arange(first, stop, MINUTE)
+    return pd.DataFrame({"close": np.ones(len(timestamps))}, index= pd.to_datetime(timestamps, unit= "ms"))
+
+def test_missing_ranges_without_covered(tmp_path):
+    store = OHLCVStore(tmp_path / "store")
+    store.write(candles(SINCE + 100 * MINUTE, SINCE + 200 * MINUTE))
+    assert store.missing_ranges(SINCE, SINCE + 300 * MINUTE, MINUTE) == [
+        (SINCE, SINCE + 100 * MINUTE),
+        (SINCE + 200 * MINUTE, SINCE + 300 * MINUTE),
+    ]
+
+def test_covered_ranges_are_not_missing(tmp_path):
+    # 交易所在 [SINCE, SINCE + 100min) 没有K线（上市之前）：该区间被请求过后不再返回。
+    store = OHLCVStore(tmp_path / "store")
+    store.write(candles(SINCE + 100 * MINUTE, SINCE + 200 * MINUTE), covered= [(SINCE, SINCE + 200 * MINUTE)])
+    assert store.missing_ranges(SINCE, SINCE + 300 * MINUTE, MINUTE) == [(SINCE + 200 * MINUTE, SINCE + 300 * MINUTE)]
+    # 没有K线时也记录（例如交易所故障期间）。
+    store.write(candles(0, 0), covered= [(SINCE + 200 * MINUTE, SINCE + 250 * MINUTE)])
+    assert store.missing_ranges(SINCE, SINCE + 300 * MINUTE, MINUTE) == [(SINCE + 250 * MINUTE, SINCE + 300 * MINUTE)]
+    # 区间保存在store.json中，并被合并。
+    reopened = OHLCVStore(tmp_path / "store")
+    assert reopened.covered == [[SINCE, SINCE + 250 * MINUTE]]
+    assert reopened.missing_ranges(SINCE, SINCE + 300 * MINUTE, MINUTE) == [(SINCE + 250 * MINUTE, SINCE + 300 * MINUTE)]
@@ -0,0 +1,17 @@
+from gym_trading_env.environments import TradingEnv
+
+def test_new_order_replaces_order_at_same_position(df):
+    env = TradingEnv(df, positions= [0, 1], initial_position= 0, verbose= 0)
+    env.reset(seed= 0)
+    close = env._get_price()
+    first = env.add_limit_order(position= 1, limit= close * 0.5)
+    env.add_limit_order(position= 1, limit= close * 0.6)
+    assert len(env._orders) == 1
+    assert not env.cancel_order(first)
+    # 止损单和限价单分别替换：同一头寸的止损单不会取消限价单。
+    env.add_stop_order(position= 1, stop= close * 2)
+    env.add_stop_order(position= 1, stop= close * 3)
+    assert len(env._orders) == 2
+    # 不同头寸的订单同时存在。
+    env.add_limit_order(position= 0, limit= close * 0.7)
+    assert len(env._orders) == 3
@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+from gym_trading_env.utils.portfolio import Portfolio, TargetPortfolio, PortfolioArray, TargetPortfolioArray, simulate_positions
+
+POSITIONS = [-3, -1, -0.5, 0, 0.5, 1, 1.5, 2, 3]
+
+def reference(portfolio, prices, positions, current_position, trading_fees, borrow_interest_rate):
+    # 与TradingEnv.step相同的逐步循环。
+    states = []
+    for k, position in enumerate(positions):
+        if position != current_position:
+            portfolio.trade_to_position(position, price = prices[k], trading_fees = trading_fees)
+            current_position = position
+        portfolio.update_interest(borrow_interest_rate = borrow_interest_rate)
+        states.append([portfolio.asset, portfolio.fiat, portfolio.interest_asset, portfolio.interest_fiat])
+        if portfolio.valorisation(prices[k + 1]) <= 0: break
+    return np.array(states, dtype= np.float64).reshape(-1, 4).T
+
+def random_scenario(seed, nb_steps = 500, crash = False):
+    rng = np.random.default_rng(seed)
+    prices = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, nb_steps + 1)))
+    if crash: prices[nb_steps // 2:] *= 0.01
+    # 每个头寸保持若干步，混合有交易和没有交易的步。
+    positions = np.repeat(rng.choice(POSITIONS, size= nb_steps), rng.integers(1, 5, size= nb_steps))[:nb_steps].astype(np.float64)
+    return prices, positions
+
+def check_parity(use_numba, prices, positions, initial_position, portfolio_factory, trading_fees = 0.001, borrow_interest_rate = 0.001):
+    expected_portfolio = portfolio_factory()
+    expected = reference(expected_portfolio, prices, positions, initial_position, trading_fees, borrow_interest_rate)
+    portfolio = portfolio_factory()
+    states = simulate_positions(portfolio, prices, positions, initial_position, trading_fees, borrow_interest_rate, use_numba = use_numba)
+    for state, expected_state in zip(states, expected):
+        assert np.array_equal(state, expected_state)
+    assert (portfolio.asset, portfolio.fiat, portfolio.interest_asset, portfolio.interest_fiat) == \
+        (expected_portfolio.asset, expected_portfolio.fiat, expected_portfolio.interest_asset, expected_portfolio.interest_fiat)
+    return len(states[0])
+
+@pytest.fixture(params = [False, True], ids = ["python", "numba"])
+def use_numba(request):
+    if request.param: pytest.importorskip("numba")
+    return request.param
+
+@pytest.mark.parametrize("seed", range(10))
+def test_simulate_positions_matches_target_portfolio(use_numba, seed):
+    prices, positions = random_scenario(seed)
+    initial_position = POSITIONS[seed % len(POSITIONS)]
+    check_parity(use_numba, prices, positions, initial_position, lambda : TargetPortfolio(initial_position, 1000, prices[0]))
+
+@pytest.mark.parametrize("seed", range(5))
+def test_simulate_positions_matches_portfolio_with_interests(use_numba, seed):
+    prices, positions = random_scenario(seed)
+    # 已有利息的投资组合（借入资产和法币）。
+    check_parity(use_numba, prices, positions, 0.5, lambda : Portfolio(asset = 5, fiat = -200, interest_asset = 0.1, interest_fiat = 3), borrow_interest_rate = 0.01)
+
+def test_simulate_positions_interest_reduction(use_numba):
+    # 减少空头头寸，然后减少杠杆多头头寸：interest_reduction_ratio < 1 的分支。
+    prices = np.full(8, 100.0)
+    positions = np.array([-2, -2, -1, -0.5, 3, 3, 1.5])
+    check_parity(use_numba, prices, positions, 0, lambda : TargetPortfolio(0, 1000, prices[0]), borrow_interest_rate = 0.05)
+
+@pytest.mark.parametrize("seed", range(5))
+def test_simulate_positions_bankruptcy(use_numba, seed):
+    prices, _ = random_scenario(seed, crash = True)
+    positions = np.full(len(prices) - 1, 3.0)
+    nb_steps = check_parity(use_numba, prices, positions, 0, lambda : TargetPortfolio(0, 1000, prices[0]))
+    assert nb_steps < len(positions)
+
+def assert_same_portfolios(portfolios, expected):
+    for attribute in ("asset", "fiat", "interest_asset", "interest_fiat"):
+        assert np.array_equal(getattr(portfolios, attribute), [getattr(portfolio, attribute) for portfolio in expected]), attribute
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("shared_price", [True, False], ids = ["shared_price", "price_per_portfolio"])
+def test_portfolio_array_matches_portfolio(seed, shared_price):
+    # 每个投资组合有自己的随机头寸序列：PortfolioArray与逐个计算的Portfolio完全一致。
+    rng = np.random.default_rng(seed)
+    nb_portfolios, nb_steps = 16, 200
+    initial_positions = rng.choice(POSITIONS, size= nb_portfolios)
+    prices = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, (nb_steps + 1, 1 if shared_price else nb_portfolios)), axis= 0))
+    prices = prices[:, 0] if shared_price else prices
+    portfolios = TargetPortfolioArray(initial_positions, 1000, prices[0])
+    expected = [TargetPortfolio(initial_positions[i], 1000, prices[0] if shared_price else prices[0, i]) for i in range(nb_portfolios)]
+    assert_same_portfolios(portfolios, expected)
+
+    current_positions = initial_positions.copy()
+    for k in range(nb_steps):
+        positions = np.where(rng.random(nb_portfolios) < 0.3, rng.choice(POSITIONS, size= nb_portfolios), current_positions)
+        # 与VectorTradingEnv相同：只有头寸变化的投资组合交易。
+        mask = positions != current_positions
+        price = prices[k]
+        portfolios.trade_to_position(positions, price = price, trading_fees = 0.001, mask = mask)
+        for i, portfolio in enumerate(expected):
+            if mask[i]: portfolio.trade_to_position(positions[i], price = price if shared_price else price[i], trading_fees = 0.001)
+        current_positions = positions
+        portfolios.update_interest(borrow_interest_rate = 0.001)
+        for portfolio in expected: portfolio.update_interest(borrow_interest_rate = 0.001)
+        assert_same_portfolios(portfolios, expected)
+
+        next_price = prices[k + 1]
+        next_prices = [next_price if shared_price else next_price[i] for i in range(nb_portfolios)]
+        assert np.array_equal(portfolios.valorisation(next_price), [portfolio.valorisation(p) for portfolio, p in zip(expected, next_prices)])
+        assert np.array_equal(portfolios.real_position(next_price), [portfolio.real_position(p) for portfolio, p in zip(expected, next_prices)])
+        assert np.array_equal(portfolios.position(next_price), [portfolio.position(p) for portfolio, p in zip(expected, next_prices)])
+
+    distribution = portfolios.get_portfolio_distribution()
+    for i, portfolio in enumerate(expected):
+        assert {key : value[i] for key, value in distribution.items()} == portfolio.get_portfolio_distribution()
+        assert portfolios[i].__dict__ == portfolio.__dict__
+
+def test_portfolio_array_interest_reduction():
+    # 减少空头和杠杆多头头寸时偿还的利息（interest_reduction_ratio < 1 的分支），与Portfolio逐个计算一致。
+    positions = np.array([[-2, 3, -1, 2], [-1, 1.5, 0, 3], [-0.5, 2, -2, 1], [0, 1, 1, 1]])
+    portfolios = TargetPortfolioArray(positions[0], 1000, 100.0)
+    expected = [TargetPortfolio(position, 1000, 100.0) for position in positions[0]]
+    for target in positions[1:]:
+        portfolios.update_interest(borrow_interest_rate = 0.05)
+        for portfolio in expected: portfolio.update_interest(borrow_interest_rate = 0.05)
+        portfolios.trade_to_position(target, price = 100.0, trading_fees = 0.001)
+        for portfolio, position in zip(expected, target): portfolio.trade_to_position(position, price = 100.0, trading_fees = 0.001)
+        assert_same_portfolios(portfolios, expected)
+
+def test_portfolio_array_broadcasts_scalars():
+    portfolios = PortfolioArray(asset = [1.0, 2.0], fiat = 100)
+    assert len(portfolios) == 2
+    assert np.array_equal(portfolios.fiat, [100, 100]) and np.array_equal(portfolios.interest_asset, [0, 0])
@@ -0,0 +1,50 @@
+import functools
+import numpy as np
+from gym_trading_env.utils.preprocess_cache import function_hash, PreprocessCache
+
+def _make_scaler(factor):
+    def scale(df):
+        return df * factor
+    return scale
+
+def _helper(df):
+    return df + 1
+
+def _uses_helper(df):
+    return _helper(df)
+
+def _add(df, value):
+    return df + value
+
+def test_function_hash_is_stable():
+    assert function_hash(_uses_helper) == function_hash(_uses_helper)
+    assert function_hash(np.log) == function_hash(np.log)
+
+def test_function_hash_closure():
+    # 代码相同但闭包变量不同。
+    assert function_hash(_make_scaler(2)) != function_hash(_make_scaler(3))
+    assert function_hash(_make_scaler(2)) == function_hash(_make_scaler(2))
+
+def test_function_hash_referenced_helper(monkeypatch):
+    before = function_hash(_uses_helper)
+    monkeypatch.setitem(globals(), "_helper", lambda df : df + 2)
+    assert function_hash(_uses_helper) != before
+
+def test_function_hash_partial():
+    # partial对象的repr包含内存地址：哈希值应只取决于函数和参数。
+    assert function_hash(functools.partial(_add, value= 1)) == function_hash(functools.partial(_add, value= 1))
+    assert function_hash(functools.partial(_add, value= 1)) != function_hash(functools.partial(_add, value= 2))
+
+def test_function_hash_callable_object():
+    class Preprocess:
+        def __call__(self, df):
+            return df
+    assert function_hash(Preprocess()) == function_hash(Preprocess())
+
+def test_preprocess_key(tmp_path):
+    dataset = tmp_path / "data.pkl"
+    dataset.write_bytes(b"0")
+    cache = PreprocessCache(tmp_path / "cache", preprocess_key= "v1")
+    assert cache.key(dataset, _make_scaler(2)) == cache.key(dataset, _make_scaler(3))
+    assert cache.key(dataset, _helper) != PreprocessCache(tmp_path / "cache", preprocess_key= "v2").key(dataset, _helper)
+    assert cache.key(dataset, _helper) != PreprocessCache(tmp_path / "cache").key(dataset, _helper)
@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("pyecharts")
+from gym_trading_env.renderer import Renderer
+
+def render_log(length):
+    close = np.linspace(100, 200, length)
+    return pd.DataFrame({
+        "open": close, "high": close, "low": close, "close": close, "volume": np.ones(length),
+        "portfolio_valuation": close, "position": np.zeros(length), "reward": np.zeros(length),
+    }, index= pd.date_range("2023", periods= length, freq= "h"))
+
+def test_window_uses_the_loaded_render_log(tmp_path):
+    render_log(100).to_pickle(tmp_path / "a.pkl")
+    render_log(300).to_pickle(tmp_path / "b.pkl")
+    renderer = Renderer(str(tmp_path))
+    a = renderer.load("a.pkl")
+    # 另一个请求加载了其他渲染日志：之前取得的渲染日志不受影响。
+    renderer.load("b.pkl")
+    assert renderer.name == "b.pkl"
+    dates, data, info = renderer.window(0, 100, loaded= a)
+    assert info["length"] == 100 and len(dates) == len(data["close"]) == 100
+    assert renderer.window(0, 300)[2]["length"] == 300
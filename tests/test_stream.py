@@ -0,0 +1,78 @@
+import queue
+import numpy as np
+import pytest
+from gym_trading_env.environments import TradingEnv, StreamingTradingEnv
+from gym_trading_env.utils.stream import GrowableArray, dataframe_feed
+
+POSITIONS = [-1, 0, 0.5, 1, 2]
+NB_BARS = 300
+
+def test_growable_array_matches_concatenate():
+    rng = np.random.default_rng(0)
+    chunks = [rng.normal(size= (size, 3)).astype(np.float32) for size in rng.integers(0, 20, size= 50)]
+    array = GrowableArray(chunks[0], capacity= 4)
+    for chunk in chunks[1:]:
+        array.append(chunk)
+        assert len(array._buffer) >= array.size
+    np.testing.assert_array_equal(array.array, np.concatenate(chunks))
+    # 容量翻倍：扩容次数为对数级。
+    assert len(array._buffer) < 2 * array.size + 4
+
+def test_growable_array_promotes_structured_dtype():
+    array = GrowableArray(np.array([(1.0, "BTC")], dtype= [("close", "f8"), ("symbol", "U3")]))
+    array.append(np.array([(2.0, "DOGE/USD")], dtype= [("close", "f8"), ("symbol", "U8")]))
+    assert array.array["symbol"].tolist() == ["BTC", "DOGE/USD"]
+    assert array.array["close"].tolist() == [1.0, 2.0]
+
+def make_feed(df, kind):
+    if kind == "dataframe": return dataframe_feed(df)
+    if kind == "chunks": return dataframe_feed(df, chunk_size= 7)
+    if kind == "series": return (row for _, row in df.iterrows())
+    if kind == "dict": return ({"date": date, **row.to_dict()} for date, row in df.iterrows())
+    feed = queue.Queue()
+    for _, bars in df.groupby(np.arange(len(df)) // 5): feed.put(bars)
+    feed.put(None)
+    return feed
+
+@pytest.mark.parametrize("windows", [None, 5])
+@pytest.mark.parametrize("kind", ["dataframe", "chunks", "series", "dict", "queue"])
+def test_streaming_env_matches_trading_env(df, kind, windows):
+    # K线逐步到达：与在完整DataFrame上的TradingEnv相同，只是截断晚一步（数据源结束时才知道最后一根K线是结尾）。
+    df = df.iloc[:NB_BARS]
+    warmup = 1 if windows is None else windows
+    kwargs = dict(positions= POSITIONS, windows= windows, trading_fees= 0.01/100, borrow_interest_rate= 0.0003/100, initial_position= 1, verbose= 0)
+    env = StreamingTradingEnv(feed= make_feed(df.iloc[warmup:], kind), df= df.iloc[:warmup], capacity= 8, **kwargs)
+    expected_env = TradingEnv(df, **kwargs)
+    obs, _ = env.reset(seed= 0)
+    expected_obs, _ = expected_env.reset(seed= 0)
+    np.testing.assert_array_equal(obs, expected_obs)
+
+    actions = np.random.default_rng(0).integers(len(POSITIONS), size= NB_BARS)
+    for step, action in enumerate(actions):
+        obs, reward, terminated, truncated, info = env.step(action)
+        expected_obs, expected_reward, expected_terminated, expected_truncated, _ = expected_env.step(action)
+        np.testing.assert_array_equal(obs, expected_obs)
+        assert (reward, terminated) == (expected_reward, expected_terminated)
+        assert not truncated
+        if expected_truncated: break
+    assert step == NB_BARS - warmup - 1
+
+    # 数据源结束：下一步被截断，不再前进。
+    obs, reward, terminated, truncated, info = env.step(actions[0])
+    assert (reward, terminated, truncated) == (0, False, True)
+    np.testing.assert_array_equal(obs, expected_obs)
+    assert info["step"] == expected_env.historical_info["step", -1]
+    for column in expected_env.historical_info.columns:
+        np.testing.assert_array_equal(env.historical_info[column], expected_env.historical_info[column], err_msg= column)
+
+def test_streaming_env_append_without_feed(df):
+    # 没有数据源时，用append添加K线：与TradingEnv相同，到达最后一根K线时截断。
+    env = StreamingTradingEnv(df= df.iloc[:1], positions= POSITIONS, initial_position= 1, verbose= 0)
+    env.reset(seed= 0)
+    assert env.step(1)[3]
+    env = StreamingTradingEnv(df= df.iloc[:1], positions= POSITIONS, initial_position= 1, verbose= 0)
+    env.reset(seed= 0)
+    env.append(df.iloc[1:3])
+    env.append(df.iloc[3])
+    assert [env.step(1)[3] for _ in range(4)] == [False, False, True, True]
+    assert env.historical_info["idx", -1] == 3
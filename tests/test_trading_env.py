@@ -0,0 +1,13 @@
+import numpy as np
+from gym_trading_env.environments import TradingEnv, NO_POSITION_INDEX
+
+def test_position_index_without_action_is_int64(df):
+    # 没有动作的步（step()和fast_forward跳过的步）记录为NO_POSITION_INDEX，列不会变为object类型。
+    env = TradingEnv(df, positions= [0, 1], initial_position= 0, verbose= 0)
+    env.reset(seed= 0)
+    env.step()
+    env.step(1)
+    env.fast_forward(max_steps= 5)
+    position_index = env.historical_info["position_index"]
+    assert position_index.dtype == np.int64
+    assert position_index.tolist() == [0, NO_POSITION_INDEX, 1] + [NO_POSITION_INDEX] * 5
@@ -0,0 +1,62 @@
+import gymnasium as gym
+import numpy as np
+import gym_trading_env
+from gym_trading_env.environments import TradingEnv, VectorTradingEnv
+
+POSITIONS = [-1, 0, 0.5, 1, 2]
+
+def make_kwargs(**kwargs):
+    return dict(positions= POSITIONS, windows= 5, trading_fees= 0.01/100, borrow_interest_rate= 0.0003/100, initial_position= 1, **kwargs)
+
+def test_vector_env_matches_independent_envs(df):
+    # 每个子环境与一个独立的TradingEnv逐步比较，包括截断后的NEXT_STEP自动重置。
+    df = df.iloc[:60]
+    num_envs = 3
+    envs = VectorTradingEnv(df, num_envs= num_envs, **make_kwargs())
+    single_envs = [TradingEnv(df, verbose= 0, **make_kwargs()) for _ in range(num_envs)]
+
+    obs, info = envs.reset(seed= 0)
+    for i, env in enumerate(single_envs):
+        single_obs, _ = env.reset(seed= 0)
+        np.testing.assert_allclose(obs[i], single_obs, rtol= 1e-6)
+
+    rng = np.random.default_rng(0)
+    autoreset = np.zeros(num_envs, dtype= bool)
+    nb_autoresets = 0
+    for _ in range(150):
+        actions = rng.integers(len(POSITIONS), size= num_envs)
+        obs, reward, terminated, truncated, info = envs.step(actions)
+        for i, env in enumerate(single_envs):
+            if autoreset[i]:
+                # 上一步结束的子环境被重置：忽略动作，奖励为0。
+                single_obs, _ = env.reset(seed= 0)
+                single_reward, single_terminated, single_truncated = 0, False, False
+                nb_autoresets += 1
+            else:
+                single_obs, single_reward, single_terminated, single_truncated, _ = env.step(actions[i])
+            np.testing.assert_allclose(obs[i], single_obs, rtol= 1e-5, atol= 1e-7)
+            np.testing.assert_allclose(reward[i], single_reward, rtol= 1e-9, atol= 1e-12)
+            assert terminated[i] == single_terminated
+            assert truncated[i] == single_truncated
+            np.testing.assert_allclose(info["portfolio_valuation"][i], env.historical_info["portfolio_valuation", -1])
+        autoreset = terminated | truncated
+    assert nb_autoresets >= num_envs
+
+def test_vector_env_window_is_zero_padded(df):
+    # 与TradingEnv相同：episode开始之前的动态特征窗口行为0。
+    envs = VectorTradingEnv(df.iloc[:60], num_envs= 2, **make_kwargs())
+    env = TradingEnv(df.iloc[:60], verbose= 0, **make_kwargs())
+    obs, _ = envs.reset(seed= 0)
+    single_obs, _ = env.reset(seed= 0)
+    np.testing.assert_array_equal(obs[:, :-1, -2:], 0)
+    np.testing.assert_allclose(obs[0], single_obs, rtol= 1e-6)
+
+def test_make_vec(df):
+    # 通过gym.make_vec创建已注册的VectorTradingEnv。
+    envs = gym.make_vec("VectorTradingEnv", num_envs= 4, df= df, positions= [0, 1], initial_position= 0)
+    assert isinstance(envs.unwrapped, VectorTradingEnv)
+    obs, info = envs.reset(seed= 0)
+    assert obs.shape == envs.observation_space.shape
+    obs, reward, terminated, truncated, info = envs.step(envs.action_space.sample())
+    assert reward.shape == terminated.shape == truncated.shape == (4,)
+    envs.close()